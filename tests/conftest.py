@@ -0,0 +1,15 @@
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mcp-graphql.py')
+
+
+@pytest.fixture(scope='session')
+def mg():
+    """以模块方式加载 mcp-graphql.py（文件名含连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location('mcp_graphql', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
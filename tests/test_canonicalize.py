@@ -0,0 +1,35 @@
+def test_whitespace_commas_and_comments_are_ignored(mg):
+    a = 'query { user(id: 1) { name } }'
+    b = 'query {\n  user(id: 1), # 注释\n  { name }\n}'
+    assert mg.canonicalize_payload(a) == mg.canonicalize_payload(b)
+
+
+def test_argument_and_input_field_order_is_ignored(mg):
+    a = 'mutation { login(username: "a", password: "b", opts: {x: 1, y: 2}) { __typename } }'
+    b = 'mutation { login(opts: {y: 2, x: 1}, password: "b", username: "a") { __typename } }'
+    assert mg.canonicalize_payload(a) == mg.canonicalize_payload(b)
+
+
+def test_aliases_are_dropped_but_argument_values_are_kept(mg):
+    assert mg.canonicalize_payload('{ u: user(id: 1) { n: name } }') == \
+        mg.canonicalize_payload('query { user(id: 1) { name } }')
+    assert mg.canonicalize_payload('{ user(id: 1) { name } }') != \
+        mg.canonicalize_payload('{ user(id: 2) { name } }')
+
+
+def test_fingerprint_includes_variables(mg):
+    payload = 'query Q($id: ID) { user(id: $id) { name } }'
+    assert mg.payload_fingerprint(payload, {'id': 1, 'x': 2}) == mg.payload_fingerprint(payload, {'x': 2, 'id': 1})
+    assert mg.payload_fingerprint(payload, {'id': 1}) != mg.payload_fingerprint(payload, {'id': 2})
+    assert mg.payload_fingerprint(payload) != mg.payload_fingerprint(payload, {'id': 1})
+
+
+def test_deduplicator_release_allows_retest(mg):
+    dedup = mg.PayloadDeduplicator()
+    payload = '{ user(id: 1) { name } }'
+    assert dedup.reserve(payload)
+    assert not dedup.reserve('query { user(id: 1) { name } }')
+    dedup.release(payload)
+    assert dedup.reserve(payload)
+    dedup.record(payload, {'payload': payload})
+    assert dedup.lookup('{ a: user(id: 1) { name } }') is not None
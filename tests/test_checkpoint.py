@@ -0,0 +1,60 @@
+def make_result(payload, **extra):
+    return dict({'type': 'SQLi', 'payload': payload, 'original_payload': payload, 'status_code': 200,
+                 'vulnerable': False}, **extra)
+
+
+def test_missing_file_loads_as_none(mg, tmp_path):
+    assert mg.ScanCheckpoint(str(tmp_path / 'none.jsonl')).load() is None
+
+
+def test_replay_keeps_last_record_per_payload(mg, tmp_path):
+    path = str(tmp_path / 'scan.checkpoint.jsonl')
+    checkpoint = mg.ScanCheckpoint(path)
+    checkpoint.open({'target': 'http://example/graphql'})
+    checkpoint.write_result('query:sqli', make_result('{ user(id: 1) { name } }'), '{"data": {}}')
+    checkpoint.write_result('query:sqli', make_result('query { user(id: 1) { name } }', vulnerable=True,
+                                                      analysis='final'), '{"data": {}}')
+    checkpoint.write_result('query:sqli', make_result('{ user(id: 2) { name } }'), failed=True)
+    checkpoint.write_round('query:sqli', 1, novelty=0.5)
+    checkpoint.write_round('query:sqli', 2, novelty=0.1)
+    checkpoint.write_result('mutation', make_result('{ user(id: 3) { name } }', grammar='sql'), 'x' * 10000)
+    checkpoint.write_session_done('query:sqli')
+    checkpoint.close()
+
+    state = mg.ScanCheckpoint(path).load()
+    assert state['meta']['target'] == 'http://example/graphql'
+    results = state['results']
+    assert len(results) == 3
+    session, result, response_text, failed = results[0]
+    # 等价 Payload 的后一条记录（本轮分析后的最终结果）覆盖验证时写入的记录
+    assert (session, result['analysis'], result['vulnerable'], failed) == ('query:sqli', 'final', True, False)
+    assert results[1][3] is True
+    assert len(results[2][2]) == mg.ScanCheckpoint.RESPONSE_LIMIT
+    assert state['sessions'] == {'query:sqli': {'round': 2, 'novelty': [0.5, 0.1], 'done': True}}
+
+
+def test_truncated_last_line_is_ignored(mg, tmp_path):
+    path = tmp_path / 'scan.checkpoint.jsonl'
+    checkpoint = mg.ScanCheckpoint(str(path))
+    checkpoint.open({'target': 't'})
+    checkpoint.write_result('s', make_result('{ a }'))
+    checkpoint.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"kind": "result", "session": "s", "res')
+
+    state = mg.ScanCheckpoint(str(path)).load()
+    assert len(state['results']) == 1
+
+
+def test_resume_appends_without_new_meta(mg, tmp_path):
+    path = str(tmp_path / 'scan.checkpoint.jsonl')
+    checkpoint = mg.ScanCheckpoint(path)
+    checkpoint.open({'target': 'first'})
+    checkpoint.close()
+    checkpoint.open({'target': 'second'}, resume=True)
+    checkpoint.write_session_done('s')
+    checkpoint.close()
+
+    state = mg.ScanCheckpoint(path).load()
+    assert state['meta']['target'] == 'first'
+    assert state['sessions']['s']['done']
@@ -0,0 +1,53 @@
+OUTPUT = """[SSRF]
+mutation { importPaste(host: "x.oast.fun", port: 80, path: "/") { __typename } }
+
+[RCE]
+mutation {
+  systemDiagnostics(cmd: "id") { __typename }
+}
+[SQLi]
+query { user(id: "1' OR '1'='1") { __typename } }
+"""
+
+
+def test_text_parser_matches_whole_output_parse(mg):
+    payloads = mg.parse_payloads(OUTPUT)
+    assert [p['type'] for p in payloads] == ['SSRF', 'RCE', 'SQLi']
+    assert payloads[1]['payload'] == 'mutation {\nsystemDiagnostics(cmd: "id") { __typename }\n}'
+
+
+def test_text_parser_emits_blocks_as_soon_as_they_end(mg):
+    parser = mg.IncrementalPayloadParser()
+    emitted = []
+    for i in range(0, len(OUTPUT), 7):
+        emitted.append(parser.feed(OUTPUT[i:i + 7]))
+    emitted.append(parser.close())
+    flat = [p for batch in emitted for p in batch]
+    assert flat == mg.parse_payloads(OUTPUT)
+    # 第一个 Payload 在空行到达时就已返回，不必等输出结束
+    first = next(i for i, batch in enumerate(emitted) if batch)
+    assert first < len(emitted) - 2
+
+
+def test_text_parser_ignores_prose(mg):
+    assert mg.parse_payloads('以下是测试 Payload：\n\n没有更多内容') == []
+
+
+def test_json_parser_emits_closed_objects_and_skips_invalid(mg):
+    text = ('{"payloads": [{"type": "RCE", "payload": "mutation { a(cmd: \\"}{\\") { __typename } }", '
+            '"variables": {"x": 1}}, {"type": "XSS", "payload": "not graphql"}, '
+            '{"type": "[IDOR]", "payload": "{ user(id: 2) { __typename } }"}]}')
+    parser = mg.IncrementalJSONPayloadParser()
+    split = text.index('}}, ') + 2  # 第一个对象刚好闭合
+    first = parser.feed(text[:split])
+    rest = parser.feed(text[split:]) + parser.close()
+    payloads = first + rest
+    assert [p['type'] for p in payloads] == ['RCE', 'IDOR']
+    assert payloads[0]['variables'] == {'x': 1}
+    assert len(first) == 1
+
+
+def test_json_parser_falls_back_to_text_output(mg):
+    parser = mg.IncrementalJSONPayloadParser()
+    payloads = parser.feed(OUTPUT) + parser.close()
+    assert [p['type'] for p in payloads] == ['SSRF', 'RCE', 'SQLi']
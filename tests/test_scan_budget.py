@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.mark.parametrize('spec, seconds', [
+    ('1200', 1200), ('90s', 90), ('20m', 1200), ('1.5h', 5400), (' 2M ', 120),
+])
+def test_parse_duration(mg, spec, seconds):
+    assert mg.parse_duration(spec) == seconds
+
+
+@pytest.mark.parametrize('spec', ['', '5x', '-3m', '1h30m', None])
+def test_parse_duration_rejects_invalid(mg, spec):
+    with pytest.raises(ValueError):
+        mg.parse_duration(spec)
+
+
+def spend(budget, phase, count):
+    budget.phase = phase
+    for _ in range(count):
+        assert budget.allow(phase)
+        assert budget.take_request()
+
+
+def test_disabled_budget_allows_everything(mg):
+    budget = mg.ScanBudget()
+    assert not budget.enabled
+    assert budget.allow('discovery', 10 ** 6, 10 ** 6)
+    assert budget.take_request()
+
+
+def test_request_shares_follow_phase_weights(mg):
+    budget = mg.ScanBudget()
+    budget.configure(request_budget=100)
+    spend(budget, 'discovery', 5)
+    assert not budget.allow('discovery')
+
+
+def test_unused_share_flows_to_later_phases(mg):
+    budget = mg.ScanBudget()
+    budget.configure(request_budget=100)
+    spend(budget, 'discovery', 1)
+    budget.end('discovery')
+    budget.end('introspection')
+    budget.end('baseline')
+    # 剩余 99 个请求在 Fuzzing 阶段之间分配，llm_rounds 还能借用 verification 的空闲份额
+    request_share, _ = budget._allocation('llm_rounds')
+    assert request_share > 99 * 0.5 / 0.8
+
+
+def test_take_request_stops_at_total(mg):
+    budget = mg.ScanBudget()
+    budget.configure(request_budget=3)
+    budget.phase = 'llm_rounds'
+    assert [budget.take_request() for _ in range(4)] == [True, True, True, False]
+    assert budget.stopped == 'requests'
+    assert budget.deadline_reached()
@@ -0,0 +1,36 @@
+import json
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def fingerprint(mg, status, body):
+    return mg.simhash(mg.response_features(status, json.dumps(body)))
+
+
+def test_echoed_values_do_not_change_the_fingerprint(mg):
+    a = fingerprint(mg, 200, {'data': {'user': {'id': '1', 'name': 'alice'}}})
+    b = fingerprint(mg, 200, {'data': {'user': {'id': '2', 'name': 'bob'}}})
+    assert distance(a, b) == 0
+
+
+def test_similar_responses_are_closer_than_different_ones(mg):
+    base = {'data': {'user': {'id': '1', 'name': 'a', 'email': 'x', 'role': 'user'}}}
+    similar = {'data': {'user': {'id': '1', 'name': 'a', 'email': 'x', 'role': 'user', 'age': 3}}}
+    error = {'errors': [{'message': 'Cannot query field "token" on type "User"'}], 'data': None}
+    near = distance(fingerprint(mg, 200, base), fingerprint(mg, 200, similar))
+    far = distance(fingerprint(mg, 200, base), fingerprint(mg, 400, error))
+    assert near < far
+    assert far > 3
+
+
+def test_clusterer_groups_by_distance(mg):
+    clusterer = mg.ResponseClusterer(max_distance=3)
+    result = {'type': 'SQLi', 'payload': '{ user(id: 1) { name } }', 'status_code': 200}
+    first, created = clusterer.assign(dict(result), json.dumps({'data': {'user': {'name': 'a'}}}))
+    assert created
+    second, created = clusterer.assign(dict(result), json.dumps({'data': {'user': {'name': 'b'}}}))
+    assert not created and second is first
+    _, created = clusterer.assign(dict(result), json.dumps({'errors': [{'message': 'syntax error'}]}))
+    assert created
@@ -0,0 +1,49 @@
+import re
+
+import pytest
+
+
+def test_fit_linear_delay(mg):
+    correlation, slope = mg.TimingVerifier._fit([(0, 0.2), (2, 2.2), (5, 5.2)])
+    assert correlation == pytest.approx(1.0)
+    assert slope == pytest.approx(1.0)
+
+
+def test_fit_flat_or_noisy_latency(mg):
+    assert mg.TimingVerifier._fit([(0, 3.0), (2, 3.0), (5, 3.0)]) == (0.0, 0.0)
+    correlation, slope = mg.TimingVerifier._fit([(0, 4.0), (2, 0.5), (5, 4.5)])
+    assert correlation < mg.TimingVerifier.MIN_CORRELATION or slope < mg.TimingVerifier.MIN_SLOPE
+
+
+def test_fit_requires_slope_not_just_correlation(mg):
+    # 延迟随注入值增长但增幅太小（目标只是偶尔变慢）
+    correlation, slope = mg.TimingVerifier._fit([(0, 1.0), (2, 1.4), (5, 2.0)])
+    assert correlation > 0.9
+    assert slope < mg.TimingVerifier.MIN_SLOPE
+
+
+def probe_verifier(mg, latency):
+    """用固定的延迟模型代替真实请求"""
+    verifier = mg.TimingVerifier('http://127.0.0.1:9/graphql', samples=2)
+    sent = []
+
+    def measure(payload, variables, timeout):
+        seconds = int(re.search(r'sleep (\d+)', payload).group(1))
+        sent.append(seconds)
+        return latency(seconds)
+
+    verifier._measure = measure
+    return verifier, sent
+
+
+def test_confirm_delay_probes_each_delay_value(mg):
+    payload = 'mutation { systemDiagnostics(cmd: "sleep 4") { __typename } }'
+    delay = mg.find_delay_parameter(payload)
+    verifier, sent = probe_verifier(mg, lambda s: s + 0.1)
+    check = verifier._confirm_delay(payload, None, delay)
+    assert check['confirmed']
+    assert sorted(set(sent)) == [0, 2, 4]
+    assert len(sent) == 6
+
+    verifier, _ = probe_verifier(mg, lambda s: 5.0)
+    assert not verifier._confirm_delay(payload, None, delay)['confirmed']